@@ -0,0 +1,147 @@
+# ~ stolas/aio.py: Asyncio Module ~
+#
+#  This module holds the asyncio side of Stolas : the protocol serving the
+#   peers of a UnisocketModel running the "asyncio" engine, and an async
+#   facade around `stolas.Stolas` objects for coroutine based programs.
+#
+
+import asyncio		# `asyncio.BufferedProtocol`, `asyncio.Queue`, `asyncio.get_running_loop`
+import socket		# `socket.socket`
+
+from .stolas import Stolas
+
+class PeerProtocol(asyncio.BufferedProtocol):
+	"""Protocol serving one Peer of a UnisocketModel on its event loop. Data
+	is received straight into the peer's input buffer."""
+	def __init__(self, model, peer):
+		"""Initialization requires the UnisocketModel and the Peer served."""
+		self.model = model
+		self.peer = peer
+		self.view = None
+
+	def connection_made(self, transport):
+		self.peer.transport = transport
+		# Whatever was queued before we got attached goes out now
+		self.model._aio_flush(self.peer)
+
+	def get_buffer(self, sizehint):
+		iqueue = self.peer.iqueue
+		if iqueue == None:
+			# We're being deleted, what comes in is dropped
+			return bytearray(max(sizehint, 2**16))
+		self.view = iqueue.reserve()
+		return self.view
+
+	def buffer_updated(self, nbytes):
+		view, self.view = self.view, None
+		if view == None:
+			return
+		view.release()
+		self.model.peer_lock(self.peer.pid)
+		# No iqueue means we're being deleted; no need to parse
+		delay = 0
+		if self.peer.iqueue != None:
+			delay = self.model._peer_received(self.peer, nbytes)
+		self.model.peer_unlock(self.peer.pid)
+		if delay > 0:
+			self.model._aio_flush(self.peer) # Pauses reading
+
+	def pause_writing(self):
+		# The transport is full : output now stays in the peer's buffer, where
+		# the backpressure policy applies
+		self.peer.paused = True
+
+	def resume_writing(self):
+		self.peer.paused = False
+		self.model._aio_flush(self.peer)
+
+	def eof_received(self):
+		self.model.logger.warning("Connection Closed by Peer %s", self.peer.pid)
+		return False # Let the transport close itself
+
+	def connection_lost(self, exc):
+		if exc != None:
+			self.model.logger.warning("Connection with Peer %s lost (%s)", self.peer.pid, type(exc))
+		self.peer.running = False
+		self.model._peer_close(self.peer)
+
+def attach_peer(model, peer):
+	"""Wrap a freshly registered peer's socket in a PeerProtocol. Must be
+	called on the model's event loop."""
+	def attached(task):
+		if task.cancelled() or task.exception() != None:
+			peer.running = False
+			model._peer_close(peer)
+
+	task = model.loop.create_task(model.loop.connect_accepted_socket(
+		lambda: PeerProtocol(model, peer),
+		sock = peer.sock
+	))
+	task.add_done_callback(attached)
+
+class AsyncStolas:
+	"""Async facade around a Stolas object whose networker runs on the
+	current event loop. Incoming messages are obtained with `async for`."""
+	def __init__(self, **kwargs):
+		"""Takes the same keyword arguments as `stolas.Stolas`."""
+		self.kwargs = kwargs
+		self.stolas = None
+		self.loop = None
+		self.__messages = None
+
+	def __repr__(self):
+		return "AsyncStolas({0})".format(self.stolas)
+
+	def __getattr__(self, name):
+		# Everything we don't wrap is the Stolas object's
+		if self.stolas == None:
+			raise AttributeError(name)
+		return getattr(self.stolas, name)
+
+	async def start(self):
+		"""Create and start the Stolas object on the running event loop."""
+		self.loop = asyncio.get_running_loop()
+		self.__messages = asyncio.Queue()
+		kwargs = dict(self.kwargs, engine = "asyncio", loop = self.loop)
+		# Creating the Inbox and binding the listen socket may hit the disk
+		self.stolas = await self.loop.run_in_executor(None, lambda: Stolas(**kwargs))
+		self.stolas.on_new_message_callbacks.append(self.__on_new_message)
+		self.stolas.start()
+
+	def __on_new_message(self, msgobj):
+		"""Internal. Called from the CPU thread with every new message."""
+		self.loop.call_soon_threadsafe(self.__messages.put_nowait, msgobj)
+
+	async def connect(self, host, port):
+		"""Connect to a peer without blocking the loop. Returns the new peer
+		ID, or False."""
+		verbinfo = (host, port)
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.setblocking(False)
+		try:
+			await self.loop.sock_connect(sock, verbinfo)
+		except OSError as e:
+			self.stolas.networker.logger.warning("Will not add new Peer : couldn't connect to %s (%s)", verbinfo, type(e))
+			sock.close()
+			return False
+		# Adding the peer takes the peer lock, which threads hold too
+		return await self.loop.run_in_executor(None, lambda: self.stolas.networker.peer_add(verbinfo, sock, outbound = True))
+
+	async def send_message(self, channel, payload, ttl = 120):
+		"""Send a message. Compression is done off the loop."""
+		return await self.loop.run_in_executor(None, self.stolas.send_message, channel, payload, ttl)
+
+	async def stop(self):
+		"""Stop the Stolas object and wait for it to be done."""
+		self.stolas.stop()
+		await self.loop.run_in_executor(None, self.stolas.join)
+		self.__messages.put_nowait(None)
+
+	def __aiter__(self):
+		return self
+
+	async def __anext__(self):
+		msgobj = await self.__messages.get()
+		if msgobj == None:
+			raise StopAsyncIteration
+		return msgobj
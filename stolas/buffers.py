@@ -0,0 +1,204 @@
+# ~ stolas/buffers.py: Peer Buffers Module ~
+#
+#  This module defines the output buffer of the peers : a queue of outgoing
+#   frames flushed with scatter-gather writes, with high and low water marks
+#   telling when the peer cannot keep up with what we send, a priority lane
+#   for the frames that should not wait behind the others, and a coalescing
+#   window for small frames.
+#
+
+import collections	# `collections.deque`
+import itertools	# `itertools.islice`
+import socket		# `socket.socket.sendmsg`
+import threading	# `threading.Lock`
+import time			# `time.monotonic`
+
+# Maximum amount of segments handed over in one `sendmsg` call (IOV_MAX is
+#  at least 1024 on the systems we run on)
+MAX_SEGMENTS = 1024
+# `sendmsg` is not available everywhere (i.e. Windows)
+HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+class OutputBuffer:
+	"""Output buffer of a peer.
+	Frames are queued as they are, without being copied or concatenated, so
+	that a frame broadcast to every peer is the same bytes object in all of
+	their buffers. Flushing keeps track of partial writes.
+	The buffer becomes congested once it goes over its high water mark, and
+	stays so until it drains down to its low water mark. Both marks are
+	(bytes, frames) tuples ; without a high water mark, the buffer is
+	never congested.
+	Urgent frames are queued ahead of the others, in their order, but after
+	the frames already being written.
+	With a (seconds, bytes) coalescing window, frames shorter than that many
+	bytes are held back for up to that many seconds, so that they go out
+	together, unless that many bytes are pending or a longer frame comes."""
+	def __init__(self, high_water = None, low_water = None, coalesce = None):
+		"""Initialization optionally takes the high and low water marks, and
+		the coalescing window. The low water mark defaults to half the high
+		water mark."""
+		self.frames = collections.deque()
+		self.offset = 0 # Bytes of the first frame already sent
+		self.size = 0 # Bytes pending
+		self.completed = 0 # Frames sent (or taken) so far
+		self.lead = 0 # Frames at the head that urgent frames are queued after
+		self.pinned = 0 # Frames being written by `flush`
+		self.writes = 0 # Calls writing out frames so far
+		self.coalesce = coalesce
+		self.deadline = None # Until when the pending frames are held back
+		self.lock = threading.Lock()
+		self.drained = threading.Condition(self.lock)
+
+		self.high_water = high_water
+		if low_water == None and high_water != None:
+			low_water = (high_water[0] // 2, high_water[1] // 2)
+		self.low_water = low_water
+		self.__congested = False
+
+	def __len__(self):
+		"""Gives the amount of bytes pending."""
+		return self.size
+
+	def __repr__(self):
+		return "OutputBuffer(frames={0}, pending={1})".format(len(self.frames), self.size)
+
+	def append(self, frame, urgent = False):
+		"""Queue a frame (a bytes-like object), ahead of the frames that
+		aren't `urgent` if it is. Can be called from any thread. Returns
+		False if the frame joined others held back, so that nothing changed
+		for whoever flushes the buffer."""
+		if len(frame) == 0:
+			return False
+		self.lock.acquire()
+		wake = True
+		if self.coalesce != None:
+			window, size = self.coalesce
+			if len(frame) >= size or self.size + len(frame) >= size:
+				self.deadline = 0 # Go now
+			elif self.deadline == None:
+				self.deadline = time.monotonic() + window
+			else:
+				wake = False
+		if urgent:
+			index = max(self.lead, self.pinned, 1 if self.offset > 0 else 0)
+			self.frames.insert(index, frame)
+			self.lead = index + 1
+		else:
+			self.frames.append(frame)
+		self.size += len(frame)
+		self.lock.release()
+		return wake
+
+	def holding(self):
+		"""Time left before the frames held back by the coalescing window
+		should be written (0 if they should be now)."""
+		deadline = self.deadline
+		if not deadline:
+			return 0
+		return max(0, deadline - time.monotonic())
+
+	def __popped(self, count):
+		"""Internal. Account for `count` frames gone from the head. The lock
+		must be held."""
+		self.completed += count
+		self.lead = max(0, self.lead - count)
+		self.pinned = 0
+		if self.size == 0:
+			self.deadline = None
+
+	def flush(self, sock):
+		"""Write as much as possible of the pending frames to a socket in a
+		single call. Returns the amount of bytes written. Socket errors are
+		left to the caller."""
+		self.lock.acquire()
+		segments = list(itertools.islice(self.frames, 0, MAX_SEGMENTS))
+		offset = self.offset
+		self.pinned = len(segments)
+		self.lock.release()
+		if len(segments) == 0:
+			return 0
+
+		if offset > 0:
+			segments[0] = memoryview(segments[0])[offset:]
+		try:
+			if HAS_SENDMSG:
+				sent = sock.sendmsg(segments)
+			else:
+				sent = sock.send(segments[0])
+		except OSError:
+			self.lock.acquire()
+			self.pinned = 0
+			self.lock.release()
+			raise
+		self.writes += 1
+		self.consume(sent)
+		return sent
+
+	def consume(self, sent):
+		"""Drop the first `sent` bytes from the buffer."""
+		self.lock.acquire()
+		self.size -= sent
+		sent += self.offset
+		popped = 0
+		while len(self.frames) > 0 and sent >= len(self.frames[0]):
+			sent -= len(self.frames.popleft())
+			popped += 1
+		self.offset = sent
+		self.__popped(popped)
+		self.__update()
+		self.lock.release()
+
+	def take(self, size = None):
+		"""Empty the buffer and return the pending data as a list of segments.
+		With a `size`, only whole frames up to at least `size` bytes are
+		taken."""
+		self.lock.acquire()
+		if size == None:
+			segments = list(self.frames)
+			self.frames.clear()
+			taken = self.size
+		else:
+			segments, taken = [], 0
+			while len(self.frames) > 0 and taken < size:
+				segments.append(self.frames.popleft())
+				taken += len(segments[-1]) - (self.offset if len(segments) == 1 else 0)
+		if self.offset > 0 and len(segments) > 0:
+			segments[0] = memoryview(segments[0])[self.offset:]
+			self.offset = 0
+		self.size -= taken
+		self.__popped(len(segments))
+		self.__update()
+		self.lock.release()
+		return segments
+
+	def clear(self):
+		"""Drop everything pending. Returns the amount of bytes dropped."""
+		return sum([len(segment) for segment in self.take()])
+
+	def congested(self):
+		"""Tells whether or not the buffer is congested."""
+		self.lock.acquire()
+		if not self.__congested and self.high_water != None:
+			hbytes, hframes = self.high_water
+			self.__congested = self.size >= hbytes or len(self.frames) >= hframes
+		congested = self.__congested
+		self.lock.release()
+		return congested
+
+	def __update(self):
+		"""Internal. Lift the congestion once we're down to the low water
+		mark. The lock must be held."""
+		if not self.__congested:
+			return
+		lbytes, lframes = self.low_water
+		if self.size <= lbytes and len(self.frames) <= lframes:
+			self.__congested = False
+			self.drained.notify_all()
+
+	def wait_drained(self, timeout = None):
+		"""Wait for the congestion to be lifted. Returns False if it still
+		isn't after `timeout` seconds."""
+		self.lock.acquire()
+		drained = self.drained.wait_for(lambda: not self.__congested, timeout)
+		self.lock.release()
+		return drained
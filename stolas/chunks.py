@@ -0,0 +1,159 @@
+# ~ stolas/chunks.py: Chunk Reassembly Module ~
+#
+#  This module puts back together the Messages received in CHUNK packets
+#   (see docs/protocol.md). Chunks are written in place in a memory mapped
+#   temporary file per Message, keyed by its unique signature, so that they
+#   can arrive in any order, from any peer. Chunks must be aligned on the
+#   chunk size and fill it (but for the last one), so that a Message is only
+#   complete once every byte of it was written.
+#
+
+import collections	# `collections.OrderedDict`
+import mmap			# `mmap.mmap`
+import tempfile		# `tempfile.TemporaryFile`
+import threading	# `threading.Lock`
+import time			# `time.monotonic`
+
+from .protocol import CHUNK_SIZE
+
+# Amount of reassembled Messages remembered, so that late chunks of them are
+#  not taken for new Messages
+REMEMBERED = 1024
+# Most Messages reassembled at once, and most of them started by one peer.
+#  Each one holds a temporary file and a memory map
+MAX_PENDING = 64
+MAX_PENDING_PER_SOURCE = 8
+
+class ReassemblyLimitError(Exception):
+	"""Raised when a chunk would start a Message beyond what we reassemble at
+	once."""
+	pass
+
+class Reassembly:
+	"""A Message being reassembled, `total` bytes long once imploded, out of
+	chunks of `chunk_size` bytes."""
+	def __init__(self, usig, total, chunk_size = CHUNK_SIZE, relayed = False, owner = None):
+		"""Initialization requires the Message's signature and length, and
+		optionally the size of its chunks, whether they are relayed as they
+		come, and the Peer ID of the peer that sent the first one."""
+		self.usig = usig
+		self.total = total
+		self.chunk_size = chunk_size
+		with tempfile.TemporaryFile() as backing:
+			backing.truncate(total)
+			self.map = mmap.mmap(backing.fileno(), total)
+		self.received = bytearray((total + chunk_size - 1) // chunk_size) # One flag per chunk
+		self.missing = len(self.received)
+		self.sources = set() # Peer IDs we got chunks from
+		self.owner = owner
+		self.relayed = relayed
+		self.stamp = time.monotonic()
+
+	def __repr__(self):
+		return "Reassembly(total={0}, missing={1})".format(self.total, self.missing)
+
+	def write(self, offset, data):
+		"""Write a chunk in place. Returns False if we had it already. Raises
+		ValueError for chunks that are not where chunks go, or not as long."""
+		if offset % self.chunk_size != 0 or len(data) != min(self.chunk_size, self.total - offset):
+			raise ValueError("Chunk does not fit in its message")
+		self.stamp = time.monotonic()
+		index = offset // self.chunk_size
+		if self.received[index]:
+			return False
+		self.map[offset:offset+len(data)] = data
+		self.received[index] = 1
+		self.missing -= 1
+		return True
+
+	def complete(self):
+		return self.missing == 0
+
+	def close(self):
+		self.map.close()
+
+class Reassembler:
+	"""The Messages being reassembled, by signature. Can be fed from any
+	thread."""
+	def __init__(self, chunk_size = CHUNK_SIZE, max_total = None, max_pending = MAX_PENDING, max_per_source = MAX_PENDING_PER_SOURCE):
+		"""Initialization optionally takes the size of the chunks, the length
+		of the longest Message we reassemble, and how many Messages are
+		reassembled at once, overall and per peer starting them."""
+		self.chunk_size = chunk_size
+		self.max_total = max_total
+		self.max_pending = max_pending
+		self.max_per_source = max_per_source
+		self.pending = {}
+		self.owned = collections.Counter() # Pending Messages by Peer ID of their owner
+		self.done = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.pending)
+
+	def __repr__(self):
+		return "Reassembler(pending={0})".format(len(self.pending))
+
+	def feed(self, usig, total, offset, data, source, relay = False):
+		"""Take a chunk of a `total` bytes long Message from peer `source`.
+		A Message seen for the first time is relayed if `relay` is set.
+		Returns the Reassembly (None for Messages reassembled already),
+		whether the chunk was new to us, and whether it completed the Message.
+		Raises ValueError for chunks that do not fit, and ReassemblyLimitError
+		for chunks of new Messages when we reassemble too many already."""
+		if total == 0 or offset % self.chunk_size != 0 or len(data) != min(self.chunk_size, total - offset):
+			raise ValueError("Chunk does not fit in its message")
+		if self.max_total != None and total > self.max_total:
+			raise ValueError("Message is too long")
+		self.lock.acquire()
+		if usig in self.done:
+			self.lock.release()
+			return None, False, False
+		reassembly = self.pending.get(usig, None)
+		if reassembly == None:
+			if len(self.pending) >= self.max_pending or self.owned[source] >= self.max_per_source:
+				self.lock.release()
+				raise ReassemblyLimitError("Too many messages being reassembled")
+			reassembly = self.pending[usig] = Reassembly(usig, total, self.chunk_size, relay, source)
+			self.owned[source] += 1
+		elif reassembly.total != total:
+			self.lock.release()
+			raise ValueError("Chunk does not fit in its message")
+		reassembly.sources.add(source)
+		new = reassembly.write(offset, data)
+		complete = reassembly.complete()
+		if complete:
+			self.__forget(usig)
+			self.done[usig] = True
+			if len(self.done) > REMEMBERED:
+				self.done.popitem(last = False)
+		self.lock.release()
+		return reassembly, new, complete
+
+	def expire(self, timeout):
+		"""Drop the Messages no chunk came for in `timeout` seconds. Returns
+		the amount of Messages dropped."""
+		deadline = time.monotonic() - timeout
+		self.lock.acquire()
+		stale = [usig for usig, reassembly in self.pending.items() if reassembly.stamp < deadline]
+		for usig in stale:
+			self.__forget(usig).close()
+		self.lock.release()
+		return len(stale)
+
+	def __forget(self, usig):
+		"""Internal. Remove a pending Message, and return it. The lock must be
+		held."""
+		reassembly = self.pending.pop(usig)
+		self.owned[reassembly.owner] -= 1
+		if self.owned[reassembly.owner] <= 0:
+			del self.owned[reassembly.owner]
+		return reassembly
+
+	def clear(self):
+		self.lock.acquire()
+		for reassembly in self.pending.values():
+			reassembly.close()
+		self.pending.clear()
+		self.owned.clear()
+		self.lock.release()
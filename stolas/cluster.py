@@ -0,0 +1,166 @@
+# ~ stolas/cluster.py: Cluster Module ~
+#
+#  This module holds what several Stolas processes serving the same port
+#   (with `SO_REUSEPORT`) share : the record of the messages any of them has
+#   already seen, so that a message is only ever logged and gossiped by one
+#   of them. The record lives in a manager process ; each process claims
+#   messages in batches, from a thread of its own, so that its workers never
+#   wait on the manager.
+#
+
+import multiprocessing.managers	# `multiprocessing.managers.BaseManager`
+import itertools		# `itertools.count`
+import os				# `os.getpid`
+import queue			# `queue.Queue`, `queue.Empty`
+import threading		# `threading.Lock`, `threading.Thread`
+import time				# `time.time`
+
+from .utils import PhantomLogger
+
+# Most claims sent to the manager at once
+CLAIM_BATCH = 256
+
+class ClaimRegistry:
+	"""Record of the messages seen by a cluster, kept by the manager process,
+	whose threads serve the processes' calls concurrently."""
+	def __init__(self):
+		self.claims = {} # Signature -> (token, expiry)
+		self.lock = threading.Lock()
+
+	def size(self):
+		return len(self.claims)
+
+	def claim_many(self, claims):
+		"""Claim (signature, token, expiry) tuples. Returns, for each of them,
+		whether its token got in first."""
+		self.lock.acquire()
+		won = [self.claims.setdefault(usig, (token, expiry))[0] == token for usig, token, expiry in claims]
+		self.lock.release()
+		return won
+
+	def vacuum(self, now):
+		"""Forget the claims on messages dead at `now`. Returns the amount of
+		claims forgotten."""
+		self.lock.acquire()
+		dead = [usig for usig, (token, expiry) in self.claims.items() if expiry <= now]
+		for usig in dead:
+			del self.claims[usig]
+		self.lock.release()
+		return len(dead)
+
+class ClusterManager(multiprocessing.managers.BaseManager):
+	"""Manager process of a cluster."""
+	pass
+
+ClusterManager.register("ClaimRegistry", ClaimRegistry)
+
+class SharedClaims:
+	"""Client side of the record of messages seen by a cluster of processes.
+	Built around a ClaimRegistry proxy, it can be handed to processes started
+	afterwards. Message signatures are claimed by the first process to see
+	them, until the message dies."""
+	def __init__(self, shared):
+		"""Initialization requires the proxy of the ClaimRegistry."""
+		self.shared = shared
+		self.__tokens = None
+		self.__owner = None
+
+	def __repr__(self):
+		return "SharedClaims(claims={0})".format(len(self))
+
+	def __len__(self):
+		return self.shared.size()
+
+	def __getstate__(self):
+		return {"shared": self.shared}
+
+	def __setstate__(self, state):
+		self.__init__(state["shared"])
+
+	def __token(self):
+		"""Internal. Returns a token unique to this claim, in this process."""
+		if self.__owner != os.getpid():
+			self.__owner = os.getpid()
+			self.__tokens = itertools.count()
+		return (self.__owner, next(self.__tokens))
+
+	def claim_many(self, claims):
+		"""Claim (signature, expiry timestamp) tuples, with a single call to
+		the manager. Returns, for each of them, True if no other process of
+		the cluster has claimed it before."""
+		return self.shared.claim_many([(usig, self.__token(), expiry) for usig, expiry in claims])
+
+	def claim(self, usig, expiry):
+		"""Claim a message signature until the `expiry` timestamp. Returns
+		True if no other process of the cluster has claimed it before."""
+		return self.claim_many([(usig, expiry)])[0]
+
+	def vacuum(self):
+		"""Forget the claims on messages that are dead. Returns the amount of
+		claims forgotten."""
+		return self.shared.vacuum(time.time())
+
+class Claimer:
+	"""Claims messages for a process, in batches, from a thread of its own.
+	Outcomes are handed to `on_claimed(won, *args)`, on that thread. Claims
+	submitted while a batch is with the manager go in the next one."""
+	def __init__(self, claims, on_claimed, name = "", logger = None):
+		"""Initialization requires the SharedClaims and the callable told of
+		the outcomes, and optionally a thread name suffix and a logger for the
+		callable's failures."""
+		self.claims = claims
+		self.on_claimed = on_claimed
+		self.logger = logger or PhantomLogger()
+		self.queue = queue.Queue()
+		self.thread = threading.Thread(target = self.__claimer_loop, name = "Claimer" + name)
+
+	def __repr__(self):
+		return "Claimer(pending={0})".format(self.queue.qsize())
+
+	def start(self):
+		self.thread.start()
+
+	def stop(self):
+		"""Stop once what was submitted is claimed."""
+		self.queue.put(None)
+
+	def join(self):
+		if self.thread.is_alive():
+			self.thread.join()
+
+	def submit(self, usig, expiry, *args):
+		"""Claim a message signature until `expiry`. Can be called from any
+		thread."""
+		self.queue.put((usig, expiry, args))
+
+	def __claimer_loop(self):
+		"""Internal. Claim whatever was submitted, batch after batch."""
+		running = True
+		while running:
+			batch = [self.queue.get()]
+			try:
+				while len(batch) < CLAIM_BATCH:
+					batch.append(self.queue.get_nowait())
+			except queue.Empty:
+				pass
+			running = not None in batch
+			batch = [item for item in batch if item != None]
+			if len(batch) == 0:
+				continue
+			try:
+				outcomes = self.claims.claim_many([(usig, expiry) for usig, expiry, args in batch])
+			except (OSError, EOFError) as err: # The manager is gone
+				self.logger.error("Could not claim %s messages : %s", len(batch), err)
+				continue
+			for (usig, expiry, args), won in zip(batch, outcomes):
+				try:
+					self.on_claimed(won, *args)
+				except Exception:
+					self.logger.exception("Failed to handle the claim of %s", usig)
+
+def shared_claims():
+	"""Start a manager process and return the SharedClaims on its registry,
+	along with the manager (which must be shut down in the end)."""
+	manager = ClusterManager()
+	manager.start()
+	return SharedClaims(manager.ClaimRegistry()), manager
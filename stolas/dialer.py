@@ -0,0 +1,185 @@
+# ~ stolas/dialer.py: Outbound Connections Module ~
+#
+#  This module defines the outbound connection manager of the UnisocketModel,
+#   which dials peers with non blocking connects so that no other part of
+#   the model ever waits for the network to answer.
+#
+
+import errno		# `errno.EINPROGRESS`, `errno.EWOULDBLOCK`
+import selectors	# `selectors.DefaultSelector`, `selectors.EVENT_WRITE`
+import socket		# `socket.socket`, `socket.socketpair`
+import threading	# `threading.Thread`, `threading.Lock`
+import time			# `time.monotonic`
+
+# Connection attempts taking longer than this (in seconds) are given up
+CONNECT_TIMEOUT = 5
+# Codes telling that a non blocking connect is on its way
+CONNECTING = (errno.EINPROGRESS, errno.EWOULDBLOCK, getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK))
+
+class Dialer:
+	"""Outbound connection manager.
+	Candidates are dialed in parallel by a single thread, each with its own
+	deadline. Established sockets are handed over to `on_connect(verbinfo,
+	sock, elapsed)`, and failures reported to `on_failure(verbinfo, error)`."""
+	def __init__(self, on_connect, on_failure = None, timeout = CONNECT_TIMEOUT, name = "", prepare = None):
+		"""Initialization requires the connection callback and, optionally,
+		the failure callback, the connect timeout, a thread name suffix and a
+		callable setting the options of new sockets before they connect."""
+		self.on_connect = on_connect
+		self.on_failure = on_failure
+		self.prepare = prepare
+		self.timeout = timeout
+		self.running = False
+
+		self.pending = {} # verbinfo -> (sock, start, deadline)
+		self.__requests = []
+		self.__lock = threading.Lock()
+		self.selector = selectors.DefaultSelector()
+		self.__wakeup_r, self.__wakeup_w = socket.socketpair()
+		self.__wakeup_r.setblocking(False)
+		self.__wakeup_w.setblocking(False)
+		self.selector.register(self.__wakeup_r, selectors.EVENT_READ)
+
+		self.thread = threading.Thread(
+			target = self.__dialer_loop,
+			name = "Dialer" + name
+		)
+
+	def __repr__(self):
+		return "Dialer(pending={0})".format(len(self.pending))
+
+	def __len__(self):
+		"""Gives the amount of connection attempts on their way."""
+		self.__lock.acquire()
+		ln = len(self.pending) + len(self.__requests)
+		self.__lock.release()
+		return ln
+
+	def start(self):
+		self.running = True
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+		self.__wakeup()
+
+	def join(self):
+		if self.thread.is_alive():
+			self.thread.join()
+
+	def dial(self, verbinfo):
+		"""Start dialing a candidate. Returns False if it is already being
+		dialed. Can be called from any thread."""
+		self.__lock.acquire()
+		if self.__is_dialing(verbinfo) or not self.running:
+			self.__lock.release()
+			return False
+		self.__requests.append(verbinfo)
+		self.__lock.release()
+		self.__wakeup()
+		return True
+
+	def dialing(self, verbinfo):
+		"""Tells whether or not a candidate is being dialed."""
+		self.__lock.acquire()
+		dialing = self.__is_dialing(verbinfo)
+		self.__lock.release()
+		return dialing
+
+	def __is_dialing(self, verbinfo):
+		"""Internal. The lock must be held."""
+		return verbinfo in self.pending or verbinfo in self.__requests
+
+	def __wakeup(self):
+		try:
+			self.__wakeup_w.send(b"\0")
+		except (BlockingIOError, OSError):
+			pass # Already awake, or already gone
+
+	def __dialer_loop(self):
+		"""Internal. Start the requested connections and wait for them to
+		complete or time out."""
+		while self.running:
+			self.__lock.acquire()
+			requests = list(self.__requests)
+			self.__lock.release()
+			for verbinfo in requests:
+				self.__connect(verbinfo)
+
+			timeout = None
+			if len(self.pending) > 0:
+				timeout = max(0, min([deadline for sock, start, deadline in self.pending.values()]) - time.monotonic())
+
+			for key, events in self.selector.select(timeout = timeout):
+				if key.fileobj is self.__wakeup_r:
+					try:
+						while self.__wakeup_r.recv(1024):
+							pass
+					except BlockingIOError:
+						pass
+				else:
+					self.__connected(key.data)
+
+			now = time.monotonic()
+			for verbinfo in [verbinfo for verbinfo in self.pending if self.pending[verbinfo][2] <= now]:
+				self.__fail(verbinfo, TimeoutError("Connection timed out"))
+
+		for verbinfo in list(self.pending.keys()):
+			self.__fail(verbinfo, ConnectionAbortedError("Dialer stopped"))
+		self.selector.close()
+		self.__wakeup_r.close()
+		self.__wakeup_w.close()
+
+	def __connect(self, verbinfo):
+		"""Internal. Start a non blocking connection attempt."""
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.setblocking(False)
+		if self.prepare != None:
+			self.prepare(sock)
+		start = time.monotonic()
+		try:
+			code = sock.connect_ex(verbinfo)
+		except OSError as e: # i.e. the address cannot be resolved
+			code = e
+
+		self.__lock.acquire()
+		self.__requests.remove(verbinfo)
+		self.pending[verbinfo] = (sock, start, start + self.timeout)
+		self.__lock.release()
+
+		if code == 0:
+			self.__connected(verbinfo)
+		elif code in CONNECTING:
+			self.selector.register(sock, selectors.EVENT_WRITE, verbinfo)
+		else:
+			self.__fail(verbinfo, code if isinstance(code, OSError) else OSError(code, errno.errorcode.get(code, "")))
+
+	def __connected(self, verbinfo):
+		"""Internal. A socket became writable : the connection either
+		succeeded or failed."""
+		sock, start, deadline = self.pending[verbinfo]
+		code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+		if code != 0:
+			self.__fail(verbinfo, OSError(code, errno.errorcode.get(code, "")))
+			return
+
+		self.__forget(verbinfo)
+		self.on_connect(verbinfo, sock, time.monotonic() - start)
+
+	def __fail(self, verbinfo, error):
+		"""Internal. Give a connection attempt up."""
+		sock, start, deadline = self.pending[verbinfo]
+		self.__forget(verbinfo)
+		sock.close()
+		if self.on_failure != None:
+			self.on_failure(verbinfo, error)
+
+	def __forget(self, verbinfo):
+		"""Internal. Stop tracking a connection attempt."""
+		try:
+			self.selector.unregister(self.pending[verbinfo][0])
+		except (KeyError, ValueError):
+			pass
+		self.__lock.acquire()
+		del self.pending[verbinfo]
+		self.__lock.release()
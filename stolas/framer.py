@@ -0,0 +1,262 @@
+# ~ stolas/framer.py: Packet Framing Module ~
+#
+#  This module slices the byte stream received from a peer into the packets
+#   of the lower protocol (see docs/protocol.md), following the framing
+#   rules of `stolas.protocol`.
+#
+
+import tempfile		# `tempfile.TemporaryFile`
+
+from .protocol import PACKET_FRAMING, DEATH_SEQUENCE
+from .utils import b2i
+
+# Default smallest read, and largest one
+READ_SIZE = 2**16
+MAX_READ = 2**22
+# Buffers that grew over this many reads' worth are dropped once empty
+RETAINED = 4
+
+class FramingError(ValueError):
+	"""Raised when the input stream cannot be sliced into packets. The
+	offending data is discarded, and its length kept in `discarded`."""
+	def __init__(self, discarded):
+		super().__init__("Malformed data : {0} bytes discarded".format(discarded))
+		self.discarded = discarded
+
+class SpilledFrame:
+	"""Packet too large to be kept in memory, spilled to a temporary file as
+	it arrived. It can be indexed and sliced like bytes, reading from the
+	file, and `open` gives the file itself to stream the packet."""
+	def __init__(self, length):
+		"""Initialization requires the length of the packet."""
+		self.length = length
+		self.file = tempfile.TemporaryFile()
+
+	def __len__(self):
+		return self.length
+
+	def __repr__(self):
+		return "SpilledFrame(length={0})".format(self.length)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			start, stop, step = index.indices(self.length)
+			self.file.seek(start)
+			return self.file.read(max(0, stop - start))[::step]
+		if index < 0:
+			index += self.length
+		if not 0 <= index < self.length:
+			raise IndexError("SpilledFrame index out of range")
+		self.file.seek(index)
+		return self.file.read(1)[0]
+
+	def write(self, data):
+		self.file.write(data)
+
+	def open(self, offset = 0):
+		"""Returns the file holding the packet, positioned at `offset`."""
+		self.file.seek(offset)
+		return self.file
+
+	def close(self):
+		self.file.close()
+
+class Framer:
+	"""Incremental packet framer.
+	Data is received straight into a buffer with room to spare (see
+	`reserve`), which is consumed through a read cursor and reused from one
+	read to the next, so that a packet arriving in many pieces is never
+	copied again until it is complete. Reads are sized after the packet
+	being received, and the buffer grows to fit it. Packets longer than
+	`max_frame` are dropped as malformed as soon as their length is known,
+	and packets at least `spill` bytes long are written to a temporary file
+	rather than buffered."""
+	def __init__(self, rules = PACKET_FRAMING, death_sequence = DEATH_SEQUENCE, max_frame = None, spill = None, read_size = READ_SIZE):
+		"""Initialization optionally takes the framing rules, the Death
+		Sequence to recognize, the longest packet allowed, the length from
+		which packets are spilled to disk and the smallest read."""
+		self.rules = rules
+		self.death_sequence = death_sequence
+		self.max_frame = max_frame
+		self.spill = spill
+		self.read_size = read_size
+		self.buffer = bytearray()
+		self.cursor = 0
+		self.end = 0 # End of the data, the rest of the buffer is free
+		# Bytes of the packet at the head of the stream that are still to come,
+		# and where they go (a SpilledFrame, or None to drop them)
+		self.remaining = 0
+		self.spilled = None
+		# Buffers allocated, reads and bytes received so far
+		self.allocations = 0
+		self.reads = 0
+		self.received = 0
+		self.typical = 0 # Running average of the length of large packets
+
+	def __len__(self):
+		"""Gives the amount of buffered bytes not yet sliced."""
+		return self.end - self.cursor
+
+	def __repr__(self):
+		return "Framer(pending={0}, capacity={1})".format(len(self), len(self.buffer))
+
+	def reserve(self, size = None):
+		"""Returns a writable memoryview on the free end of the buffer, to
+		receive at most `size` bytes into. By default, it is large enough
+		for the rest of the packet being received, and at least `read_size`.
+		The view must be released, and what was received in it committed."""
+		if size == None:
+			size = self.__wanted()
+		if len(self.buffer) - self.end < size:
+			self.__make_room(size)
+		return memoryview(self.buffer)[self.end:self.end+size]
+
+	def commit(self, size):
+		"""Account for `size` bytes received in the view given by `reserve`."""
+		self.reads += 1
+		self.received += size
+		if self.remaining > 0:
+			# The rest of a packet being spilled or dropped
+			head = min(size, self.remaining)
+			with memoryview(self.buffer) as view:
+				if self.spilled != None:
+					self.spilled.write(view[self.end:self.end+head])
+				view[self.end:self.end+size-head] = view[self.end+head:self.end+size]
+			self.remaining -= head
+			size -= head
+		self.end += size
+
+	def feed(self, data):
+		"""Append received data to the buffer."""
+		with self.reserve(len(data)) as view:
+			view[:] = data
+		self.commit(len(data))
+
+	def __wanted(self):
+		"""Internal. Size of the next read : the rest of the packet being
+		received if we know it, bounded by MAX_READ. The rest of a packet
+		being spilled or dropped only goes through the buffer on its way, so
+		it is read `read_size` bytes at a time."""
+		if self.remaining > 0:
+			return self.read_size
+		wanted = 0
+		if len(self) > 0 and self.buffer[self.cursor] in self.rules:
+			length = self.frame_length()
+			if length != None and (self.spill == None or length < self.spill):
+				wanted = length - len(self)
+		return max(self.read_size, min(wanted, MAX_READ))
+
+	def __make_room(self, size):
+		"""Internal. Make room for `size` more bytes, moving the pending data
+		to the front of the buffer, or to a larger one."""
+		pending = len(self)
+		if len(self.buffer) - pending >= size:
+			self.buffer[:pending] = self.buffer[self.cursor:self.end]
+		else:
+			buffer = bytearray(pending + size)
+			buffer[:pending] = self.buffer[self.cursor:self.end]
+			self.buffer = buffer
+			self.allocations += 1
+		self.cursor = 0
+		self.end = pending
+
+	def frame_length(self):
+		"""Returns the length of the packet at the head of the buffer, or None
+		if not enough of it arrived to tell. Raises FramingError for unknown
+		headers."""
+		if len(self) == 0:
+			return None
+
+		rule = self.rules.get(self.buffer[self.cursor], None)
+		if rule == None:
+			return self.__death_length()
+
+		length, field = rule
+		if field != None:
+			offset, size = field
+			if len(self) < offset + size:
+				return None
+			start = self.cursor + offset
+			length += b2i(self.buffer[start:start+size])
+		return length
+
+	def __death_length(self):
+		"""Internal. The Death Sequence is the only unruled packet we know of."""
+		pending = min(len(self), len(self.death_sequence))
+		if self.buffer[self.cursor:self.cursor+pending] != self.death_sequence[:pending]:
+			discarded = len(self)
+			self.clear()
+			raise FramingError(discarded)
+		return len(self.death_sequence)
+
+	def next_frame(self):
+		"""Returns the next complete packet as a bytes object (or a
+		SpilledFrame), or None. Raises FramingError for packets too long."""
+		if self.remaining > 0:
+			return None
+		if self.spilled != None:
+			frame, self.spilled = self.spilled, None
+			return frame
+
+		length = self.frame_length()
+		if length == None:
+			return None
+		if self.max_frame != None and length > self.max_frame:
+			self.__divert(length, None)
+			raise FramingError(length)
+		if self.spill != None and length >= self.spill:
+			self.__divert(length, SpilledFrame(length))
+			return self.next_frame()
+		if len(self) < length:
+			return None
+
+		with memoryview(self.buffer) as view:
+			frame = view[self.cursor:self.cursor+length].tobytes()
+
+		if frame == self.death_sequence:
+			# Nothing makes sense after the Death Sequence
+			self.clear()
+		else:
+			if length > self.read_size:
+				self.typical += (length - self.typical) // 8
+			self.cursor += length
+			self.__rewind()
+		return frame
+
+	def frames(self):
+		"""Iterate over the complete packets in the buffer."""
+		frame = self.next_frame()
+		while frame != None:
+			yield frame
+			frame = self.next_frame()
+
+	def __divert(self, length, spilled):
+		"""Internal. Send the packet at the head of the buffer, and the rest
+		of it to come, to `spilled` (or nowhere)."""
+		available = min(len(self), length)
+		if spilled != None:
+			with memoryview(self.buffer) as view:
+				spilled.write(view[self.cursor:self.cursor+available])
+		self.cursor += available
+		self.remaining = length - available
+		self.spilled = spilled
+		self.__rewind()
+
+	def __rewind(self):
+		"""Internal. Go back to the start of the buffer once everything in it
+		was consumed, which costs nothing. A buffer that grew for packets
+		larger than those we usually get is dropped then."""
+		if self.cursor == self.end:
+			self.cursor = self.end = 0
+			if len(self.buffer) > RETAINED * max(self.read_size, self.typical):
+				self.buffer = bytearray()
+
+	def clear(self):
+		"""Drop everything buffered."""
+		self.buffer = bytearray()
+		self.cursor = 0
+		self.end = 0
+		if self.spilled != None:
+			self.spilled.close()
+		self.remaining = 0
+		self.spilled = None
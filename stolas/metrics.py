@@ -0,0 +1,273 @@
+# ~ stolas/metrics.py: Metrics Module ~
+#
+#  This module defines the counters, gauges and histograms Stolas nodes keep
+#   about themselves, the registry gathering them, and the HTTP server
+#   exposing that registry in the Prometheus text format.
+#  Counters and histograms are updated by many threads at once : each thread
+#   updates cells of its own, without locking, and cells are only added up
+#   when the metrics are collected.
+#
+
+import http.server	# `http.server.ThreadingHTTPServer`, `http.server.BaseHTTPRequestHandler`
+import threading	# `threading.local`, `threading.Lock`, `threading.Thread`
+
+from .utils import Histogram
+
+# Default buckets of histograms, in seconds
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+# Content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class ThreadCells:
+	"""One cell per thread, built by `make`, so that every thread updates
+	its own without locking. The cells of the threads gone are folded, with
+	`fold(into, cell)`, into a cell of their own."""
+	def __init__(self, make, fold):
+		self.make = make
+		self.fold = fold
+		self.__local = threading.local()
+		self.__cells = [] # (thread, cell) tuples
+		self.__gone = make()
+		self.__lock = threading.Lock()
+
+	def cell(self):
+		"""Returns the cell of the calling thread."""
+		cell = getattr(self.__local, "cell", None)
+		if cell == None:
+			cell = self.__local.cell = self.make()
+			self.__lock.acquire()
+			self.__cells.append((threading.current_thread(), cell))
+			self.__lock.release()
+		return cell
+
+	def cells(self):
+		"""Returns every cell, folding those of the threads gone."""
+		self.__lock.acquire()
+		alive = []
+		for thread, cell in self.__cells:
+			if thread.is_alive():
+				alive.append((thread, cell))
+			else:
+				self.fold(self.__gone, cell)
+		self.__cells = alive
+		cells = [self.__gone] + [cell for thread, cell in alive]
+		self.__lock.release()
+		return cells
+
+class Counter(ThreadCells):
+	"""Count that only goes up."""
+	def __init__(self):
+		super().__init__(lambda: [0], self.__fold)
+
+	def __repr__(self):
+		return "Counter({0})".format(self.get())
+
+	def __fold(self, into, cell):
+		into[0] += cell[0]
+
+	def inc(self, amount = 1):
+		self.cell()[0] += amount
+
+	def get(self):
+		return sum([cell[0] for cell in self.cells()])
+
+class Gauge:
+	"""Value that goes up and down."""
+	def __init__(self):
+		self.value = 0
+		self.__lock = threading.Lock()
+
+	def __repr__(self):
+		return "Gauge({0})".format(self.value)
+
+	def set(self, value):
+		self.value = value
+
+	def inc(self, amount = 1):
+		self.__lock.acquire()
+		self.value += amount
+		self.__lock.release()
+
+	def dec(self, amount = 1):
+		self.inc(-amount)
+
+	def get(self):
+		return self.value
+
+class ThreadHistogram(ThreadCells):
+	"""Distribution of observed values over fixed buckets (see
+	`stolas.utils.Histogram`), observed from any thread."""
+	def __init__(self, bounds = LATENCY_BUCKETS):
+		super().__init__(lambda: Histogram(bounds), self.__fold)
+		self.bounds = tuple(bounds)
+
+	def __repr__(self):
+		return "ThreadHistogram(count={0})".format(self.get().count)
+
+	def __fold(self, into, cell):
+		into.counts = [mine + theirs for mine, theirs in zip(into.counts, cell.counts)]
+		into.count += cell.count
+		into.sum += cell.sum
+
+	def observe(self, value):
+		self.cell().observe(value)
+
+	def get(self):
+		"""Returns a `stolas.utils.Histogram` of every observation so far."""
+		total = Histogram(self.bounds)
+		for cell in self.cells():
+			self.__fold(total, cell)
+		return total
+
+class Family:
+	"""A named metric, with one child (a Counter, Gauge or ThreadHistogram)
+	per combination of label values. A metric can instead be backed by a
+	function, called when collecting, returning its value (a number, or a
+	`stolas.utils.Histogram`), or a dictionary of values by label values."""
+	def __init__(self, kind, name, documentation, labelnames = (), make = None, function = None):
+		self.kind = kind
+		self.name = name
+		self.documentation = documentation
+		self.labelnames = tuple(labelnames)
+		self.make = make
+		self.function = function
+		self.children = {}
+		self.__lock = threading.Lock()
+
+	def __repr__(self):
+		return "Family(name='{0}', kind='{1}')".format(self.name, self.kind)
+
+	def labels(self, *values):
+		"""Returns the child for the given label values, which is kept at
+		hand by whoever updates it often."""
+		values = tuple([str(value) for value in values])
+		child = self.children.get(values, None)
+		if child == None:
+			self.__lock.acquire()
+			child = self.children.setdefault(values, self.make())
+			self.__lock.release()
+		return child
+
+	def collect(self):
+		"""Returns a list of (label values, value) tuples."""
+		if self.function == None:
+			return [(values, child.get()) for values, child in list(self.children.items())]
+		value = self.function()
+		if not isinstance(value, dict):
+			return [((), value)]
+		return [(key if isinstance(key, tuple) else (key,), item) for key, item in value.items()]
+
+def escape(value):
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def number(value):
+	"""Format a sample value."""
+	if value == float("inf"):
+		return "+Inf"
+	if isinstance(value, bool):
+		return str(int(value))
+	return repr(value) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+	"""The metrics of a node, by name."""
+	def __init__(self):
+		self.families = {}
+		self.__lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.families)
+
+	def __repr__(self):
+		return "MetricsRegistry(metrics={0})".format(len(self.families))
+
+	def __register(self, family):
+		"""Internal. Register a family, replacing any of the same name.
+		Returns the family, or its only child if it has no labels and no
+		function."""
+		self.__lock.acquire()
+		self.families[family.name] = family
+		self.__lock.release()
+		if family.function == None and len(family.labelnames) == 0:
+			return family.labels()
+		return family
+
+	def counter(self, name, documentation, labelnames = (), function = None):
+		return self.__register(Family("counter", name, documentation, labelnames, Counter, function))
+
+	def gauge(self, name, documentation, labelnames = (), function = None):
+		return self.__register(Family("gauge", name, documentation, labelnames, Gauge, function))
+
+	def histogram(self, name, documentation, bounds = LATENCY_BUCKETS, labelnames = (), function = None):
+		return self.__register(Family("histogram", name, documentation, labelnames, lambda: ThreadHistogram(bounds), function))
+
+	def get(self, name, *values):
+		"""Returns the value of a metric, for the given label values, or None."""
+		family = self.families.get(name, None)
+		if family == None:
+			return None
+		values = tuple([str(value) for value in values])
+		return dict([(key, value) for key, value in family.collect()]).get(values, None)
+
+	def exposition(self):
+		"""Returns every metric in the Prometheus text format."""
+		lines = []
+		for name, family in sorted(list(self.families.items())):
+			lines.append("# HELP {0} {1}".format(name, family.documentation.replace("\\", "\\\\").replace("\n", "\\n")))
+			lines.append("# TYPE {0} {1}".format(name, family.kind))
+			for values, value in family.collect():
+				labels = list(zip(family.labelnames, values))
+				if family.kind != "histogram":
+					lines.append("{0}{1} {2}".format(name, self.__labels(labels), number(value)))
+					continue
+				seen = 0
+				for bound, count in value.buckets():
+					seen += count
+					lines.append("{0}_bucket{1} {2}".format(name, self.__labels(labels + [("le", number(bound))]), seen))
+				lines.append("{0}_sum{1} {2}".format(name, self.__labels(labels), number(value.sum)))
+				lines.append("{0}_count{1} {2}".format(name, self.__labels(labels), value.count))
+		return "\n".join(lines) + "\n"
+
+	def __labels(self, labels):
+		"""Internal. Format a list of (name, value) label tuples."""
+		if len(labels) == 0:
+			return ""
+		return "{" + ",".join(["{0}=\"{1}\"".format(name, escape(value)) for name, value in labels]) + "}"
+
+class MetricsServer:
+	"""HTTP server exposing a registry in the Prometheus text format, on
+	`/metrics`, from a thread of its own."""
+	def __init__(self, registry, port, bind = "127.0.0.1"):
+		"""Initialization requires the registry and the port to listen on
+		(0 picks one), and optionally the address to bind."""
+		self.registry = registry
+
+		class Handler(http.server.BaseHTTPRequestHandler):
+			def do_GET(handler):
+				if handler.path.split("?")[0] not in ("/", "/metrics"):
+					handler.send_error(404)
+					return
+				body = registry.exposition().encode("utf8")
+				handler.send_response(200)
+				handler.send_header("Content-Type", CONTENT_TYPE)
+				handler.send_header("Content-Length", str(len(body)))
+				handler.end_headers()
+				handler.wfile.write(body)
+
+			def log_message(handler, format, *args):
+				pass # Scrapes are not worth logging
+
+		self.httpd = http.server.ThreadingHTTPServer((bind, port), Handler)
+		self.httpd.daemon_threads = True
+		self.port = self.httpd.server_address[1]
+		self.thread = threading.Thread(target = self.httpd.serve_forever, name = "Metrics", daemon = True)
+
+	def __repr__(self):
+		return "MetricsServer(port={0})".format(self.port)
+
+	def start(self):
+		self.thread.start()
+
+	def stop(self):
+		if self.thread.is_alive():
+			self.httpd.shutdown()
+		self.httpd.server_close()
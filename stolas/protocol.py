@@ -17,12 +17,58 @@ MESSAGE_BYTE = 5
 MESSAGEACK_BYTE = 6
 MALFORMED_DATA = 7
 ADVERTISE_BYTE = 8
+CHUNK_BYTE = 9
+PING_BYTE = 10
+PONG_BYTE = 11
 DEATH_SEQUENCE = b"\x57\x68\x61\x74\x20\x69\x73\x20\x6c\x6f\x76\x65\x3f\x20\x42\x61\x62\x79\x20\x64\x6f\x6e\x27\x74\x20\x68\x75\x72\x74\x20\x6d\x65\x2c\x20\x64\x6f\x6e\x27\x74\x20\x68\x75\x72\x74\x20\x6d\x65\x2c\x20\x6e\x6f\x20\x6d\x6f\x72\x65"
 
+# Framing rules of the lower protocol, used to slice packets out of the input
+#  stream. Each header maps to a tuple of (fixed length, variable length
+#  field) ; the variable length field is either None or an (offset, size)
+#  tuple locating a big endian integer that is added to the fixed length.
+PACKET_FRAMING = {
+	HELLO_BYTE: (2, None),
+	GOODBYE_BYTE: (1, None),
+	SHAREPEER_BYTE: (4, (1, 1)),
+	REQUESTPEER_BYTE: (1, None),
+	MESSAGE_BYTE: (4, (1, 3)),
+	MESSAGEACK_BYTE: (4, None),
+	MALFORMED_DATA: (3, None),
+	ADVERTISE_BYTE: (4, (1, 1)),
+	CHUNK_BYTE: (4, (1, 3)),
+	PING_BYTE: (9, None),
+	PONG_BYTE: (9, None),
+}
+# Names of the packets (see docs/protocol.md)
+PACKET_NAMES = {
+	HELLO_BYTE: "HELLO",
+	GOODBYE_BYTE: "GOODBYE",
+	SHAREPEER_BYTE: "SHAREPEER",
+	REQUESTPEER_BYTE: "REQUESTPEER",
+	MESSAGE_BYTE: "MESSAGE",
+	MESSAGEACK_BYTE: "MESSAGEACK",
+	MALFORMED_DATA: "MALFORMEDDATA",
+	ADVERTISE_BYTE: "ADVERTISER",
+	CHUNK_BYTE: "CHUNK",
+	PING_BYTE: "PING",
+	PONG_BYTE: "PONG",
+}
+# Packets carrying bulk data. They are the ones held back or dropped when a
+#  peer cannot keep up with what we send, while control packets always go.
+BULK_HEADERS = [MESSAGE_BYTE, CHUNK_BYTE]
+# Control packets that overtake the bulk packets waiting to be sent. Those
+#  whose order matters (HELLO, GOODBYE) wait their turn.
+PRIORITY_HEADERS = [SHAREPEER_BYTE, REQUESTPEER_BYTE, MESSAGEACK_BYTE, MALFORMED_DATA, ADVERTISE_BYTE, PING_BYTE, PONG_BYTE]
+# Imploded Messages longer than this are sent in CHUNK packets carrying that
+#  much of them each
+CHUNK_SIZE = 2**14
+
 # Integration variables
 # FIXME: When global configuration is operational, move those there.
 MIN_INTEGRATION = 5
 MAX_INTEGRATION = 50
+# Size of the pieces in which messages spilled to disk are read back
+EXPLODE_CHUNK = 2**16
 
 from hashlib import sha512   # Required for uing generation
 import time                  # `time.time`
@@ -38,6 +84,11 @@ class Message:
 	 of Stolas' protocol. It can be initialized with a custom channel name and
 	 Time To Live (TTL). The payload is required."""
 	def __init__(self, **kwargs):
+		# The imploded Message and the packet carrying it, built once and
+		#  dropped whenever a field changes
+		self.__wire = None
+		self.__frame = None
+		self.__chunks = None
 		self.__usig = sha512("{0}{1}{2}{3}".format(time.time(), MIN_INTEGRATION, kwargs, os.urandom(random.randrange(1, 256))).encode("utf8")).digest()
 
 		# Optional parameters
@@ -82,7 +133,10 @@ class Message:
 		return hex(b2i(self.__usig))[2:]
 
 	def implode(self):
-		"""Implode the Message's fields into a binary payload."""
+		"""Implode the Message's fields into a binary payload. The payload is
+		only compressed once, and reused until a field changes."""
+		if self.__wire != None:
+			return self.__wire
 		if self.timestamp == None:
 			raise TypeError("Timestamp is None")
 		if self.ttl == None:
@@ -108,8 +162,43 @@ class Message:
 		if len(data) >= 2**24:
 			raise RuntimeError("Implosion payload size is above or on limit (2**24)")
 
+		self.__wire = data
 		return data
 
+	def frame(self):
+		"""Returns the MESSAGE packet carrying the imploded Message."""
+		if self.__frame == None:
+			data = self.implode()
+			self.__frame = i2b(MESSAGE_BYTE) + i2b(len(data), 3) + data
+		return self.__frame
+
+	def chunks(self, size = CHUNK_SIZE):
+		"""Returns the CHUNK packets carrying the imploded Message, `size`
+		bytes of it each (see docs/protocol.md)."""
+		if self.__chunks == None or self.__chunks[0] != size:
+			data = self.implode()
+			head = i2b(CHUNK_BYTE)
+			tail = self.__usig + i2b(len(data), 3)
+			self.__chunks = (size, [
+				head + i2b(70 + len(data[offset:offset+size]), 3) + tail + i2b(offset, 3) + data[offset:offset+size]
+				for offset in range(0, len(data), size)
+			])
+		return self.__chunks[1]
+
+	def is_imploded(self):
+		"""Tells whether or not the imploded Message is at hand already."""
+		return self.__wire != None
+
+	def size(self):
+		"""Size of the Message's fields once serialized, before compression."""
+		return 77 + len(self.channel.encode("utf8")) + len(self.payload)
+
+	def __invalidate(self):
+		"""Internal. Drop the imploded Message after a change."""
+		self.__wire = None
+		self.__frame = None
+		self.__chunks = None
+
 	def is_complete(self):
 		"""Checks for missing fields."""
 		return not None in [self.timestamp, self.ttl, self.channel, self.payload]
@@ -118,16 +207,43 @@ class Message:
 		"""Check whether or not we've gone over our Time To Live."""
 		return time.time() < self.timestamp + self.ttl
 
+	@staticmethod
+	def __inflate(source):
+		"""Internal. Decompress the data read from the `source` file, piece
+		by piece, up to the longest message there can be."""
+		limit = 77 + 255 + 2**24
+		inflater = zlib.decompressobj()
+		data = bytearray()
+		chunk = source.read(EXPLODE_CHUNK)
+		while chunk:
+			data += inflater.decompress(chunk, limit + 1 - len(data))
+			if len(data) > limit:
+				raise ValueError("Malformed message data : too long")
+			chunk = source.read(EXPLODE_CHUNK)
+		data += inflater.flush()
+		if not inflater.eof:
+			raise ValueError("Malformed message data : truncated")
+		return bytes(data)
+
 	@staticmethod
 	def explode(data):
-		"""Explode binary data into a Message object."""
-		if type(data) != type(b""):
+		"""Explode binary data into a Message object. The data can also be
+		given as a binary file holding it, which is read in pieces (the
+		imploded Message is then not kept)."""
+		compressed = None
+		if hasattr(data, "read"):
+			data = Message.__inflate(data)
+		elif type(data) != type(b""):
 			raise TypeError("Data must be provided as a Byte object")
-		if len(data) < 14:
+		else:
+			if len(data) < 14:
+				raise ValueError("Malformed message data")
+			compressed = data
+			data = zlib.decompress(data)
+		if len(data) < 77:
 			raise ValueError("Malformed message data")
 
 		self = Message()
-		data = zlib.decompress(data)
 		self.__usig = data[:64]
 		data = data[64:]
 		self.set_timestamp(b2i(data[:8]))
@@ -138,6 +254,8 @@ class Message:
 		self.set_channel(data[13:13+chanlen].decode("utf8"))
 		self.set_payload(data[13+chanlen:])
 
+		# What we received is as good as what we would implode
+		self.__wire = compressed
 		return self
 
 	def set_timestamp(self, timestamp):
@@ -150,6 +268,7 @@ class Message:
 			raise ValueError("Timestamp provided is negative")
 
 		self.timestamp = timestamp
+		self.__invalidate()
 
 	def get_timestamp(self):
 		"""Returns the timestamp."""
@@ -165,6 +284,7 @@ class Message:
 			raise ValueError("TTL must be in range(60, 223200)")
 
 		self.ttl = ttl
+		self.__invalidate()
 
 	def get_ttl(self):
 		"""Returns the Time To Live."""
@@ -179,6 +299,7 @@ class Message:
 			raise ValueError("Channel cannot be longer than 255 characters")
 
 		self.channel = channel
+		self.__invalidate()
 
 	def get_channel(self):
 		"""Returns the message channel."""
@@ -194,6 +315,7 @@ class Message:
 			raise ValueError("Payload length is superior to 2**24.")
 
 		self.payload = payload
+		self.__invalidate()
 
 	def get_payload(self):
 		"""Returns the payload."""
@@ -0,0 +1,149 @@
+# ~ stolas/registry.py: Peer Registry Module ~
+#
+#  This module defines the structures in which the UnisocketModel keeps track
+#   of its peers and of the candidates it could connect to, indexed so that
+#   no lookup has to go through all of them.
+#
+
+import heapq		# `heapq.heappush`, `heapq.heappop`
+import types		# `types.MappingProxyType`
+
+class PeerRegistry:
+	"""Registry of the peers of a UnisocketModel.
+	Peers are stored by Peer ID, and indexed by address (`verbinfo`) and
+	listen address. Peer IDs are allocated from a free list of released IDs,
+	lowest first, or past the highest ever allocated.
+	Writers change the tables in place, in constant time, and must hold the
+	model's peer lock. Lookups need no lock. `peers` and `by_listen`, which
+	are iterated, are immutable snapshots of the tables : one is copied on
+	the first read following a change, and handed out until the next change,
+	so that a burst of changes costs a single copy."""
+	def __init__(self):
+		self.__peers = {}
+		self.__by_verbinfo = {}
+		self.__by_listen = {}
+		# Changes so far, and the snapshots of `peers` and `by_listen`, each
+		# along with the amount of changes they were copied after
+		self.__version = 0
+		self.__peers_snapshot = (0, types.MappingProxyType({}))
+		self.__listen_snapshot = (0, types.MappingProxyType({}))
+		self.__free = [] # Heap of released Peer IDs
+		self.__next = 0 # Lowest Peer ID never allocated
+
+	def __len__(self):
+		return len(self.__peers)
+
+	def __contains__(self, pid):
+		return pid in self.__peers
+
+	def __iter__(self):
+		return iter(self.peers)
+
+	def __repr__(self):
+		return "PeerRegistry(peers={0})".format(len(self.__peers))
+
+	@property
+	def peers(self):
+		"""Immutable snapshot of the peers, by Peer ID."""
+		self.__peers_snapshot = self.__snapshot(self.__peers_snapshot, self.__peers)
+		return self.__peers_snapshot[1]
+
+	@property
+	def by_listen(self):
+		"""Immutable snapshot of the Peer IDs, by listen address."""
+		self.__listen_snapshot = self.__snapshot(self.__listen_snapshot, self.__by_listen)
+		return self.__listen_snapshot[1]
+
+	def __snapshot(self, snapshot, table):
+		"""Internal. Returns `snapshot`, or a new one of `table` if it changed
+		since. The version is read before copying : a change racing with the
+		copy leaves it outdated, to be copied again on the next read."""
+		version = self.__version
+		if snapshot[0] != version:
+			snapshot = (version, types.MappingProxyType(table.copy()))
+		return snapshot
+
+	def allocate(self):
+		"""Returns a Peer ID for a new peer."""
+		if len(self.__free) > 0:
+			return heapq.heappop(self.__free)
+		self.__next += 1
+		return self.__next - 1
+
+	def add(self, peer):
+		"""Register a peer, whose Peer ID comes from `allocate`."""
+		if peer.verbinfo != None:
+			self.__by_verbinfo[peer.verbinfo] = peer.pid
+		if peer.listen != None:
+			self.__by_listen[peer.listen] = peer.pid
+		self.__peers[peer.pid] = peer
+		self.__version += 1
+
+	def remove(self, pid):
+		"""Unregister a peer and release its Peer ID. Returns the peer."""
+		peer = self.__peers.pop(pid)
+		if self.__by_verbinfo.get(peer.verbinfo, None) == pid:
+			del self.__by_verbinfo[peer.verbinfo]
+		if self.__by_listen.get(peer.listen, None) == pid:
+			del self.__by_listen[peer.listen]
+		self.__version += 1
+		heapq.heappush(self.__free, pid)
+		return peer
+
+	def get(self, pid, alternative = None):
+		return self.__peers.get(pid, alternative)
+
+	def set_listen(self, peer, listen):
+		"""Set the listen address of a peer."""
+		if self.__by_listen.get(peer.listen, None) == peer.pid:
+			del self.__by_listen[peer.listen]
+		peer.listen = listen
+		if listen != None:
+			self.__by_listen[listen] = peer.pid
+		self.__version += 1
+
+	def find(self, addr):
+		"""Returns the peer connected to, or listening on, an address, or None."""
+		pid = self.__by_listen.get(addr, self.__by_verbinfo.get(addr, None))
+		return self.__peers.get(pid, None) if pid != None else None
+
+class CandidateList(list):
+	"""List of the addresses of possible peers, with constant time membership
+	tests and removals. Removing an address moves the last one in its place,
+	since the order of candidates does not matter."""
+	def __init__(self, candidates = ()):
+		super().__init__()
+		self.__index = {}
+		self.extend(candidates)
+
+	def __contains__(self, addr):
+		return addr in self.__index
+
+	def __iadd__(self, candidates):
+		self.extend(candidates)
+		return self
+
+	def append(self, addr):
+		"""Add a candidate, unless we already have it."""
+		if addr in self.__index:
+			return
+		self.__index[addr] = len(self)
+		super().append(addr)
+
+	def extend(self, candidates):
+		for addr in candidates:
+			self.append(addr)
+
+	def remove(self, addr):
+		"""Remove a candidate. Raises ValueError if we don't have it."""
+		index = self.__index.pop(addr, None)
+		if index == None:
+			raise ValueError("{0} is not a candidate".format(addr))
+		last = super().pop()
+		if index < len(self):
+			self[index] = last
+			self.__index[last] = index
+
+	def clear(self):
+		super().clear()
+		self.__index.clear()
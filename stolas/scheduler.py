@@ -0,0 +1,81 @@
+# ~ stolas/scheduler.py: Scheduler Module ~
+#
+#  This module defines the timer heap driving the periodic tasks of the
+#   processing units (integration, MPile vacuuming, message distribution),
+#   so that they can block on their queues until the next deadline.
+#
+
+import heapq		# `heapq.heappush`, `heapq.heappop`
+import itertools	# `itertools.count`
+import threading	# `threading.Lock`, `threading.get_ident`
+import time			# `time.monotonic`
+
+class Scheduler:
+	"""Timer heap on the monotonic clock.
+	Callbacks run in the thread calling `run_pending`, which is expected to
+	sleep for at most `timeout()` seconds in between. Since a callback
+	scheduled from another thread may be due earlier than what that thread
+	is sleeping for, `wakeup` is called whenever that happens."""
+	def __init__(self, wakeup = None):
+		"""Initialization optionally takes a callable waking the thread that
+		runs the callbacks up."""
+		self.heap = []
+		self.counter = itertools.count() # Keeps equal deadlines in order
+		self.lock = threading.Lock()
+		self.wakeup = wakeup
+		self.runner = None # Thread identifier of whoever runs the callbacks
+
+	def __len__(self):
+		"""Gives the amount of scheduled callbacks."""
+		return len([entry for entry in self.heap if entry[2] != None])
+
+	def __repr__(self):
+		return "Scheduler(pending={0})".format(len(self))
+
+	def call_later(self, delay, callback, *args):
+		"""Schedule a callback to be called after `delay` seconds, with the
+		given arguments. Returns a handle that can be cancelled."""
+		entry = [time.monotonic() + delay, next(self.counter), callback, args]
+		self.lock.acquire()
+		heapq.heappush(self.heap, entry)
+		earliest = self.heap[0] is entry
+		self.lock.release()
+
+		if earliest and self.wakeup != None and self.runner != threading.get_ident():
+			self.wakeup()
+		return entry
+
+	def cancel(self, handle):
+		"""Cancel a scheduled callback. It is simply skipped when due, and
+		lets go of its arguments meanwhile."""
+		if handle != None:
+			handle[2] = None
+			handle[3] = ()
+
+	def timeout(self):
+		"""Returns the time left until the next deadline (0 if overdue), or
+		None when there's nothing scheduled."""
+		self.lock.acquire()
+		while len(self.heap) > 0 and self.heap[0][2] == None:
+			heapq.heappop(self.heap)
+		deadline = self.heap[0][0] if len(self.heap) > 0 else None
+		self.lock.release()
+
+		if deadline == None:
+			return None
+		return max(0, deadline - time.monotonic())
+
+	def run_pending(self):
+		"""Call every callback due. Callbacks scheduled meanwhile wait for the
+		next call, even if they're already due."""
+		self.runner = threading.get_ident()
+		now = time.monotonic()
+		due = []
+		self.lock.acquire()
+		while len(self.heap) > 0 and self.heap[0][0] <= now:
+			due.append(heapq.heappop(self.heap))
+		self.lock.release()
+
+		for deadline, index, callback, args in due:
+			if callback != None:
+				callback(*args)
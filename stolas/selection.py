@@ -0,0 +1,159 @@
+# ~ stolas/selection.py: Peer Selection Module ~
+#
+#  This module defines the strategies the UnisocketModel picks the candidates
+#   it connects to, the peers it asks for more peers, and the peers it lets
+#   go of when it has too many, with. The latency aware strategy scores peers
+#   by their round trip time and throughput, and candidates by what we know
+#   of them from earlier connections, to keep the fastest ones around.
+#
+
+import collections	# `collections.OrderedDict`
+import random		# `random.sample`, `random.choice`
+import threading	# `threading.Lock`
+import time			# `time.monotonic`
+
+from .protocol import CHUNK_SIZE
+
+# Amount of addresses whose costs are remembered
+REMEMBERED = 1024
+# Least amount of bytes a peer must have sent us between two observations for
+#  its throughput to be measured, and amount of bytes its throughput is
+#  weighted by in its cost (the time it takes to send us a chunk)
+THROUGHPUT_SAMPLE = 2**16
+THROUGHPUT_WEIGHT = CHUNK_SIZE
+
+class RandomSelection:
+	"""Peer selection strategy picking candidates and peers at random, and
+	never replacing peers. Other strategies override its methods, which run
+	in the model's processor, unless said otherwise."""
+	# Whether the strategy replaces peers once the model is at capacity
+	replaces = False
+
+	def __repr__(self):
+		return "{0}()".format(type(self).__name__)
+
+	def observe(self, peers):
+		"""Look at the peers, on every integration check."""
+		pass
+
+	def connected(self, addr, elapsed):
+		"""Note that connecting to `addr` took `elapsed` seconds. Called from
+		the dialer."""
+		pass
+
+	def failed(self, addr):
+		"""Note that connecting to `addr` failed. Called from the dialer."""
+		pass
+
+	def candidates(self, possible, count, peers):
+		"""Returns up to `count` candidates out of `possible` to connect to,
+		given our current `peers`."""
+		return random.sample(possible, min(count, len(possible)))
+
+	def requestee(self, peers):
+		"""Returns the Peer ID of the peer to ask for more peers."""
+		return random.choice(list(peers.keys()))
+
+	def surplus(self, peers, count):
+		"""Returns the Peer IDs of up to `count` peers to let go of."""
+		return []
+
+class LatencySelection(RandomSelection):
+	"""Peer selection strategy preferring fast peers.
+	A peer costs its smoothed round trip time, plus the time it takes to
+	send us a chunk at its recent throughput, when it sent us enough to tell.
+	A candidate costs what it did when it was last our peer, or else the time
+	it took to connect to it. Candidates we know nothing about are tried
+	first, and known ones only if they're cheaper than our worst peer."""
+	replaces = True
+
+	def __init__(self):
+		self.rates = {} # Peer ID -> (peer, bytes received, stamp, throughput)
+		self.costs = collections.OrderedDict() # Address -> cost
+		self.lock = threading.Lock()
+
+	def __repr__(self):
+		return "LatencySelection(known={0})".format(len(self.costs))
+
+	def __remember(self, addr, cost):
+		"""Internal. Remember the cost of an address."""
+		self.lock.acquire()
+		self.costs.pop(addr, None)
+		self.costs[addr] = cost
+		if len(self.costs) > REMEMBERED:
+			self.costs.popitem(last = False)
+		self.lock.release()
+
+	def cost(self, peer):
+		"""Returns the cost of a peer, in seconds, or None until we measured
+		its round trip time."""
+		if peer.rtt == None:
+			return None
+		cost = peer.rtt
+		entry = self.rates.get(peer.pid, None)
+		if entry != None and entry[0] is peer and entry[3] != None:
+			cost += THROUGHPUT_WEIGHT / entry[3]
+		return cost
+
+	def observe(self, peers):
+		now = time.monotonic()
+		rates = {}
+		for pid, peer in peers.items():
+			iqueue = peer.iqueue
+			if iqueue == None:
+				continue # Being deleted
+			entry = self.rates.get(pid, None)
+			if entry == None or not entry[0] is peer:
+				rates[pid] = (peer, iqueue.received, now, None)
+				continue
+			peer, received, stamp, rate = entry
+			if iqueue.received - received >= THROUGHPUT_SAMPLE and now > stamp:
+				sample = (iqueue.received - received) / (now - stamp)
+				rate = sample if rate == None else 0.75 * rate + 0.25 * sample
+				received, stamp = iqueue.received, now
+			rates[pid] = (peer, received, stamp, rate)
+			if peer.listen != None and self.cost(peer) != None:
+				self.__remember(peer.listen, self.cost(peer))
+		self.rates = rates
+
+	def connected(self, addr, elapsed):
+		self.lock.acquire()
+		known = addr in self.costs
+		self.lock.release()
+		if not known:
+			self.__remember(addr, elapsed)
+
+	def failed(self, addr):
+		self.__remember(addr, float("inf"))
+
+	def candidates(self, possible, count, peers):
+		costs = [self.cost(peer) for peer in peers.values()]
+		worst = max([cost for cost in costs if cost != None] + [0])
+		full = len(costs) > 0 and not None in costs
+		self.lock.acquire()
+		known = [(self.costs[addr], addr) for addr in possible if addr in self.costs]
+		unknown = [addr for addr in possible if not addr in self.costs]
+		self.lock.release()
+		# Only what could beat our worst peer is worth replacing it with
+		known = [addr for cost, addr in sorted(known) if not full or cost < worst]
+		random.shuffle(unknown)
+		return (unknown + known)[:count]
+
+	def requestee(self, peers):
+		"""Ask one of our fastest peers, since their own peers are likely to
+		be close to us too."""
+		ranked = sorted(peers.values(), key = lambda peer: (self.cost(peer) == None, self.cost(peer) or 0))
+		return random.choice(ranked[:max(1, len(ranked) // 2)]).pid
+
+	def surplus(self, peers, count):
+		"""Let go of the most costly peers, once all of them were measured."""
+		costs = [(self.cost(peer), pid) for pid, peer in peers.items()]
+		if None in [cost for cost, pid in costs]:
+			return [] # Wait for the new ones to be measured
+		return [pid for cost, pid in sorted(costs, reverse = True)[:count]]
+
+# Strategies by name
+STRATEGIES = {
+	"random": RandomSelection,
+	"latency": LatencySelection,
+}
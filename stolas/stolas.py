@@ -5,20 +5,34 @@ import queue
 import random
 import time
 import sqlite3
+import zlib				# `zlib.error`
 import os, os.path
 import logging			# `logging.Logger`, `logging.Formatter`, `logging.StreamHandler`
-import logging.handlers	# `logging.handlers.RotatingFileHandler`
+import logging.handlers	# `logging.handlers.RotatingFileHandler`, `logging.handlers.QueueHandler`, `logging.handlers.QueueListener`
 
 import stolas.protocol as protocol
-from stolas.unisocket import UnisocketModel, i2b, b2i, PhantomLogger
+from stolas.unisocket import UnisocketModel, b2i, PhantomLogger
+from stolas.scheduler import Scheduler
+from stolas.workers import WorkerPool
+from stolas.metrics import MetricsRegistry, MetricsServer
+from stolas.tracing import Tracer
+from stolas.cluster import Claimer
 
 randport = lambda: random.randrange(1024, 65536)
 
 class MessagePile:
-	def __init__(self):
-		"""Initialize the Message Stack object. Needs no parameters."""
+	def __init__(self, metrics = None):
+		"""Initialize the Message Stack object. Optionally takes the registry
+		our metrics are recorded in."""
 		self.data = {}
+		self.__usigs = {} # Message IDs by unique signature
 		self.__lock = threading.Lock()
+		self.metrics = metrics
+		if metrics != None:
+			metrics.gauge("stolas_mpile_messages", "Messages in the MPile", function = self.__len__)
+			self.__added = metrics.counter("stolas_mpile_added_total", "Messages added to the MPile")
+			self.__known = metrics.counter("stolas_mpile_known_total", "Messages not added to the MPile since it had them")
+			self.__vacuumed = metrics.counter("stolas_mpile_vacuumed_total", "Dead messages vacuumed from the MPile")
 
 	def __new_msgid(self):
 		"""Internal. Get a new message ID."""
@@ -29,7 +43,10 @@ class MessagePile:
 		return [x for x in range(len(self.data)+1) if not self.data.get(x, False)][0]
 
 	def __contains__(self, key):
-		return True in [self.data[mid] == key for mid in self.data]
+		if not isinstance(key, protocol.Message):
+			return False
+		mid = self.__usigs.get(key.usig(), None)
+		return mid != None and self.data.get(mid, None) == key
 
 	def __len__(self):
 		return len(self.data)
@@ -39,7 +56,9 @@ class MessagePile:
 			yield usig, self.data[usig]
 
 	def add(self, message):
-		"""Add a message onto the pile. Expects a stolas.protocol.Message object."""
+		"""Add a message onto the pile. Expects a stolas.protocol.Message object.
+		Returns the new message ID, or None if the message is dead or already
+		in the pile."""
 		if message == None or not isinstance(message, protocol.Message):
 			raise TypeError("Invalid data type {0}: expected stolas.protocol.Message")
 
@@ -49,14 +68,26 @@ class MessagePile:
 		# Otherwise, we're okay to go
 		elif message.is_alive():
 			self.__lock.acquire()
+			if message in self:
+				self.__lock.release()
+				if self.metrics != None:
+					self.__known.inc()
+				return None
 			nmid = self.__new_msgid()
 			self.data[nmid] = message
+			self.__usigs[message.usig()] = nmid
 			self.__lock.release()
+			if self.metrics != None:
+				self.__added.inc()
 			return nmid
 
 	def get(self, message_id, alternative = None):
 		return self.data.get(message_id, alternative)
 
+	def knows(self, usig):
+		"""Tells whether or not a message with that signature is in the pile."""
+		return usig in self.__usigs
+
 	def get_random(self):
 		self.__lock.acquire()
 		acceptable = [mid for mid in self.data if self.data[mid].is_alive()]
@@ -76,17 +107,19 @@ class MessagePile:
 			return False
 
 		self.__lock.acquire()
-		del self.data[message_id]
+		message = self.data.pop(message_id, None)
+		if message != None and self.__usigs.get(message.usig(), None) == message_id:
+			del self.__usigs[message.usig()]
 		self.__lock.release()
-		return True
+		return message != None
 
 	def vacuum(self):
 		for mid in list(self.data.keys()):
 			# We use the key list so that it is a separate entity from the pile
 			# which size we cannot guarantee won't change during vacuuming
 			msg = self.get(mid)
-			if msg and not msg.is_alive():
-				self.delete(mid)
+			if msg and not msg.is_alive() and self.delete(mid) and self.metrics != None:
+				self.__vacuumed.inc()
 
 def find_storage_directory():
 	if os.name == "nt":
@@ -102,13 +135,18 @@ class Inbox:
 	data = {}
 	_storage_directory = find_storage_directory()
 	_callbacks = []
-	def __init__(self, nowrite=False):
+	def __init__(self, nowrite=False, metrics=None):
 		# Here be database stuff
 		if not os.path.isdir(self._storage_directory):
 			os.mkdir(self._storage_directory)
 		self.cursor = None
 		self.conn = None
 		self.nowrite = nowrite
+		self.metrics = metrics
+		if metrics != None:
+			metrics.gauge("stolas_inbox_messages", "Messages in the Inbox", function = lambda: len(self.data))
+			self.__added = metrics.counter("stolas_inbox_added_total", "Messages added to the Inbox")
+			self.__removed = metrics.counter("stolas_inbox_removed_total", "Messages removed from the Inbox")
 
 	def __iter__(self):
 		for usig in self.data:
@@ -150,6 +188,8 @@ class Inbox:
 		if self.exists(uuid):
 			self.cursor.execute('DELETE from inbox WHERE uuid=?', (uuid,))
 			self.save()
+			if self.metrics != None:
+				self.__removed.inc()
 
 	def add(self, uuid, msg):
 		if self.nowrite:
@@ -170,6 +210,8 @@ class Inbox:
 		for callback in self._callbacks:
 			callback(uuid, msg)
 		self.save()
+		if self.metrics != None:
+			self.__added.inc()
 
 	def get(self, uuid, other=None):
 		return self.data.get(uuid, other)
@@ -187,6 +229,21 @@ class Stolas:
 		if self.name == None:
 			self.name = hex(random.randrange(pow(16,8),pow(16,16)))[2:10]
 
+		# Background writers of the log files
+		self.__log_listeners = []
+		# Where our metrics are recorded (see stolas.metrics) : a registry, or
+		# True for one of our own, which serving them on a port implies
+		self.metrics = kwargs.get("metrics", None)
+		self.metrics_port = kwargs.get("metrics_port", None)
+		if self.metrics == True or (self.metrics == None and self.metrics_port != None):
+			self.metrics = MetricsRegistry()
+		self.metrics_server = None
+		# What traces messages through our stages and the networker's (see
+		# stolas.tracing), given the fraction of batches of packets to trace
+		self.tracer = None
+		if kwargs.get("trace_rate", None):
+			self.tracer = Tracer(kwargs["trace_rate"], self.metrics)
+
 		if kwargs.get("logging", False):
 			self.logger = self.__logging_setup("Stolas(" + self.name + ")")
 		else:
@@ -201,26 +258,72 @@ class Stolas:
 		networker_kwargs["name"] = "US," + self.name
 		networker_kwargs["listen"] = kwargs.get("listen", True)
 		networker_kwargs["bind"] = kwargs.get("bind", None)
+		networker_kwargs["engine"] = kwargs.get("engine", "threads")
+		networker_kwargs["loop"] = kwargs.get("loop", None)
+		networker_kwargs["metrics"] = self.metrics
+		networker_kwargs["tracer"] = self.tracer
+		for option in ["high_water", "low_water", "coalesce", "backpressure", "block_timeout", "connect_timeout", "dial_parallelism", "shutdown_timeout", "workers", "reuse_port",
+			"peer_inbound_rate", "peer_outbound_rate", "inbound_rate", "outbound_rate",
+			"max_frame", "spill_threshold", "cut_through", "nodelay", "sndbuf", "rcvbuf", "keepalive", "backlog", "recv_size",
+			"heartbeat", "heartbeat_misses", "selection", "max_clients", "replace_interval"]:
+			if option in kwargs:
+				networker_kwargs[option] = kwargs[option]
 
 		self.networker = UnisocketModel(self.port, **networker_kwargs)
-
-		self.networker.start()
+		self.networker.chunk_filter = self.__wants
+		# Called with every new message object received from the network
+		self.on_new_message_callbacks = []
 
 		self.processor = threading.Thread(
 			name = "CPU," + self.name,
 			target = self.__processor_unit
 		)
 
-		self.now = None
+		# Tasks for the CPU thread go in the same queue as the messages from
+		# the networker, so that it can sleep on a single queue
+		self.tasks = self.networker.imessages
+		self.scheduler = Scheduler(wakeup = lambda: self.tasks.put(("wakeup", None)))
+		self.__distribution = None
+		self.__distribution_lock = threading.Lock()
+		# Messages are exploded and logged by workers, sharded by Peer ID
+		self.pool = WorkerPool(kwargs.get("workers", 1) or 1, self.__handle_message, "Worker," + self.name + ",", self.logger)
+
 		self.vacuum_timer = 5
-		self.mpile = MessagePile()
+		self.mpile = MessagePile(self.metrics)
 		self.distribution_timer = 10
 
+		# Messages claimed by the other processes of our cluster, if we're part
+		# of one (see stolas.cluster), and by us, by signature, with their
+		# expiry. Messages are claimed in batches, off the workers
+		self.claims = kwargs.get("claims", None)
+		self.__foreign = {}
+		self.__owned = {}
+		self.claimer = None
+		if self.claims != None:
+			self.claimer = Claimer(self.claims, self.__claimed, "," + self.name, self.logger)
+
+		# Messages compressed for sending, and reused without compressing
+		# them again (along with the bytes that would have been compressed)
+		self.implosions = {"compressed": 0, "reused": 0, "saved": 0}
+		self.__stats_lock = threading.Lock()
+
 		self.tuned_channels = [""]
 		if kwargs.get("virtual"):
-			self.inbox = Inbox(nowrite=True)
+			self.inbox = Inbox(nowrite=True, metrics=self.metrics)
 		else:
-			self.inbox = Inbox()
+			self.inbox = Inbox(metrics=self.metrics)
+
+		if self.metrics != None:
+			self.__received = self.metrics.counter("stolas_messages_received_total", "Messages received from peers")
+			self.__explosions = self.metrics.histogram("stolas_explode_seconds", "Time taken to explode received messages")
+			self.__broadcasts = self.metrics.counter("stolas_messages_broadcast_total", "Messages sent to all of our peers")
+			self.metrics.counter("stolas_implosions_total", "Messages imploded for sending, or reused as they were", ["kind"],
+				function = lambda: {"compressed": self.implosions["compressed"], "reused": self.implosions["reused"]})
+			self.metrics.gauge("stolas_worker_queued", "Messages waiting for the workers", function = self.pool.pending)
+
+		# Last, since packets may come as soon as it runs, and what handles
+		# them (like `__wants`) must be ready
+		self.networker.start()
 
 	def __repr__(self):
 		return "Stolas(name='{0}',port='{1}')".format(self.name, self.port)
@@ -256,12 +359,17 @@ class Stolas:
 		console.setFormatter(c_formatter)
 		logger.addHandler(console)
 
-		# Create the file handler.
+		# Create the file handler. It is run by a background thread, fed
+		# through a queue, so that whoever logs never waits for the disk.
 		file_lo = logging.handlers.RotatingFileHandler(filename = logfile)
 		file_lo.setLevel(logging.DEBUG)
 		f_formatter = logging.Formatter('[%(asctime)s][%(levelname)7s][%(name)20s:%(funcName)25s:%(lineno)3s][%(threadName)20s] %(message)s')
 		file_lo.setFormatter(f_formatter)
-		logger.addHandler(file_lo)
+		records = queue.Queue()
+		listener = logging.handlers.QueueListener(records, file_lo, respect_handler_level = True)
+		listener.start()
+		self.__log_listeners.append(listener)
+		logger.addHandler(logging.handlers.QueueHandler(records))
 
 		logger.debug("Logger Ready")
 		return logger
@@ -273,10 +381,25 @@ class Stolas:
 	def join(self):
 		self.networker.join()
 		self.processor.join()
+		self.pool.join()
+		if self.claimer != None:
+			self.claimer.stop()
+			self.claimer.join()
+		if self.metrics_server != None:
+			self.metrics_server.stop()
+		# Whatever was logged until now gets written
+		for listener in self.__log_listeners:
+			listener.stop()
 
 	def start(self):
 		self.running = True
+		self.pool.start()
+		if self.claimer != None:
+			self.claimer.start()
 		self.processor.start()
+		if self.metrics_port != None:
+			self.metrics_server = MetricsServer(self.metrics, self.metrics_port)
+			self.metrics_server.start()
 
 	def is_alive(self):
 		return self.running
@@ -322,55 +445,121 @@ class Stolas:
 			return
 		self.message_broadcast(randomly_selected_message)
 
+	def __vacuum(self):
+		"""Internal. Scheduled MPile vacuuming."""
+		self.logger.debug("Vacuuming the MPile")
+		self.mpile.vacuum()
+		now = time.time()
+		for claims in [self.__foreign, self.__owned]:
+			for usig in [usig for usig, expiry in list(claims.items()) if expiry <= now]:
+				claims.pop(usig, None)
+		self.scheduler.call_later(self.vacuum_timer, self.__vacuum)
+
+	def __distribute(self):
+		"""Internal. Scheduled message distribution."""
+		self.message_distribution()
+		if len(self.mpile) > 0:
+			# Parabolic timer
+			#self.distribution_timer = (lambda x: -(10/65025) * (x**2 - 1)**2 + 10)(len(self.mpile.list()))
+			# Hyperbolic timer
+			self.distribution_timer = (lambda x: 1/(x-(9/10)))(len(self.mpile))
+		self.schedule_distribution(self.distribution_timer)
+
+	def schedule_distribution(self, delay = 0):
+		"""(Re)schedule the next message distribution in `delay` seconds."""
+		self.__distribution_lock.acquire()
+		self.scheduler.cancel(self.__distribution)
+		self.__distribution = self.scheduler.call_later(delay, self.__distribute)
+		self.__distribution_lock.release()
+
 	def __processor_unit(self):
-		self.now = time.time()
 		self.inbox._db_open()
 		self.inbox._load()
-		self.tasks = queue.Queue()
+		self.scheduler.call_later(self.vacuum_timer, self.__vacuum)
+		self.schedule_distribution(self.distribution_timer)
 		while self.running:
-			if not self.networker.running:
-				self.running = False
-
-			dt = time.time() - self.now
-			self.vacuum_timer -= dt
-			self.distribution_timer -= dt
-			self.now += dt
-			if self.vacuum_timer <= 0:
-				self.logger.debug("Vacuuming the MPile")
-				self.mpile.vacuum()
-				self.vacuum_timer = 5
-
-			if self.distribution_timer <= 0:
-				self.message_distribution()
-				# Parabolic timer
-				#self.distribution_timer = (lambda x: -(10/65025) * (x**2 - 1)**2 + 10)(len(self.mpile.list()))
-				# Hyperbolic timer
-				self.distribution_timer = (lambda x: 1/(x-(9/10)))(len(self.mpile.list()))
+			self.scheduler.run_pending()
 
+			# Sleep until either a message or a task comes, or the next timer is due
 			try:
-				mtype, message = self.networker.imessages.get(timeout=0)
+				mtype, data = self.tasks.get(timeout = self.scheduler.timeout())
 			except queue.Empty:
-				pass
-			else:
-				if mtype == "message":
-					msg = protocol.Message.explode(message)
-					self.handle_new_message(msg)
-					self.networker.imessages.task_done()
+				continue
 
-			try:
-				mtype, data = self.tasks.get(timeout=0)
-			except queue.Empty:
-				pass
-			else:
-				if mtype == "inbox_add":
-					usig, msg = data
-					self.inbox.add(usig, msg)
-				elif mtype == "inbox_del":
-					self.inbox.remove(data)
+			if mtype == "stopped":
+				self.running = False
 
+			elif mtype == "message":
+				data, pid, trace = data
+				if trace != None:
+					trace.stamp("imessages")
+				self.pool.submit(pid, data, trace)
+
+			elif mtype == "inbox_add":
+				usig, msg, trace = data
+				if trace != None:
+					trace.stamp("inbox_queue")
+				self.inbox.add(usig, msg)
+				if trace != None:
+					trace.stamp("inbox")
+					trace.finish()
+
+			elif mtype == "inbox_del":
+				self.inbox.remove(data)
+
+		self.pool.stop()
 		self.logger.info("Shutting down CPU")
 
-	def __add_in_inbox(self, msgobj):
+	def __handle_message(self, data, trace = None):
+		"""Internal. Explode and log a message received from the network, along
+		with its trace if it is traced. Runs in the worker in charge of the
+		peer that sent it."""
+		if trace != None:
+			trace.stamp("workers")
+		if self.metrics != None:
+			self.__received.inc()
+			then = time.monotonic()
+		try:
+			msg = protocol.Message.explode(data)
+		except (ValueError, TypeError, zlib.error) as err:
+			self.logger.warning("Dropped a malformed message : %s", err)
+			return
+		finally:
+			if hasattr(data, "close"):
+				data.close() # A message spilled to disk
+		if self.metrics != None:
+			self.__explosions.observe(time.monotonic() - then)
+		if trace != None:
+			trace.stamp("explode")
+
+		# In a cluster, new messages are logged once claimed, by the claimer
+		usig = msg.usig()
+		if self.claimer != None and msg.is_alive() and not msg in self.mpile and not usig in self.__owned:
+			if not usig in self.__foreign:
+				self.claimer.submit(usig, msg.get_timestamp() + msg.get_ttl(), msg, trace)
+			return
+		self.__welcome(msg, trace)
+
+	def __claimed(self, won, msgobj, trace):
+		"""Internal. Hear whether we claimed a message first among the processes
+		of our cluster, and log it if we did. Runs in the claimer."""
+		expiry = msgobj.get_timestamp() + msgobj.get_ttl()
+		if not won:
+			self.__foreign[msgobj.usig()] = expiry
+			return
+		self.__owned[msgobj.usig()] = expiry
+		self.__welcome(msgobj, trace)
+
+	def __welcome(self, msgobj, trace = None):
+		"""Internal. Log a message received from the network, and tell whoever
+		wants to know if it was new to us."""
+		if self.handle_new_message(msgobj, trace):
+			for callback in self.on_new_message_callbacks:
+				callback(msgobj)
+
+	def __add_in_inbox(self, msgobj, trace = None):
+		"""Internal. Have a message logged in the Inbox if we're tuned to its
+		channel, by the CPU thread. Returns False if it won't be."""
 		if msgobj.channel in self.tuned_channels and not self.inbox.get(msgobj.usig(), False):
 			msg = {
 				"timestamp":	msgobj.get_timestamp(),
@@ -378,49 +567,92 @@ class Stolas:
 				"payload":		msgobj.get_payload()
 			}
 			# Send the message to the CPU thread
-			self.tasks.put(("inbox_add", (msgobj.usig(), msg)))
+			self.tasks.put(("inbox_add", (msgobj.usig(), msg, trace)))
+			return True
+		return False
 
 	def remove_inbox_message(self, usig):
 		self.tasks.put(("inbox_del", usig))
 
-	def handle_new_message(self, msgobj):
+	def __claim(self, msgobj):
+		"""Internal. Claim a message for us among the processes of our cluster,
+		right away, unless we know who has it already. Returns False if
+		another one did first."""
+		usig = msgobj.usig()
+		if usig in self.__owned:
+			return True
+		if usig in self.__foreign:
+			return False
+		expiry = msgobj.get_timestamp() + msgobj.get_ttl()
+		if self.claims.claim(usig, expiry):
+			self.__owned[usig] = expiry
+			return True
+		self.__foreign[usig] = expiry
+		return False
+
+	def __wants(self, usig):
+		"""Internal. Tells the networker whether a message it starts receiving
+		in chunks, given its raw signature, is new to us."""
+		usig = hex(b2i(usig))[2:]
+		return not self.mpile.knows(usig) and not usig in self.__foreign
+
+	def handle_new_message(self, msgobj, trace = None):
+		"""Log a message in the MPile and the Inbox, optionally following its
+		trace (see stolas.tracing). Returns True if the message was new to
+		us."""
 		if not msgobj.is_alive():
-			return
-
-		if not msgobj in self.mpile:
-			mid = self.mpile.add(msgobj)
-			self.logger.info("Logged in message {0}".format(mid))
-
-		self.__add_in_inbox(msgobj)
+			return False
+		if self.claims != None and not msgobj in self.mpile and not self.__claim(msgobj):
+			return False # Another process of our cluster logged it already
+
+		# Adding is atomic, so a message coming from several peers at once is
+		# only ever new once
+		mid = self.mpile.add(msgobj)
+		new = mid != None
+		if new:
+			if len(self.mpile) == 1:
+				self.schedule_distribution() # Nothing was being distributed
+			self.logger.info("Logged in message %s", mid)
+		if trace != None:
+			trace.stamp("mpile")
+
+		if not self.__add_in_inbox(msgobj, trace) and trace != None:
+			trace.finish() # Its journey ends here
+		return new
 
 	def send_message(self, channel, payload, ttl = 120):
 		if len(payload) == 0:
 			return False
 		msgobj = protocol.Message(channel = channel, payload = payload, ttl = ttl)
-		bmessage = msgobj.implode()
-		payload_len = i2b(len(bmessage), 3)
-		if payload_len == b"\0\0":
-			return False
+		self.__fan_out(msgobj)
+		self.handle_new_message(msgobj)
 
-		self.networker.peerlock.acquire()
+	def __fan_out(self, msgobj):
+		"""Internal. Send a message to all of our peers. The packet is built
+		once, kept by the message for its next distributions, and shared by
+		every peer's output buffer."""
+		reused = msgobj.is_imploded()
+		if len(msgobj.implode()) > protocol.CHUNK_SIZE:
+			# Sent in pieces, that other packets can go in between
+			frame = msgobj.chunks()
+		else:
+			frame = msgobj.frame()
+		self.__stats_lock.acquire()
+		if reused:
+			self.implosions["reused"] += 1
+			self.implosions["saved"] += msgobj.size()
+		else:
+			self.implosions["compressed"] += 1
+		self.__stats_lock.release()
+		if self.metrics != None:
+			self.__broadcasts.inc()
+		# Fan out on a snapshot of the peers, never blocking on new connections
 		for peerid in self.networker.peers:
-			self.networker.peer_send(peerid, protocol.MESSAGE_BYTE, payload_len + bmessage)
-		self.networker.peerlock.release()
-
-		self.handle_new_message(msgobj)
+			self.networker.raw_peer_send(peerid, frame)
 
 	def message_broadcast(self, msgobj):
 		#FIXME : Is only kept for backwards compatibility
-		data = msgobj.implode()
-
-		payload_len = i2b(len(data), 3)
-		if payload_len == b"\0\0":
-			return False
-
-		self.networker.peerlock.acquire()
-		for peerid in self.networker.peers:
-			self.networker.peer_send(peerid, protocol.MESSAGE_BYTE, payload_len + data)
-		self.networker.peerlock.release()
+		self.__fan_out(msgobj)
 		if not msgobj in self.mpile and msgobj.is_alive():
 			mid = self.mpile.add(msgobj)
-			self.logger.info("Logged in message {0}".format(mid))
+			self.logger.info("Logged in message %s", mid)
@@ -0,0 +1,84 @@
+# ~ stolas/throttle.py: Throttling Module ~
+#
+#  This module defines the token buckets limiting the rate at which we read
+#   from and write to peers, in bytes and in frames per second, for each peer
+#   and for all of them at once.
+#
+
+import threading	# `threading.Lock`
+import time			# `time.monotonic`
+
+class TokenBucket:
+	"""Token bucket on the monotonic clock.
+	Tokens are refilled at `rate` per second, up to `burst`. Taking tokens
+	never fails : the bucket goes into debt, and whoever takes from it is
+	expected to wait for `delay()` seconds before taking again."""
+	def __init__(self, rate, burst = None):
+		"""Initialization requires the rate, in tokens per second. The burst
+		defaults to a second worth of tokens."""
+		self.rate = rate
+		self.burst = burst if burst != None else rate
+		self.tokens = self.burst
+		self.stamp = time.monotonic()
+		self.lock = threading.Lock()
+
+	def __repr__(self):
+		return "TokenBucket(rate={0}, tokens={1:.0f})".format(self.rate, self.tokens)
+
+	def __refill(self):
+		"""Internal. The lock must be held."""
+		now = time.monotonic()
+		self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+		self.stamp = now
+
+	def take(self, amount):
+		self.lock.acquire()
+		self.__refill()
+		self.tokens -= amount
+		self.lock.release()
+
+	def delay(self):
+		"""Time to wait before the bucket is out of debt."""
+		self.lock.acquire()
+		self.__refill()
+		delay = max(0, -self.tokens / self.rate)
+		self.lock.release()
+		return delay
+
+class Throttle:
+	"""Limits on the traffic in one direction, as a (bytes, frames) per
+	second tuple, either of which can be None. A throttle can have a parent
+	throttle, shared with others, whose limits apply as well."""
+	def __init__(self, rates = None, parent = None):
+		"""Initialization optionally takes the rates and the parent throttle."""
+		self.buckets = []
+		if rates != None:
+			self.buckets = [TokenBucket(rate) if rate != None else None for rate in rates]
+		self.parent = parent
+		self.throttled = 0 # Seconds we had to wait so far
+
+	def __repr__(self):
+		return "Throttle(buckets={0}, throttled={1:.2f}s)".format(self.buckets, self.throttled)
+
+	def limited(self):
+		"""Tells whether or not any limit applies."""
+		return len([bucket for bucket in self.buckets if bucket != None]) > 0 or (self.parent != None and self.parent.limited())
+
+	def delay(self):
+		"""Time to wait before more traffic is allowed."""
+		delays = [bucket.delay() for bucket in self.buckets if bucket != None]
+		if self.parent != None:
+			delays.append(self.parent.delay())
+		return max(delays + [0])
+
+	def account(self, size, frames = 0):
+		"""Account for `size` bytes and `frames` frames of traffic. Returns
+		the time to wait before more is allowed."""
+		for bucket, amount in zip(self.buckets, (size, frames)):
+			if bucket != None and amount > 0:
+				bucket.take(amount)
+		if self.parent != None:
+			self.parent.account(size, frames)
+		delay = self.delay()
+		self.throttled += delay
+		return delay
@@ -0,0 +1,87 @@
+# ~ stolas/tracing.py: Tracing Module ~
+#
+#  This module defines the traces following messages through the stages of a
+#   node, from the moment their bytes are received to the moment they're
+#   logged in the Inbox, and the tracer sampling them. Every stage a trace
+#   goes through is timed into a histogram of its own, so that one can tell
+#   where the time is spent. Only a fraction of what is received is traced,
+#   so that tracing can be left on.
+#
+
+import random	# `random.random`
+import time		# `time.monotonic`
+
+from .metrics import MetricsRegistry, LATENCY_BUCKETS
+
+# Stages, in the order they're gone through, each timed from the end of the
+#  previous one :
+STAGES = (
+	"parse",			# Packets sliced out of what was received
+	"iqueue",			# Waited for the networker's processor
+	"dispatch",			# Waited for the networker's worker
+	"handle",			# Handled along the packets before it in its batch
+	"imessages",		# Waited for the node's processor
+	"workers",			# Waited for the node's worker
+	"explode",			# Exploded into a message object
+	"mpile",			# Logged in the MPile
+	"inbox_queue",		# Waited for the node's processor, again
+	"inbox",			# Logged in the Inbox
+)
+
+class Trace:
+	"""Timestamps of a batch of packets, then of one message, through the
+	stages of a node. Stamping a stage records the time since the previous
+	one."""
+	__slots__ = ("tracer", "origin", "last")
+
+	def __init__(self, tracer, origin):
+		self.tracer = tracer
+		self.origin = origin
+		self.last = origin
+
+	def __repr__(self):
+		return "Trace(age={0:.6f})".format(time.monotonic() - self.origin)
+
+	def stamp(self, stage):
+		now = time.monotonic()
+		self.tracer.observe(stage, now - self.last)
+		self.last = now
+
+	def fork(self):
+		"""Returns a trace of its own for one of the messages of the batch."""
+		trace = Trace(self.tracer, self.origin)
+		trace.last = self.last
+		return trace
+
+	def finish(self):
+		"""Record the time taken through every stage."""
+		self.tracer.observe("total", time.monotonic() - self.origin)
+
+class Tracer:
+	"""Sampler of the traces, and keeper of the histograms of their stages."""
+	def __init__(self, rate = 1, metrics = None, bounds = LATENCY_BUCKETS):
+		"""Initialization takes the fraction of the batches of packets received
+		that are traced, and optionally the registry the histograms are kept
+		in (one of our own otherwise) and their buckets."""
+		self.rate = rate
+		self.metrics = metrics if metrics != None else MetricsRegistry()
+		self.stages = self.metrics.histogram("stolas_stage_seconds", "Time spent by traced messages in each stage", bounds, ["stage"])
+		# Histograms are kept at hand, since stages are stamped often
+		self.__histograms = dict([(stage, self.stages.labels(stage)) for stage in STAGES + ("total",)])
+
+	def __repr__(self):
+		return "Tracer(rate={0})".format(self.rate)
+
+	def sample(self, origin = None):
+		"""Returns a trace starting at `origin` (now, by default), or None if
+		this one isn't sampled."""
+		if self.rate < 1 and random.random() >= self.rate:
+			return None
+		return Trace(self, origin if origin != None else time.monotonic())
+
+	def observe(self, stage, elapsed):
+		self.__histograms[stage].observe(elapsed)
+
+	def histograms(self):
+		"""Returns a `stolas.utils.Histogram` of each stage, by name, in order."""
+		return [(stage, self.__histograms[stage].get()) for stage in STAGES + ("total",)]
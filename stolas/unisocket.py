@@ -10,29 +10,126 @@ import socket		# `socket.socket`
 import queue		# `queue.Queue`, `queue.Empty`
 import os			# `os.name`
 import random		# `random.randrange`, `random.choice`
+import selectors	# `selectors.DefaultSelector`, `selectors.EVENT_READ`, `selectors.EVENT_WRITE`
 import time
 
 from .protocol import *
-from .utils import b2i, i2b, PhantomLogger
-
+from .framer import Framer, FramingError, SpilledFrame
+from .buffers import OutputBuffer
+from .scheduler import Scheduler
+from .dialer import Dialer, CONNECT_TIMEOUT
+from .registry import PeerRegistry, CandidateList
+from .workers import WorkerPool
+from .throttle import Throttle
+from .chunks import Reassembler, ReassemblyLimitError
+from .selection import STRATEGIES
+from .tracing import Tracer
+from .utils import b2i, i2b, Histogram, PhantomLogger, Excerpt
+
+# Transport engines a UnisocketModel can run its peers on :
+#  - "threads" : one busy thread per peer (historical behaviour)
+#  - "selector" : one I/O thread multiplexing every socket with `selectors`
+#  - "asyncio" : peers are served by protocols on a given asyncio event loop
+ENGINES = ("threads", "selector", "asyncio")
+# What to do with bulk frames sent to a peer whose output buffer is congested :
+#  - "block" : make the producer wait until the buffer drained (or gave up),
+#     but for relayed chunks, dropped rather than stalling the peer they came
+#     from
+#  - "drop" : drop the frame
+#  - "disconnect" : drop the peer's pending output and disconnect them
+BACKPRESSURE_POLICIES = ("block", "drop", "disconnect")
+# Default (bytes, frames) high water mark of the peers' output buffers
+HIGH_WATER = (8 * 2**20, 4096)
+# Longest time between two integration checks, so that changes in our peers
+#  are noticed
+INTEGRATION_TICK = 1
+# Upper bound on the time the selector engine sleeps without looking at its
+#  running state (it is normally woken up explicitly)
+IO_TICK = 0.5
+# Buckets of the histograms of the batches of frames handed to the processor,
+#  by size (frames) and latency (seconds between their slicing and handling)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+BATCH_LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+# Default time given to the peers, from `stop`, to flush their output before
+#  it is abandoned
+SHUTDOWN_TIMEOUT = 5
+# Most bytes the asyncio engine hands to a rate limited peer's transport at
+#  once, since the transport writes whatever it is given
+AIO_THROTTLED_CHUNK = 2**16
+# Default longest packet we accept (the longest MESSAGE packet), and length
+#  from which received packets are spilled to disk instead of being buffered
+MAX_FRAME = 4 + 2**24 - 1
+SPILL_THRESHOLD = 2**20
+# Time after which a Message received in chunks is given up on, if no chunk
+#  of it came in the meantime
+REASSEMBLY_TIMEOUT = 30
+# Default socket options (see `tune_socket`), geared towards throughput :
+#  Nagle's algorithm only delays our packets since we coalesce writes
+#  ourselves, reads are large, and the kernel keeps sizing the socket buffers
+#  (None leaves them be). Keepalive probes are sent after KEEPALIVE[0] idle
+#  seconds, every KEEPALIVE[1] seconds, KEEPALIVE[2] times.
+NODELAY = True
+RECV_SIZE = 2**16
+BACKLOG = 128
+KEEPALIVE = (60, 10, 5)
+# Default time between two pings of a peer, and amount of pings in a row a
+#  peer can leave us without news for before it is evicted
+HEARTBEAT = 5
+HEARTBEAT_MISSES = 3
+# Default time between two attempts at replacing a peer with a faster one,
+#  once we have as many peers as we can (see `stolas.selection`)
+REPLACE_INTERVAL = 30
 
 class Peer:
 	"""Representation of the data surrounding a Network Peer"""
-	def __init__(self, pid, thread, verbinfo = None):
-		"""Initialization requires a Peer ID, a thread object, and, optionally, verbose information (an addr tuple)."""
+	def __init__(self, pid, thread, verbinfo = None, sock = None, high_water = None, low_water = None, ithrottle = None, othrottle = None, max_frame = None, spill = None, read_size = RECV_SIZE, coalesce = None):
+		"""Initialization requires a Peer ID, a thread object (None when the
+		peer is driven by the selector engine), and, optionally, verbose
+		information (an addr tuple), the peer's socket, the water marks
+		of its output buffer, the throttles of its input and output, the
+		framing limits and smallest read of its input (see `Framer`), and the
+		coalescing window of its output (see `OutputBuffer`)."""
 		self.pid = pid
 		self.thread = thread
-		self.oqueue = b""
-		self.iqueue = b""
+		self.sock = sock
+		self.transport = None # Set by the asyncio engine once attached
+		self.paused = False # Set by the asyncio engine while the transport is full
+		self.oqueue = OutputBuffer(high_water, low_water, coalesce)
+		self.iqueue = Framer(max_frame = max_frame, spill = spill, read_size = read_size)
 		self.version = -1
 		self.running = True
 		self.verbinfo = verbinfo
 		self.listen = None
 		self.datalock = threading.Lock()
+		self.ithrottle = ithrottle or Throttle()
+		self.othrottle = othrottle or Throttle()
+		self.reading = True # Cleared by the asyncio engine while reads are throttled
+		# Pending look at the peer once its rate limits or coalescing window
+		# allow it, and when it is due, for the selector and asyncio engines
+		self.timer = None
+		self.timer_due = None
+		# Heartbeat : the next ping, when the last one went out, when we last
+		# received anything, and how many pings in a row we got no news over
+		self.heartbeat = None
+		self.pinged = None
+		self.heard = time.monotonic()
+		self.missed = 0
+		# Smoothed round trip time and its mean deviation, in seconds (None
+		# until the first pong), estimated like TCP does (RFC 6298)
+		self.rtt = None
+		self.jitter = None
 
 	def __repr__(self):
 		return "Peer(pid={0}, verbinfo={1}, version={2})".format(self.pid, self.verbinfo, self.version)
 
+	def measure(self, sample):
+		"""Account for a round trip time sample, in seconds."""
+		if self.rtt == None:
+			self.rtt, self.jitter = sample, sample / 2
+		else:
+			self.jitter = 0.75 * self.jitter + 0.25 * abs(self.rtt - sample)
+			self.rtt = 0.875 * self.rtt + 0.125 * sample
+
 
 # Model of UniSocket P2P manager
 class UnisocketModel:
@@ -44,23 +141,96 @@ class UnisocketModel:
 		self.listen = kwargs.get("listen", True)
 		if self.listen:
 			self.listen_addr = kwargs.get("bind", "") or ""
+		# Whether several processes can listen on our port, and share the
+		# connections coming in
+		self.reuse_port = kwargs.get("reuse_port", False)
+		if self.reuse_port and not hasattr(socket, "SO_REUSEPORT"):
+			raise ValueError("SO_REUSEPORT is not supported on this platform")
 		self.name = kwargs.get("name", None)
 		if self.name == None:
 			self.name = hex(random.randrange(7800000,78000000))[2:10]
-		self.max_clients = 50
+		self.max_clients = kwargs.get("max_clients", 50)
 		self.death_sequence = DEATH_SEQUENCE
+		self.engine = kwargs.get("engine", "threads") or "threads"
+		if not self.engine in ENGINES:
+			raise ValueError("Unknown engine '{0}' (expected one of {1})".format(self.engine, ENGINES))
+		self.loop = kwargs.get("loop", None)
+		if self.engine == "asyncio" and self.loop == None:
+			raise ValueError("The asyncio engine requires an event loop")
+		self.high_water = kwargs.get("high_water", HIGH_WATER)
+		self.low_water = kwargs.get("low_water", None)
+		# Coalescing window of the peers' output, as a (seconds, bytes) tuple
+		# (see `OutputBuffer`), or None
+		self.coalesce = kwargs.get("coalesce", None)
+		self.backpressure_policy = kwargs.get("backpressure", "drop") or "drop"
+		if not self.backpressure_policy in BACKPRESSURE_POLICIES:
+			raise ValueError("Unknown backpressure policy '{0}' (expected one of {1})".format(self.backpressure_policy, BACKPRESSURE_POLICIES))
+		self.block_timeout = kwargs.get("block_timeout", 5)
+		self.connect_timeout = kwargs.get("connect_timeout", CONNECT_TIMEOUT)
+		# How many candidates we dial at once when lacking integration
+		self.dial_parallelism = kwargs.get("dial_parallelism", MIN_INTEGRATION)
+		self.shutdown_timeout = kwargs.get("shutdown_timeout", SHUTDOWN_TIMEOUT)
+		# How many workers handle the packets, sharded by Peer ID
+		self.workers = kwargs.get("workers", 1) or 1
+		# Rate limits, as (bytes, frames) per second tuples (either can be
+		# None), for each peer and for all of them, inbound and outbound
+		self.peer_inbound_rate = kwargs.get("peer_inbound_rate", None)
+		self.peer_outbound_rate = kwargs.get("peer_outbound_rate", None)
+		self.inbound = Throttle(kwargs.get("inbound_rate", None))
+		self.outbound = Throttle(kwargs.get("outbound_rate", None))
+		# Longest packet accepted from peers, and length from which packets
+		# received are spilled to disk (None never spills)
+		self.max_frame = kwargs.get("max_frame", MAX_FRAME)
+		self.spill_threshold = kwargs.get("spill_threshold", SPILL_THRESHOLD)
+		# Whether the chunks of Messages new to us are relayed to our other
+		# peers as they come, before the Messages are complete
+		self.cut_through = kwargs.get("cut_through", False)
+		# Socket options (see `tune_socket`)
+		self.nodelay = kwargs.get("nodelay", NODELAY)
+		self.sndbuf = kwargs.get("sndbuf", None)
+		self.rcvbuf = kwargs.get("rcvbuf", None)
+		self.keepalive = kwargs.get("keepalive", KEEPALIVE)
+		self.backlog = kwargs.get("backlog", BACKLOG)
+		self.recv_size = kwargs.get("recv_size", RECV_SIZE)
+		# Time between two pings of each peer (None disables the heartbeat),
+		# and amount of pings a peer can miss before it is evicted
+		self.heartbeat = kwargs.get("heartbeat", HEARTBEAT)
+		self.heartbeat_misses = kwargs.get("heartbeat_misses", HEARTBEAT_MISSES)
+		# How candidates and peers are picked : the name of a strategy from
+		# `stolas.selection`, or a strategy object
+		self.selection = kwargs.get("selection", "random") or "random"
+		if isinstance(self.selection, str):
+			if not self.selection in STRATEGIES:
+				raise ValueError("Unknown peer selection strategy '{0}' (expected one of {1})".format(self.selection, tuple(STRATEGIES)))
+			self.selection = STRATEGIES[self.selection]()
+		self.replace_interval = kwargs.get("replace_interval", REPLACE_INTERVAL)
+		# Where we record our metrics (see `stolas.metrics`), if anywhere
+		self.metrics = kwargs.get("metrics", None)
+		# What traces packets and messages through our stages (see
+		#  `stolas.tracing`) : a tracer, or the fraction of batches to trace
+		self.tracer = kwargs.get("tracer", None)
+		if self.tracer == None and kwargs.get("trace_rate", None):
+			self.tracer = Tracer(kwargs["trace_rate"], self.metrics)
 
 		# Dynamic status fields
 		self.integrated = False
 		self.running = False
-		self.now = time.time()
+		self.now = time.monotonic()
 		self.timers = {
-			"integration": 0
+			"integration": 0,
+			"replacement": 0
 		}
 
 		# Data Storage Structures
-		self.peers = {}
-		self.possible_peers = []
+		self.registry = PeerRegistry()
+		self.possible_peers = CandidateList()
+		# Messages being received in chunks
+		self.reassembler = Reassembler(max_total = self.max_frame)
+		# Called with the signature of a Message we receive chunks of for the
+		# first time, and tells whether we want it (None wants them all)
+		self.chunk_filter = None
+		# How many times each backpressure policy fired
+		self.backpressure = dict([(policy, 0) for policy in BACKPRESSURE_POLICIES])
 
 		# Communication Structures
 		self.listen_socket = None
@@ -72,7 +242,26 @@ class UnisocketModel:
 		self.omessages = queue.Queue()
 
 		# Control Structures
+		# The peer lock serializes changes to the registry. Readers go through
+		# its snapshots and never take it.
 		self.peerlock = threading.Lock()
+		# Notified by every peer leaving the registry
+		self.__peer_gone = threading.Condition(self.peerlock)
+		self.__stats_lock = threading.Lock()
+		self.__shutdown_deadline = None
+		# Output the peers could not flush before the shutdown deadline
+		self.abandoned = {"peers": 0, "frames": 0, "bytes": 0}
+		# Seconds the peers had to wait for their rate limits
+		self.throttled = {"inbound": 0, "outbound": 0}
+		# Batches of frames handled by the processor
+		self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+		self.batch_latency = Histogram(BATCH_LATENCY_BUCKETS)
+		# Timers of the processor, which is woken up by an empty item
+		self.scheduler = Scheduler(wakeup = lambda: self.iqueue.put(None))
+		self.__integration = None
+		self.__integration_lock = threading.Lock()
+		# Guards the candidates, shared by the workers and the integration
+		self.__candidates_lock = threading.Lock()
 
 		# The logger
 		self.logger = kwargs.get("logger", PhantomLogger())
@@ -87,6 +276,57 @@ class UnisocketModel:
 			target = self.__processor_unit,
 			name = "Processor" + self.__nametag()
 		)
+		self.pool = WorkerPool(self.workers, self.__handle_batch, "Worker" + self.__nametag() + ",", self.logger)
+		self.dialer = Dialer(self.__dialed, self.__dial_failed, self.connect_timeout, self.__nametag(), self.tune_socket)
+		if self.metrics != None:
+			self.__register_metrics()
+
+		# Selector and asyncio engine structures. Peers that need their
+		# registration refreshed are marked dirty, and the I/O thread (or the
+		# event loop) is woken up so that it never has to poll.
+		self.__io_dirty = set()
+		self.__io_lock = threading.Lock()
+		if self.engine == "selector":
+			self.selector = selectors.DefaultSelector()
+			self.__wakeup_r, self.__wakeup_w = socket.socketpair()
+			self.__wakeup_r.setblocking(False)
+			self.__wakeup_w.setblocking(False)
+			self.selector.register(self.__wakeup_r, selectors.EVENT_READ)
+			# Timers of the I/O thread, for the ends of throttling
+			self.io_scheduler = Scheduler(wakeup = self.__io_wakeup)
+			self.io = threading.Thread(
+				target = self.__io_loop,
+				name = "IO" + self.__nametag()
+			)
+
+	def __register_metrics(self):
+		"""Internal. Register our metrics. Those updated on the hot path are
+		kept at hand, the others are collected from our state."""
+		metrics = self.metrics
+		traffic = metrics.counter("stolas_bytes_total", "Bytes exchanged with peers", ["direction"])
+		self.__bytes = {"inbound": traffic.labels("inbound"), "outbound": traffic.labels("outbound")}
+		received = metrics.counter("stolas_packets_received_total", "Packets received from peers", ["type"])
+		self.__packets_in = dict([(header, received.labels(name)) for header, name in PACKET_NAMES.items()])
+		sent = metrics.counter("stolas_packets_sent_total", "Packets queued for peers", ["type"])
+		self.__packets_out = dict([(header, sent.labels(name)) for header, name in PACKET_NAMES.items()])
+
+		metrics.gauge("stolas_peers", "Connected peers", function = lambda: len(self.registry))
+		metrics.gauge("stolas_candidates", "Addresses of possible peers", function = lambda: len(self.possible_peers))
+		metrics.gauge("stolas_dialing", "Connections being attempted", function = lambda: len(self.dialer))
+		metrics.gauge("stolas_integrated", "Whether we have enough peers", function = lambda: self.integrated)
+		metrics.gauge("stolas_iqueue_batches", "Batches of packets waiting for the processor", function = self.iqueue.qsize)
+		metrics.gauge("stolas_imessages_queued", "Messages and tasks waiting for the upper layer", function = self.imessages.qsize)
+		metrics.gauge("stolas_unisocket_worker_queued", "Batches of packets waiting for the workers", function = self.pool.pending)
+		metrics.gauge("stolas_output_buffered_bytes", "Bytes waiting to be sent to peers",
+			function = lambda: sum([peer.oqueue.size for peer in self.peers.values()]))
+		metrics.gauge("stolas_reassemblies", "Messages being received in chunks", function = lambda: len(self.reassembler))
+		metrics.gauge("stolas_peer_rtt_seconds", "Smoothed round trip time of each peer", ["peer"],
+			function = lambda: dict([(str(pid), peer.rtt) for pid, peer in self.peers.items() if peer.rtt != None]))
+		metrics.counter("stolas_backpressure_total", "Firings of each backpressure policy", ["policy"], function = lambda: dict(self.backpressure))
+		metrics.counter("stolas_throttled_seconds_total", "Time peers waited for their rate limits", ["direction"], function = lambda: dict(self.throttled))
+		metrics.counter("stolas_abandoned_bytes_total", "Output dropped on shutdown", function = lambda: self.abandoned["bytes"])
+		metrics.histogram("stolas_batch_frames", "Packets per batch handed to the processor", BATCH_SIZE_BUCKETS, function = lambda: self.batch_sizes)
+		metrics.histogram("stolas_batch_latency_seconds", "Time between the slicing and the handling of batches", BATCH_LATENCY_BUCKETS, function = lambda: self.batch_latency)
 
 	def __del__(self):
 		#self.logger.debug("UniSocket model deleted")
@@ -104,168 +344,376 @@ class UnisocketModel:
 		self.running = True
 		if self.listen:
 			self.__start_listen() # There might be errors here, so we don't start anything
+		if self.engine == "selector":
+			self.io.start()
+		self.dialer.start()
+		self.pool.start()
 		self.processor.start()
 
 	def __is_already_peer(self, verbinfo):
-		return (self.listen and verbinfo == (self.listen_addr, self.port)) or verbinfo in (self.peers[peer].listen for peer in self.peers if self.peers[peer].listen != None)
+		return (self.listen and verbinfo == (self.listen_addr, self.port)) or self.registry.find(verbinfo) != None
 
 	def __is_already_known(self, verbinfo):
-		return self.__is_already_peer(verbinfo) or verbinfo in self.possible_peers
+		"""Internal. The candidates lock must be held."""
+		return self.__is_already_peer(verbinfo) or verbinfo in self.possible_peers or self.dialer.dialing(verbinfo)
+
+	def __dialed(self, verbinfo, sock, elapsed):
+		"""Internal. Called by the dialer once an outbound connection is up."""
+		self.logger.debug("Connected to %s in %.3fs", verbinfo, elapsed)
+		self.selection.connected(verbinfo, elapsed)
+		self.peer_add(verbinfo, sock, outbound = True)
+		self.schedule_integration()
+
+	def __dial_failed(self, verbinfo, error):
+		"""Internal. Called by the dialer when an outbound connection failed."""
+		self.logger.warning("Will not add new Peer : couldn't connect to %s (%s)", verbinfo, type(error))
+		self.selection.failed(verbinfo)
+		self.schedule_integration()
 
 	def __peer_both_ways(self, sock, pid):
 		"""Internal. Runs the network exchange logic between a Peer and our UniSocket Model."""
 		# We want a non blocking socket to be able to alternative without stopping between I and O
 		sock.settimeout(0)
-		self.logger.debug("Started peer {0}".format(pid))
+		self.logger.debug("Started peer %s", pid)
 		peer = self.peers[pid] # Peer object access is faster
-		while peer.running or peer.oqueue != b"":
+		while peer.running or len(peer.oqueue) > 0:
 			self.peer_lock(pid)
-			# If output must be sent, then so be it
+			# If output must be sent, then so be it, unless throttled
 			if len(peer.oqueue) > 0:
-				try:
-					sock.send(peer.oqueue)
-				except BlockingIOError:
-					continue
-				except BrokenPipeError:
-					self.logger.warning("BROKEN Pipe! Connection with peer {0} broken".format(pid))
-					self.peer_unlock(pid)
-					break
-				except ConnectionResetError:
-					self.logger.warning("Connection Reset with Peer {0}".format(pid))
+				if peer.othrottle.delay() == 0 and peer.oqueue.holding() == 0 and not self.__peer_write(peer):
 					self.peer_unlock(pid)
 					break
-				except ConnectionAbortedError:
-					self.logger.warning("Connection Aborted with Peer {0}".format(pid))
-					#FixME: Look for an ancestry "NetworkError" class
-
-				self.logger.debug("[{0}] << {1}".format(pid, peer.oqueue))
-				peer.oqueue = b""
 			elif not peer.running:
 				self.peer_unlock(pid)
 				break
 
 			# No iqueue means we're being deleted; no need to recv, or parse
-			if peer.iqueue == None:
-				self.peer_unlock(pid)
-				continue
-
-			# Create the Differed Delta Frame, fancy word for "Data that's new"
-			ddf = b""
-			try:
-				ddf += sock.recv(1024)
-			except BlockingIOError:
-				pass
-			except ConnectionResetError:
-				self.logger.warning("Connection Reset with Peer {0}".format(pid))
-				self.peer_unlock(pid)
-				break
-			except ConnectionAbortedError:
-				self.logger.warning("Connection Aborted with Peer {0}".format(pid))
+			if peer.iqueue != None and peer.ithrottle.delay() == 0 and not self.__peer_read(peer):
 				self.peer_unlock(pid)
 				break
+			self.peer_unlock(pid)
 
-			# No news is good news
-			if ddf == b"":
-				self.peer_unlock(pid)
-				continue
+		self._peer_close(peer)
 
-			peer.iqueue += ddf
-			self.logger.debug("[{0}] >> {1}".format(pid, ddf))
+	def __peer_write(self, peer):
+		"""Internal. Try and send the peer's output buffer. The peer must be
+		locked. Returns False when the connection is broken."""
+		try:
+			completed = peer.oqueue.completed
+			sent = peer.oqueue.flush(peer.sock)
+			self.__throttle(peer, "outbound", sent, peer.oqueue.completed - completed)
+		except BlockingIOError:
+			return True
+		except BrokenPipeError:
+			self.logger.warning("BROKEN Pipe! Connection with peer %s broken", peer.pid)
+			return False
+		except ConnectionResetError:
+			self.logger.warning("Connection Reset with Peer %s", peer.pid)
+			return False
+		except ConnectionAbortedError:
+			self.logger.warning("Connection Aborted with Peer %s", peer.pid)
+			return False
 
-			self.parse_packets(pid)
-			self.peer_unlock(pid)
+		self.logger.debug("[%s] << %s bytes", peer.pid, sent)
+		return True
+
+	def __peer_read(self, peer):
+		"""Internal. Receive whatever the peer sent and parse it. The peer must
+		be locked. Returns False when the connection is broken or closed."""
+		# Receive straight into the input buffer, which sizes the read
+		try:
+			with peer.iqueue.reserve() as view:
+				size = peer.sock.recv_into(view)
+		except BlockingIOError:
+			return True # No news is good news
+		except ConnectionResetError:
+			self.logger.warning("Connection Reset with Peer %s", peer.pid)
+			return False
+		except ConnectionAbortedError:
+			self.logger.warning("Connection Aborted with Peer %s", peer.pid)
+			return False
+
+		# A non blocking socket only reads nothing once the other end closed it
+		if size == 0:
+			self.logger.warning("Connection Closed by Peer %s", peer.pid)
+			return False
 
-		sock.close()
-		# Only the UniSocket Peer Thread of a specific Peer can eventually erase itself
+		self._peer_received(peer, size)
+		return True
+
+	def _peer_received(self, peer, size):
+		"""Commit `size` bytes freshly received in the peer's input buffer
+		(see `Framer.reserve`) and parse them. The peer must be locked. Shared
+		with the engines' modules. Returns the time to wait before reading
+		from the peer again."""
+		peer.iqueue.commit(size)
+		peer.heard = time.monotonic()
+		self.logger.debug("[%s] >> %s bytes", peer.pid, size)
+
+		frames = self.parse_packets(peer.pid)
+		return self.__throttle(peer, "inbound", size, frames)
+
+	def __throttle(self, peer, direction, size, frames):
+		"""Internal. Account for traffic with a peer in one direction. Returns
+		the time to wait before more is allowed."""
+		if self.metrics != None:
+			self.__bytes[direction].inc(size)
+		throttle = peer.ithrottle if direction == "inbound" else peer.othrottle
+		delay = throttle.account(size, frames)
+		if delay > 0:
+			self.__stats_lock.acquire()
+			self.throttled[direction] += delay
+			self.__stats_lock.release()
+		return delay
+
+	def __wake_later(self, peer, delay):
+		"""Internal. Selector and asyncio engines : have a peer looked at again
+		in `delay` seconds, once its rate limits or its coalescing window
+		allow it. Runs on the I/O thread (or the event loop)."""
+		due = time.monotonic() + delay
+		if peer.timer != None:
+			if peer.timer_due <= due:
+				return
+			if self.engine == "selector":
+				self.io_scheduler.cancel(peer.timer)
+			else:
+				peer.timer.cancel()
+		if self.engine == "selector":
+			peer.timer = self.io_scheduler.call_later(delay, self.__wake, peer)
+		else:
+			peer.timer = self.loop.call_later(delay, self.__wake, peer)
+		peer.timer_due = due
+
+	def __wake(self, peer):
+		"""Internal. The time a peer had to wait for is over."""
+		peer.timer = None
+		if self.peer_get(peer.pid) is not peer:
+			return # Gone meanwhile
+		if self.engine == "selector":
+			self.__io_sync(peer)
+		else:
+			self._aio_flush(peer)
+
+	def _peer_close(self, peer):
+		"""Close the peer's socket and unregister it. Shared with the engines'
+		modules."""
+		peer.sock.close()
+		self.scheduler.cancel(peer.heartbeat)
+		# Only the engine driving a specific Peer can eventually erase it
 		# That ensures we never run into a situation where a semi-ghost peer thread runs
 		self.peerlock.acquire()
-		self.peer_lock(pid)
-		del self.peers[pid]
+		if self.registry.get(peer.pid) is not peer:
+			self.peerlock.release()
+			return # Already closed
+		self.peer_lock(peer.pid)
+		self.registry.remove(peer.pid)
 		peer.datalock.release() # The peer isn't registered any more
+		self.__peer_gone.notify_all()
 		self.peerlock.release()
-		self.logger.debug("Stopped peer {0}".format(pid))
-
-	def parse_packets(self, peerid):
-		"""Parse the peer's input buffer and slice the packets when complete so
-		that they're processed later. Requires the peer's Peer ID."""
-		peer = self.peer_get(peerid)
-		# IMPORTANT: We get a snapshot of the input buffer, not a reference to it. It saves time.
-		data = peer.iqueue
-		while data and len(data) > 0:
-			# Just refer to the protocol
-			if data[0] == HELLO_BYTE:
-				if len(data) < 2:
-					break
-				self.iqueue.put((data[0:2], peerid))
-				data = data[2:]
-
-			elif data[0] == GOODBYE_BYTE:
-				self.iqueue.put((data[:1], peerid))
-				data = data[1:]
-
-			elif data[0] == SHAREPEER_BYTE: # Share Peer
-				if len(data) < 2:
-					break
-
-				addr_len = data[1]
-				if len(data) < 4 + addr_len:
-					break
-
-				if addr_len > 2: # No address would be so short
-					self.iqueue.put((data[:4+addr_len], peerid))
-				data = data[4+addr_len:]
-
-			elif data[0] == REQUESTPEER_BYTE: # Request Byte
-				self.iqueue.put((b"\x04", peerid))
-				data = data[1:]
-
-			elif data[0] == MESSAGE_BYTE:
-				if len(data) < 4:
-					break
-
-				payload_len = b2i(data[1:4])
-				if len(data) < 4 + payload_len:
-					break
+		self.logger.debug("Stopped peer %s", peer.pid)
+
+	def __io_loop(self):
+		"""Internal. Selector engine : a single thread multiplexing the listen
+		socket and every peer socket, only waking up on readiness."""
+		self.logger.debug("I/O loop ready")
+		listening = self.listen
+		while self.running or len(self.peers) > 0:
+			self.io_scheduler.run_pending()
+			timeout = self.io_scheduler.timeout()
+			for key, events in self.selector.select(timeout = IO_TICK if timeout == None else min(IO_TICK, timeout)):
+				if key.fileobj is self.__wakeup_r:
+					try:
+						while self.__wakeup_r.recv(1024):
+							pass
+					except BlockingIOError:
+						pass
+				elif key.fileobj is self.listen_socket:
+					self.__io_accept()
+				else:
+					self.__io_ready(key.data, events)
 
-				self.iqueue.put((data[:4+payload_len], peerid))
-				data = data[4 + payload_len:]
+			if listening and not self.running:
+				self.__stop_listen()
+				listening = False
 
-			elif data[0] == MESSAGEACK_BYTE:
-				if len(data) < 4:
-					break
-				self.iqueue.put((data[:4], peerid))
-				data = data[4:]
-
-			elif data[0] == MALFORMED_DATA:
-				if len(data) < 3:
-					break
-				self.iqueue.put((data[:3], peerid))
-				data = data[3:]
-
-			elif data[0] == ADVERTISE_BYTE:
-				if len(data) < 2:
-					break
+			self.__io_lock.acquire()
+			dirty, self.__io_dirty = self.__io_dirty, set()
+			self.__io_lock.release()
+			for pid in dirty:
+				peer = self.peer_get(pid)
+				if peer:
+					self.__io_sync(peer)
+
+		self.selector.close()
+		self.__wakeup_r.close()
+		self.__wakeup_w.close()
+		self.logger.debug("I/O loop stopped")
+
+	def __io_accept(self, add = None):
+		"""Internal. Accept every pending connection on the listen socket, and
+		hand them to `add` (`peer_add` by default)."""
+		add = add or self.peer_add
+		while self.running:
+			try:
+				psock, pinfo = self.listen_socket.accept()
+			except BlockingIOError:
+				return
+			except OSError:
+				return # Happens with ERRno24 : too many files open
+			add(pinfo, psock)
+
+	def __aio_peer_add(self, pinfo, psock):
+		"""Internal. Add a peer accepted by the event loop, off the loop, since
+		that takes the peer lock."""
+		self.loop.run_in_executor(None, self.peer_add, pinfo, psock)
+
+	def __io_ready(self, peer, events):
+		"""Internal. Serve a peer whose socket became ready."""
+		self.peer_lock(peer.pid)
+		alive = True
+		if events & selectors.EVENT_WRITE and len(peer.oqueue) > 0:
+			alive = self.__peer_write(peer)
+		if alive and events & selectors.EVENT_READ and peer.iqueue != None:
+			alive = self.__peer_read(peer)
+		if not alive:
+			peer.running = False
+			peer.oqueue.clear()
+		self.peer_unlock(peer.pid)
+		self.__io_sync(peer)
+
+	def __io_sync(self, peer):
+		"""Internal. Align the selector registration of a peer with its state,
+		and close it once it stopped and has nothing left to send."""
+		if not peer.running and len(peer.oqueue) == 0:
+			try:
+				self.selector.unregister(peer.sock)
+			except (KeyError, ValueError):
+				pass
+			self._peer_close(peer)
+			return
 
-				addr_len = data[1]
-				if len(data) < 4 + addr_len:
-					break
+		# Throttled directions are left out until the peer's limits allow them
+		events, wait = 0, 0
+		if peer.iqueue != None:
+			delay = peer.ithrottle.delay()
+			if delay == 0:
+				events |= selectors.EVENT_READ
+			wait = max(wait, delay)
+		if len(peer.oqueue) > 0:
+			delay = max(peer.othrottle.delay(), peer.oqueue.holding())
+			if delay == 0:
+				events |= selectors.EVENT_WRITE
+			wait = max(wait, delay)
+		if wait > 0:
+			self.__wake_later(peer, wait)
 
-				self.iqueue.put((data[:4+addr_len], peerid))
-				data = data[4+addr_len:]
+		try:
+			key = self.selector.get_key(peer.sock)
+		except KeyError:
+			if events != 0:
+				self.selector.register(peer.sock, events, peer)
+		else:
+			if events == 0:
+				self.selector.unregister(peer.sock)
+			elif key.events != events:
+				self.selector.modify(peer.sock, events, peer)
+
+	def __io_touch(self, pid):
+		"""Internal. Mark a peer for registration refresh and wake the I/O
+		thread (or the event loop) up. Does nothing with the threads engine."""
+		if self.engine == "threads":
+			return
+		self.__io_lock.acquire()
+		wake = len(self.__io_dirty) == 0
+		self.__io_dirty.add(pid)
+		self.__io_lock.release()
+		if self.engine == "selector":
+			self.__io_wakeup()
+		elif wake:
+			self.loop.call_soon_threadsafe(self.__aio_sync)
+
+	def __aio_sync(self):
+		"""Internal. Asyncio engine : called on the event loop to hand the
+		dirty peers' output to their transports, and close the stopped ones."""
+		self.__io_lock.acquire()
+		dirty, self.__io_dirty = self.__io_dirty, set()
+		self.__io_lock.release()
+		for pid in dirty:
+			peer = self.peer_get(pid)
+			if peer:
+				self._aio_flush(peer)
+
+	def _aio_flush(self, peer):
+		"""Asyncio engine : write the peer's output to its transport, if it is
+		attached yet, and close it once it stopped. Runs on the event loop."""
+		if peer.transport == None:
+			return # connection_made will flush it
+
+		# Reads are paused for as long as the peer's input is throttled
+		delay = peer.ithrottle.delay() if peer.iqueue != None else 0
+		if delay > 0:
+			if peer.reading:
+				peer.transport.pause_reading()
+				peer.reading = False
+			self.__wake_later(peer, delay)
+		elif not peer.reading:
+			peer.transport.resume_reading()
+			peer.reading = True
+
+		chunk = AIO_THROTTLED_CHUNK if peer.othrottle.limited() else None
+		while len(peer.oqueue) > 0:
+			if peer.paused and peer.running:
+				return # resume_writing will flush it
+			delay = max(peer.othrottle.delay(), peer.oqueue.holding())
+			if delay > 0:
+				self.__wake_later(peer, delay)
+				return
+			segments = peer.oqueue.take(chunk)
+			peer.oqueue.writes += 1
+			peer.transport.writelines(segments)
+			self.__throttle(peer, "outbound", sum([len(segment) for segment in segments]), len(segments))
+			self.logger.debug("[%s] << %s frames", peer.pid, len(segments))
+		if not peer.running:
+			peer.transport.close() # Flushes first, then calls connection_lost
+
+	def __io_wakeup(self):
+		"""Internal. Wake the I/O thread up."""
+		try:
+			self.__wakeup_w.send(b"\0")
+		except (BlockingIOError, OSError):
+			pass # Already awake, or already gone
 
-			elif data[0:56] == self.death_sequence:
-				self.logger.info("Found the Death Sequence")
-				self.iqueue.put((self.death_sequence, peerid))
-				data = b""
+	def parse_packets(self, peerid):
+		"""Slice the complete packets out of the peer's input framer so that
+		they're processed later, handed to the processor all at once.
+		Requires the peer's Peer ID. Returns the amount of packets."""
+		peer = self.peer_get(peerid)
+		frames = []
+		while True:
+			try:
+				for frame in peer.iqueue.frames():
+					if frame[0] == SHAREPEER_BYTE and frame[1] <= 2:
+						continue # No address would be so short
+					if frame == self.death_sequence:
+						self.logger.info("Found the Death Sequence")
+					frames.append(frame)
+				break
 
-			else:
-				paylen = len(data)
+			except FramingError as err:
+				# What follows an oversized packet can still be sliced
+				paylen = err.discarded
 				if paylen >= 2**16:
 					paylen = (2**16)-1
 				self.peer_send(peerid, MALFORMED_DATA, i2b(paylen, 2))
-				data = b""
 
-		peer.iqueue = data # Refresh the data from our modified snapshot
+		if len(frames) > 0:
+			trace = None
+			if self.tracer != None:
+				trace = self.tracer.sample(peer.heard)
+				if trace != None:
+					trace.stamp("parse")
+			self.iqueue.put((frames, peerid, time.monotonic(), trace))
+		return len(frames)
 
 	def __listener_thread(self):
 		"""Listening thread. Responsible for the creation of all Peer Threads."""
@@ -281,64 +729,116 @@ class UnisocketModel:
 
 
 			npid = self.peer_add(pinfo, psock)
+		self.__stop_listen()
+		self.logger.debug("Stopped")
+
+	def __stop_listen(self):
+		"""Internal. Shut the listen socket down."""
+		if self.engine == "selector":
+			self.selector.unregister(self.listen_socket)
+		elif self.engine == "asyncio":
+			self.loop.remove_reader(self.listen_socket)
 		try:
 			self.listen_socket.shutdown(socket.SHUT_RDWR)
 		except OSError:
 			pass # Happens on Windows when the socket tried to send data
 		self.listen_socket.close()
-		self.logger.debug("Stopped")
 
-	def peer_add(self, verbinfo, sock = None):
+	def peer_add(self, verbinfo, sock = None, outbound = False):
 		"""Add a peer, either from an info tuple, or an info tuple and a socket.
 		If the socket is None, then this means initiating a connection, creating sock,
-		connecting it, and eventually creating and storing the informations of the peer."""
+		connecting it, and eventually creating and storing the informations of the peer.
+		A socket we connected ourselves is flagged with `outbound`, so that we
+		advertise our listen address to it."""
 		if not self.running:
+			if sock != None:
+				sock.close() # Nobody else will
 			return False
 
-		self.peerlock.acquire()
-		# New PeerID
-		npid = 0
-		while self.peer_get(npid):
-			npid += 1
-
-		advertise = True
-
-		# Initiating the connection
+		# Initiating the connection. We never hold the peer lock while waiting
+		# for the network, so that nothing else is held up by it.
 		if sock == None:
 			if self.__is_already_peer(verbinfo):
-				self.logger.warning("Will not add new Peer : already connected to {0}".format(verbinfo))
-				self.peerlock.release()
+				self.logger.warning("Will not add new Peer : already connected to %s", verbinfo)
 				return False
 
 			try:
-				sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-				sock.connect(verbinfo)
-			except Exception as e:
-				self.logger.warning("Will not add new Peer : couldn't connect to {0} ({1})".format(verbinfo, type(e)))
-				self.peerlock.release()
-				return False
-			except OSError:
+				sock = socket.create_connection(verbinfo, timeout = self.connect_timeout)
+			except OSError as e:
+				self.logger.warning("Will not add new Peer : couldn't connect to %s (%s)", verbinfo, type(e))
 				return False
-		else:
-			# We gotta advertise
-			advertise = False
-
-		# New Peer Attached to their Thread
-		trd = threading.Thread(
-			target = self.__peer_both_ways,
-			args = (sock, npid),
-			name = "Peer::{0}".format(npid) + self.__nametag()
-		)
+			outbound = True
 
-		self.peers[npid] = Peer(npid, trd, verbinfo)
-		self.peers[npid].thread.start()
+		self.tune_socket(sock)
+		self.peerlock.acquire()
+		if outbound and self.__is_already_peer(verbinfo):
+			self.logger.warning("Will not add new Peer : already connected to %s", verbinfo)
+			self.peerlock.release()
+			sock.close()
+			return False
+
+		# New PeerID
+		npid = self.registry.allocate()
+
+		# We gotta advertise
+		advertise = outbound
+
+		# New Peer Attached to their Thread, or to the I/O thread
+		trd = None
+		if self.engine == "threads":
+			trd = threading.Thread(
+				target = self.__peer_both_ways,
+				args = (sock, npid),
+				name = "Peer::{0}".format(npid) + self.__nametag()
+			)
+		else:
+			sock.setblocking(False)
+
+		peer = Peer(npid, trd, verbinfo, sock, self.high_water, self.low_water,
+			Throttle(self.peer_inbound_rate, self.inbound), Throttle(self.peer_outbound_rate, self.outbound),
+			self.max_frame, self.spill_threshold, self.recv_size, self.coalesce)
+		self.registry.add(peer)
+		if trd != None:
+			trd.start()
+		elif self.engine == "asyncio":
+			from .aio import attach_peer
+			self.loop.call_soon_threadsafe(attach_peer, self, peer)
+		self.__io_touch(npid)
+		if self.heartbeat:
+			# Spread the pings of peers coming in together
+			peer.heartbeat = self.scheduler.call_later(random.uniform(0.5, 1) * self.heartbeat, self.__heartbeat, peer)
 		if advertise and self.listen:
-			self.peers[npid].listen = verbinfo
+			self.registry.set_listen(peer, verbinfo)
 			self.peer_send(npid, ADVERTISE_BYTE, b"\0" + i2b(self.port, 2))
 		self.peerlock.release()
 
 		return npid
 
+	def tune_socket(self, sock):
+		"""Apply our socket options to a peer's socket. Buffer sizes are best
+		set before connecting."""
+		self.__tune_buffers(sock)
+		try:
+			if self.nodelay != None:
+				sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.nodelay))
+			if self.keepalive:
+				sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+				for option, value in zip(["TCP_KEEPIDLE", "TCP_KEEPINTVL", "TCP_KEEPCNT"], self.keepalive):
+					if hasattr(socket, option): # Not everywhere (i.e. macOS)
+						sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+		except OSError as e:
+			self.logger.warning("Could not tune socket options (%s)", e)
+
+	def __tune_buffers(self, sock):
+		"""Internal. Apply the socket buffer sizes, if any."""
+		try:
+			if self.sndbuf != None:
+				sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+			if self.rcvbuf != None:
+				sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+		except OSError as e:
+			self.logger.warning("Could not set socket buffer sizes (%s)", e)
+
 	def peer_del(self, pid):
 		"""Initiate the deletion of a peer. In the end, most of the data remains until the thread ends."""
 		peer = self.peer_get(pid)
@@ -348,11 +848,18 @@ class UnisocketModel:
 		self.peer_lock(pid)
 		peer.iqueue = None # Drop all data
 		peer.running = False # Stop the peer's thread
-		peer.oqueue += i2b(GOODBYE_BYTE)
+		peer.oqueue.append(i2b(GOODBYE_BYTE))
 		self.peer_unlock(pid)
+		self.__io_touch(pid)
+
+	@property
+	def peers(self):
+		"""Immutable snapshot of the peers, by Peer ID. Reading it needs no lock,
+		the registry copies a new one after a peer came or went."""
+		return self.registry.peers
 
 	def peer_get(self, npid):
-		return self.peers.get(npid, None)
+		return self.registry.get(npid, None)
 
 	def peer_lock(self, npid):
 		peer = self.peer_get(npid)
@@ -367,16 +874,29 @@ class UnisocketModel:
 		peer.datalock.release()
 
 	def peer_count(self):
-		ln = len(self.peers.keys())
-		return ln
+		return len(self.registry)
 
 	def __start_listen(self):
 		"""Internal. Creates and starts the listen thread after initializing the listen socket and setting some of its properties."""
 		# We initialize the socket here so that any error in binding/listening can be caught from in the main thread
+		if self.reuse_port:
+			self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+		# Accepted sockets inherit the buffer sizes, which must be known when
+		# the connection is set up
+		self.__tune_buffers(self.listen_socket)
 		self.listen_socket.bind((self.listen_addr, self.port))
-		self.listen_socket.listen(10)
+		self.listen_socket.listen(self.backlog)
 		self.listen_socket.settimeout(0)
 
+		if self.engine == "selector":
+			# The I/O thread accepts connections itself
+			self.selector.register(self.listen_socket, selectors.EVENT_READ)
+			return
+		elif self.engine == "asyncio":
+			# So does the event loop, which leaves adding them to an executor
+			self.loop.call_soon_threadsafe(self.loop.add_reader, self.listen_socket, self.__io_accept, self.__aio_peer_add)
+			return
+
 		self.listener = threading.Thread(
 			target = self.__listener_thread,
 			name = "Listener" + self.__nametag()
@@ -385,6 +905,14 @@ class UnisocketModel:
 
 	def stop(self):
 		self.running = False
+		self.__shutdown_deadline = time.monotonic() + self.shutdown_timeout
+		self.dialer.stop()
+		self.iqueue.put(None) # Wake the processor up
+		self.imessages.put(("stopped", None)) # And tell whoever reads our messages
+		if self.engine == "selector":
+			self.__io_wakeup()
+		elif self.engine == "asyncio" and self.listen:
+			self.loop.call_soon_threadsafe(self.__stop_listen)
 		self.logger.debug("Initiated Killing Process")
 
 	def is_alive(self):
@@ -394,32 +922,150 @@ class UnisocketModel:
 		# Waiting individually for each category of threads
 		self.logger.debug("Entered the join process")
 		# Stop the source of new connections
-		if self.listen and self.listener.is_alive():
+		if self.listen and self.engine == "threads" and self.listener.is_alive():
 			self.listener.join()
+		self.dialer.join()
 		# Stop the processing of all data
 		# FIXME: Maybe finish processing currently queued packets if possible?
 		if self.processor.is_alive():
 			self.processor.join()
-		# All peers are summoned for deletion by the PU, so we wait last for them
-		while len(self.peers) > 0:
-			pass
+		self.pool.join()
+		# All peers are summoned for deletion by the PU, so we wait last for
+		# them to flush their output, until the shutdown deadline
+		deadline = self.__shutdown_deadline or time.monotonic() + self.shutdown_timeout
+		if not self.__wait_peers_gone(deadline - time.monotonic()):
+			for peer in self.peers.values():
+				self.__abandon(peer)
+			self.logger.warning("Abandoned %(frames)s frames (%(bytes)s bytes) of %(peers)s peers on shutdown", dict(self.abandoned))
+			if not self.__wait_peers_gone(self.shutdown_timeout):
+				self.logger.error("%s peers are still running", len(self.peers))
+		# The I/O thread leaves once every peer is gone
+		if self.engine == "selector" and self.io.is_alive():
+			self.io.join()
 		self.logger.debug("Left the join process")
 
-	def raw_peer_send(self, pid, data):
+	def __wait_peers_gone(self, timeout):
+		"""Internal. Wait for every peer to be closed. Returns False if some are
+		still around after `timeout` seconds."""
+		self.peerlock.acquire()
+		gone = self.__peer_gone.wait_for(lambda: len(self.registry) == 0, max(0, timeout))
+		self.peerlock.release()
+		return gone
+
+	def __abandon(self, peer):
+		"""Internal. Drop a stopping peer's pending output so that it closes
+		right away, and account for what was dropped."""
+		self.peer_lock(peer.pid)
+		peer.running = False
+		segments = peer.oqueue.take()
+		self.peer_unlock(peer.pid)
+		self.__stats_lock.acquire()
+		self.abandoned["peers"] += 1
+		self.abandoned["frames"] += len(segments)
+		self.abandoned["bytes"] += sum([len(segment) for segment in segments])
+		self.__stats_lock.release()
+		self.__hang_up(peer)
+
+	def __evict(self, peer):
+		"""Internal. Close a peer that stopped answering right away, without
+		waiting for its output to be flushed (it never would be)."""
+		self.peer_lock(peer.pid)
+		peer.iqueue = None
+		peer.running = False
+		peer.oqueue.clear()
+		self.peer_unlock(peer.pid)
+		self.__hang_up(peer)
+
+	def __hang_up(self, peer):
+		"""Internal. Have a stopped peer with no output left closed by its
+		engine."""
+		if self.engine == "asyncio":
+			self.loop.call_soon_threadsafe(self.__aio_abort, peer)
+		else:
+			self.__io_touch(peer.pid)
+
+	def __aio_abort(self, peer):
+		"""Internal. Asyncio engine : close an abandoned peer's transport
+		without flushing it."""
+		if peer.transport == None:
+			self._peer_close(peer)
+			return
+		size = peer.transport.get_write_buffer_size()
+		self.__stats_lock.acquire()
+		self.abandoned["bytes"] += size
+		self.__stats_lock.release()
+		peer.transport.abort() # Calls connection_lost
+
+	def raw_peer_send(self, pid, data, block = True):
+		"""Queue a packet for a peer, or a list of packets queued as a whole.
+		Unless `block` is False, the caller may wait for a congested peer to
+		drain, under the "block" policy. Returns the amount of bytes queued,
+		or False."""
 		peer = self.peer_get(pid)
-		if peer == None:
-			return False
+		if peer == None or not peer.running:
+			return False # Nothing more goes to a peer we're disconnecting
+		frames = data if isinstance(data, list) else [data]
+		if len(frames) == 0 or len(frames[0]) == 0:
+			return 0
+
+		# Only bulk frames are held back when the peer cannot keep up
+		if frames[0][0] in BULK_HEADERS and peer.oqueue.congested():
+			if not self.__backpressure(peer, block):
+				return False
 
-		peer.oqueue += data
-		return len(data)
+		wake = False
+		for frame in frames:
+			wake |= peer.oqueue.append(frame, frame[0] in PRIORITY_HEADERS)
+			if self.metrics != None and frame[0] in self.__packets_out:
+				self.__packets_out[frame[0]].inc()
+		if wake:
+			self.__io_touch(pid)
+		return sum([len(frame) for frame in frames])
+
+	def __backpressure(self, peer, block = True):
+		"""Internal. Apply the backpressure policy to a congested peer, the
+		"block" policy dropping instead unless `block` is set. Returns True if
+		the frame can be queued after all."""
+		policy = self.backpressure_policy
+		if policy == "block" and not block:
+			policy = "drop"
+		self.__count_backpressure(policy)
+		if policy == "block":
+			if peer.oqueue.wait_drained(self.block_timeout):
+				return True
+			policy = "drop" # We gave up waiting
+			self.__count_backpressure(policy)
+
+		if policy == "disconnect":
+			self.logger.warning("Peer %s cannot keep up, disconnecting them", peer.pid)
+			peer.oqueue.clear()
+			self.peer_del(peer.pid)
+		return False
+
+	def __count_backpressure(self, policy):
+		"""Internal. Count a firing of a backpressure policy."""
+		self.__stats_lock.acquire()
+		self.backpressure[policy] += 1
+		self.__stats_lock.release()
 
 	def peer_send(self, pid, header, data):
 		self.raw_peer_send(pid, i2b(header) + data)
 
 	def integrate(self):
-		# Detect a lack of network integration and ask for peers
-		self.peerlock.acquire()
-		pln = self.peer_count()
+		"""Detect a lack of network integration and ask for peers. Runs as a
+		scheduled callback of the processor, and schedules its own next run."""
+		now = time.monotonic()
+		elapsed, self.now = now - self.now, now
+		for timer in self.timers:
+			self.timers[timer] -= elapsed
+		expired = self.reassembler.expire(REASSEMBLY_TIMEOUT)
+		if expired > 0:
+			self.logger.info("Gave up on %s incomplete messages", expired)
+
+		peers = self.peers
+		pln = len(peers)
+		self.selection.observe(peers)
+		self.__candidates_lock.acquire()
 		if pln > 0 and self.is_alive():
 			if pln < MIN_INTEGRATION:
 				if self.integrated:
@@ -428,15 +1074,15 @@ class UnisocketModel:
 					self.timers["integration"] = random.randrange(2, 5)
 
 				if len(self.possible_peers) != 0:
-					npeer = random.choice(self.possible_peers)
-					self.peerlock.release()
-					pid = self.peer_add(npeer)
-					self.peerlock.acquire()
-					self.possible_peers.remove(npeer)
+					# Dial several candidates at once, the first ones up win
+					dials = min(self.dial_parallelism, MIN_INTEGRATION - pln) - len(self.dialer)
+					for npeer in self.selection.candidates(self.possible_peers, max(0, dials), peers):
+						self.possible_peers.remove(npeer)
+						self.dialer.dial(npeer)
 
 				elif self.timers["integration"] <= 0:
-					rpid = random.choice(list(self.peers.keys()))
-					self.peer_get(rpid).oqueue += i2b(REQUESTPEER_BYTE)
+					rpid = self.selection.requestee(peers)
+					self.peer_send(rpid, REQUESTPEER_BYTE, b"")
 
 					self.timers["integration"] = random.randrange(2, 5)
 
@@ -446,18 +1092,14 @@ class UnisocketModel:
 					self.integrated = True
 
 				if self.timers["integration"] <= 0:
-					if len(self.possible_peers) == 0:
-						rpid = random.choice(list(self.peers.keys()))
-						self.peer_get(rpid).oqueue += i2b(REQUESTPEER_BYTE)
+					npeers = self.selection.candidates(self.possible_peers, 1, peers)
+					if len(npeers) == 0:
+						rpid = self.selection.requestee(peers)
+						self.peer_send(rpid, REQUESTPEER_BYTE, b"")
 
 					else:
-						npeer = random.choice(self.possible_peers)
-						self.peerlock.release()
-						pid = self.peer_add(npeer)
-						self.peerlock.acquire()
-
-						if type(pid) == type(0):
-							self.possible_peers.remove(npeer)
+						self.possible_peers.remove(npeers[0])
+						self.dialer.dial(npeers[0])
 
 					dd = 100 # seconds
 					mx = self.max_clients # clients
@@ -465,122 +1107,262 @@ class UnisocketModel:
 					self.timers["integration"] = (lambda x: (dd/(mx**2)) * (x**2))(pln) # x->(dd/mx^2)*x^2
 					#self.timers["integration"] = (lambda x: -(dd/ ((MIN_INTEGRATION - self.max_clients) ** 2)) * (x - self.max_clients) ** 2 + dd)(pln)
 
-		self.peerlock.release()
+			elif self.selection.replaces:
+				self.__replace(peers, pln)
+
+		# Wake up when the integration timer runs out, or at least every tick.
+		# The dialer brings us forward whenever an attempt is over.
+		delay = INTEGRATION_TICK
+		waiting_on_dials = pln < MIN_INTEGRATION and len(self.possible_peers) > 0
+		if pln > 0 and pln < self.max_clients and not waiting_on_dials:
+			delay = max(0, min(delay, self.timers["integration"]))
+		self.__candidates_lock.release()
+		self.schedule_integration(delay)
+
+	def __replace(self, peers, pln):
+		"""Internal. We're at capacity : let go of the peers the selection
+		strategy likes least if we're over it, or else try out a candidate
+		every once in a while, which may replace one of them. The candidates
+		lock must be held."""
+		if pln > self.max_clients:
+			for pid in self.selection.surplus(peers, pln - self.max_clients):
+				self.logger.info("Letting go of peer %s to make room", pid)
+				self.peer_del(pid)
+
+		elif self.timers["replacement"] <= 0 and len(self.dialer) == 0:
+			for npeer in self.selection.candidates(self.possible_peers, 1, peers):
+				self.possible_peers.remove(npeer)
+				self.dialer.dial(npeer)
+			self.timers["replacement"] = self.replace_interval
+
+	def __heartbeat(self, peer):
+		"""Internal. Ping a peer, or evict them if we heard nothing from them
+		since the last few pings. Runs as a scheduled callback of the
+		processor, and schedules its own next run."""
+		if self.peer_get(peer.pid) is not peer or not peer.running:
+			return
+		if peer.pinged != None and peer.heard < peer.pinged:
+			peer.missed += 1
+		else:
+			peer.missed = 0
+		if peer.missed >= self.heartbeat_misses:
+			self.logger.warning("Peer %s missed %s heartbeats, evicting them", peer.pid, peer.missed)
+			self.__evict(peer)
+			return
+
+		peer.pinged = time.monotonic()
+		self.peer_send(peer.pid, PING_BYTE, i2b(int(peer.pinged * 10**6), 8))
+		peer.heartbeat = self.scheduler.call_later(self.heartbeat, self.__heartbeat, peer)
+
+	def schedule_integration(self, delay = 0):
+		"""(Re)schedule the next integration check in `delay` seconds."""
+		self.__integration_lock.acquire()
+		self.scheduler.cancel(self.__integration)
+		self.__integration = self.scheduler.call_later(delay, self.integrate)
+		self.__integration_lock.release()
 
 	def __processor_unit(self):
 		"""Internal. Processing unit. Must be modified for the handling of packets according to the protocol though."""
-		self.now = time.time()
+		self.now = time.monotonic()
+		self.schedule_integration()
 		while self.is_alive():
-			then = time.time() - self.now
-			self.now = time.time()
-			for timer in self.timers:
-				self.timers[timer] -= then
-
-			self.integrate()
+			self.scheduler.run_pending()
 
+			# Sleep until either a packet comes, or the next timer is due
 			try:
-				data, pid = self.iqueue.get(timeout=0)
+				item = self.iqueue.get(timeout = self.scheduler.timeout())
 			except queue.Empty:
 				continue
+			if item == None:
+				continue # Woken up
+			frames, pid, stamp, trace = item
+			self.batch_sizes.observe(len(frames))
+			self.batch_latency.observe(time.monotonic() - stamp)
+			if trace != None:
+				trace.stamp("iqueue")
+			self.pool.submit(pid, frames, pid, trace)
+
+		# Workers finish what they were given, then leave
+		self.pool.stop()
+		# Summoning the peers for deletion. The snapshot won't change under us
+		# while peers go, and the listener stopped, so no new one can show up.
+		for pid in self.peers:
+			self.peer_del(pid)
+		self.reassembler.clear()
+		self.logger.debug("Stopped")
 
-			#FIXME: Reorganize and make some tasks unresponsive during shutdown
+	def __handle_batch(self, frames, pid, trace = None):
+		"""Internal. Handle a batch of packets received from a peer, in order,
+		along with its trace if it is traced. Runs in the worker in charge of
+		that peer."""
+		if trace != None:
+			trace.stamp("dispatch")
+		for data in frames:
+			if not self.is_alive():
+				break # The rest of the batch goes with the peers
+			self.__handle_packet(data, pid, trace)
+
+	def __handle_packet(self, data, pid, trace = None):
+		"""Internal. Handle one packet received from a peer, as part of a
+		batch which may be traced."""
+		#FIXME: Reorganize and make some tasks unresponsive during shutdown
+		if self.metrics != None and data[0] in self.__packets_in:
+			self.__packets_in[data[0]].inc()
+
+		if data[0] == HELLO_BYTE: # Hello Byte
+			peer = self.peer_get(pid)
+			if peer == None:
+				return # Gone already
+			peer.version = data[1]
+			self.logger.debug("Peer %s is running version %s", pid, data[1])
+
+		elif data[0] == GOODBYE_BYTE: # Peer Disconnect Byte
+			self.peer_del(pid)
 
-			if data[0] == HELLO_BYTE: # Hello Byte
-				self.peer_get(pid).version = data[1]
-				self.logger.debug("Peer {0} is running version {1}".format(pid, data[1]))
+		elif data[0] == SHAREPEER_BYTE: # Peer share byte
+			addr_len = data[1]
+			port = b2i(data[-2:])
 
-			elif data[0] == GOODBYE_BYTE: # Peer Disconnect Byte
-				self.peer_del(pid)
+			try:
+				ip = data[2:2+addr_len].decode("utf8")
+			except UnicodeDecodeError:
+				self.peer_send(pid, MALFORMED_DATA, i2b(len(data), 2))
+				return
+			self.__candidates_lock.acquire()
+			known = self.__is_already_known((ip, port))
+			if not known:
+				self.possible_peers.append((ip, port))
+			self.__candidates_lock.release()
+			if not known and self.peer_count() < MIN_INTEGRATION:
+				self.schedule_integration() # Don't wait to use them
+
+		elif data[0] == REQUESTPEER_BYTE:
+			# We were requested a peer, so...
+			peer = None
+			if len(self.peers) == 0 or not self.is_alive():
+				# We don't participate in the network if we're gonna shut down
+				return
+
+			possibles = list(self.registry.by_listen.values())
+			if possibles == []:
+				#self.peer_send(pid, SHAREPEER_BYTE, b"\0" * 3)
+				# For now do not respond
+				return
+
+			rpid = random.choice(possibles)
+			peer = self.peer_get(rpid)
+			if peer and rpid != pid and peer.iqueue != None:
+				self.peer_lock(rpid)
+				verbinfo = peer.listen
+				addr_len = i2b(len(verbinfo[0]))
+
+				port = i2b(verbinfo[1], 2)
+				self.peer_send(pid, SHAREPEER_BYTE, addr_len + verbinfo[0].encode("utf8") + port)
+				self.peer_unlock(rpid)
+			else:
+				self.logger.info("Refused to send %s", rpid)
+				#self.peer_send(pid, SHAREPEER_BYTE, b"\0" * 3) See 517
+
+		elif data[0] == MESSAGE_BYTE: # Message Arrival Byte
+			payload_len = b2i(data[1:4])
+			if isinstance(data, SpilledFrame):
+				msg = data.open(4) # Exploded straight from the disk
+				self.logger.info("Received %s bytes from %s", payload_len, pid)
+			else:
+				msg = data[4:4+payload_len]
+				self.logger.info("Received %s from %s", Excerpt(msg), pid)
+			self.imessages.put(("message", (msg, pid, self.__fork(trace))))
+			self.peer_send(pid, MESSAGEACK_BYTE, i2b(payload_len, 3))
 
-			elif data[0] == SHAREPEER_BYTE: # Peer share byte
-				addr_len = data[1]
-				port = b2i(data[-2:])
+		elif data[0] == CHUNK_BYTE: # Chunk of a Message
+			self.__handle_chunk(data, pid, trace)
 
-				ip = data[2:2+addr_len].decode("utf8")
-				if not self.__is_already_known((ip, port)):
-					self.possible_peers.append((ip, port))
-
-			elif data[0] == REQUESTPEER_BYTE:
-				# We were requested a peer, so...
-				peer = None
-				if len(self.peers) == 0 or not self.is_alive():
-					# We don't participate in the network if we're gonna shut down
-					continue
-
-				self.peerlock.acquire()
-				possibles = [peer for peer in self.peers if self.peers[peer].listen != None]
-				if possibles == []:
-					self.peerlock.release()
-					#self.peer_send(pid, SHAREPEER_BYTE, b"\0" * 3)
-					# For now do not respond
-					continue
-
-				rpid = random.choice(possibles)
-				peer = self.peer_get(rpid)
-				self.peerlock.release()
-				if peer and rpid != pid and peer.iqueue != None:
-					self.peer_lock(rpid)
-					verbinfo = peer.listen
-					addr_len = i2b(len(verbinfo[0]))
-
-					port = i2b(verbinfo[1], 2)
-					self.peer_send(pid, SHAREPEER_BYTE, addr_len + verbinfo[0].encode("utf8") + port)
-					self.peer_unlock(rpid)
-				else:
-					self.logger.info("Refused to send {0}".format(rpid))
-					#self.peer_send(pid, SHAREPEER_BYTE, b"\0" * 3) See 517
+		elif data[0] == PING_BYTE: # Heartbeat
+			self.peer_send(pid, PONG_BYTE, data[1:9])
 
-			elif data[0] == MESSAGE_BYTE: # Message Arrival Byte
-				payload_len = b2i(data[1:4])
-				msg = data[4:4+payload_len]
-				self.logger.info("Received '{0}' from {1}".format(msg, pid))
-				self.imessages.put(("message", msg))
-				self.peer_send(pid, MESSAGEACK_BYTE, i2b(payload_len, 3))
+		elif data[0] == PONG_BYTE: # Heartbeat answered
+			peer = self.peer_get(pid)
+			sample = time.monotonic() - b2i(data[1:9]) / 10**6
+			if peer != None and sample >= 0:
+				peer.measure(sample)
 
-			elif data[0] == MESSAGEACK_BYTE: # Message acknowledgement
-				self.imessages.put(("ack", b2i(data[1:])))
+		elif data[0] == MESSAGEACK_BYTE: # Message acknowledgement
+			self.imessages.put(("ack", b2i(data[1:])))
 
-			elif data[0] == MALFORMED_DATA: # Malformed data alert
-				self.imessages.put(("malformed", b2i(data[1:])))
+		elif data[0] == MALFORMED_DATA: # Malformed data alert
+			self.imessages.put(("malformed", b2i(data[1:])))
 
-			elif data[0] == ADVERTISE_BYTE: # Advertising byte
-				addr_len = data[1]
-				port = b2i(data[-2:])
+		elif data[0] == ADVERTISE_BYTE: # Advertising byte
+			addr_len = data[1]
+			port = b2i(data[-2:])
 
+			try:
 				ip = data[2:2+addr_len].decode("utf8")
-				self.peer_lock(pid)
-				peer = self.peer_get(pid)
-				if peer == None:
-					# There was never any peer locking anyways,
-					# If it returns None now, the peer was deleted before our locking
-					continue
+			except UnicodeDecodeError:
+				self.peer_send(pid, MALFORMED_DATA, i2b(len(data), 2))
+				return
+			self.peerlock.acquire()
+			peer = self.peer_get(pid)
+			if peer == None:
+				# If it returns None now, the peer was deleted before our locking
+				self.peerlock.release()
+				return
 
-				listen = (ip if ip != "" else peer.verbinfo[0], port)
+			listen = (ip if ip != "" else peer.verbinfo[0], port)
 
-				if self.__is_already_peer(listen):
-					self.logger.info("Dropping peer {0}, they were already connected to us".format(pid, listen))
-					self.peer_unlock(pid)
-					self.peer_del(pid)
-					continue
-				peer.listen = listen
-
-				self.logger.info("Peer {0}'s listen is revealed to be {1}".format(pid, listen))
-				self.peer_unlock(pid)
+			if self.__is_already_peer(listen):
+				self.logger.info("Dropping peer %s, they were already connected to us", pid)
+				self.peerlock.release()
+				self.peer_del(pid)
+				return
+			self.registry.set_listen(peer, listen)
+
+			self.logger.info("Peer %s's listen is revealed to be %s", pid, listen)
+			self.peerlock.release()
+
+		elif data[0:56] == self.death_sequence: # Death Sequence
+			self.stop()
+
+	def __fork(self, trace):
+		"""Internal. Returns the trace of a message handed over from a traced
+		batch, if it is."""
+		if trace == None:
+			return None
+		trace = trace.fork()
+		trace.stamp("handle")
+		return trace
+
+	def __handle_chunk(self, data, pid, trace = None):
+		"""Internal. Handle a chunk of a Message, relaying it to our other
+		peers right away if we're cutting through, and handing the Message
+		over once it is complete."""
+		if isinstance(data, SpilledFrame):
+			spilled, data = data, data[:]
+			spilled.close()
+		usig = data[4:68]
+		total = b2i(data[68:71])
+		offset = b2i(data[71:74])
+		if self.chunk_filter != None and not usig in self.reassembler.pending and not self.chunk_filter(usig):
+			return # Known already
 
-			elif data[0:56] == self.death_sequence: # Death Sequence
-				self.stop()
+		try:
+			reassembly, new, complete = self.reassembler.feed(usig, total, offset, data[74:], pid, self.cut_through)
+		except ValueError:
+			self.peer_send(pid, MALFORMED_DATA, i2b(min(len(data), (2**16)-1), 2))
+			return
+		except ReassemblyLimitError:
+			self.logger.warning("Dropped a chunk from %s, too many messages are being reassembled", pid)
+			return
+		if not new:
+			return
 
-			self.iqueue.task_done()
+		if reassembly.relayed:
+			for rpid in self.peers:
+				if not rpid in reassembly.sources:
+					self.raw_peer_send(rpid, data, block = False) # Never stall the worker relaying
 
-		# Summoning the peers for deletion. We may not want to wait for them to
-		# end but at the same time we can't safely parse the list, since it may
-		# change size during execution. We'll just take all indices right now, since the listener stopped,
-		# and, for each peer, initiate its deletion.
-		self.peerlock.acquire()
-		peers = list(self.peers.keys())
-		for pid in peers:
-			if self.peers.get(pid, None) == None:
-				continue
-			self.peer_del(pid)
-		self.peerlock.release()
-		self.logger.debug("Stopped")
+		if complete:
+			self.logger.info("Received a message of %s bytes in chunks from %s", total, pid)
+			reassembly.map.seek(0)
+			self.imessages.put(("message", (reassembly.map, pid, self.__fork(trace))))
+			self.peer_send(pid, MESSAGEACK_BYTE, i2b(total, 3))
@@ -4,6 +4,11 @@
 #   the project's different sections (i.e. byte conversion, etc).
 #
 
+import bisect		# `bisect.bisect_left`
+
+# Longest part of a payload shown in the logs
+EXCERPT_SIZE = 64
+
 def i2b(n, minimal = -1):
 	"""Integer to Bytes (Big Endian)"""
 	# If the integer is null, just return the empty byte with the desired
@@ -31,14 +36,75 @@ def b2i(b):
 		n = n << 8
 	return n >> 8
 
+class Histogram:
+	"""Distribution of observed values over fixed buckets. Bucket `i` counts
+	the values up to `bounds[i]`, and a last bucket counts those above
+	every bound. Observations are made by a single thread."""
+	def __init__(self, bounds):
+		"""Initialization requires the sorted upper bounds of the buckets."""
+		self.bounds = tuple(bounds)
+		self.counts = [0] * (len(self.bounds) + 1)
+		self.count = 0
+		self.sum = 0
+
+	def __repr__(self):
+		return "Histogram(count={0}, mean={1:.6g})".format(self.count, self.mean())
+
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.bounds, value)] += 1
+		self.count += 1
+		self.sum += value
+
+	def mean(self):
+		return self.sum / self.count if self.count > 0 else 0
+
+	def quantile(self, q):
+		"""Upper bound of the bucket holding the `q` quantile (infinity for
+		the last one), or None without any observation."""
+		if self.count == 0:
+			return None
+		rank = q * self.count
+		seen = 0
+		for index, count in enumerate(self.counts):
+			seen += count
+			if seen >= rank and count > 0:
+				break
+		return self.bounds[index] if index < len(self.bounds) else float("inf")
+
+	def buckets(self):
+		"""List of (upper bound, count) tuples."""
+		return list(zip(self.bounds + (float("inf"),), self.counts))
+
+class Excerpt:
+	"""The beginning of a payload, to be logged. Only formatted if the record
+	is actually emitted, and never in full."""
+	def __init__(self, data, size = EXCERPT_SIZE):
+		self.data = data
+		self.size = size
+
+	def __str__(self):
+		if len(self.data) <= self.size:
+			return repr(bytes(self.data))
+		return "{0}... ({1} bytes)".format(repr(bytes(self.data[:self.size])), len(self.data))
+
 class PhantomLogger:
-	def debug(msg, *args, **kwargs):
+	"""Hollow `logging.Logger`, discarding everything."""
+	def isEnabledFor(self, level):
+		return False
+
+	def debug(self, msg, *args, **kwargs):
+		pass
+
+	def warning(self, msg, *args, **kwargs):
+		pass
+
+	def info(self, msg, *args, **kwargs):
 		pass
 
-	def warning(msg, *args, **kwargs):
+	def error(self, msg, *args, **kwargs):
 		pass
 
-	def info(msg, *args, **kwargs):
+	def exception(self, msg, *args, **kwargs):
 		pass
 
 
@@ -0,0 +1,80 @@
+# ~ stolas/workers.py: Worker Pool Module ~
+#
+#  This module defines the pool of worker threads the processing units hand
+#   their work to. Work is sharded by key (a Peer ID), so that everything
+#   coming from the same peer is handled in order, by the same worker.
+#
+
+import queue		# `queue.Queue`
+import threading	# `threading.Thread`
+
+from .utils import PhantomLogger
+
+class WorkerPool:
+	"""Pool of worker threads, each serving its own queue.
+	A pool of a single worker has no thread : work is handled right away, by
+	the thread submitting it. Work failing is logged, and never takes its
+	worker (or the submitting thread) down with it."""
+	def __init__(self, size, handler, name = "Worker", logger = None):
+		"""Initialization requires the amount of workers, and the callable
+		handling the work submitted. Workers are named after `name`, and
+		failures are logged with `logger`."""
+		self.size = max(1, size)
+		self.handler = handler
+		self.logger = logger or PhantomLogger()
+		self.queues = []
+		self.threads = []
+		if self.size > 1:
+			for index in range(self.size):
+				self.queues.append(queue.Queue())
+				self.threads.append(threading.Thread(
+					name = "{0}{1}".format(name, index),
+					target = self.__worker,
+					args = (self.queues[index],)
+				))
+
+	def __len__(self):
+		return self.size
+
+	def __repr__(self):
+		return "WorkerPool(size={0})".format(self.size)
+
+	def pending(self):
+		"""Gives the amount of work waiting for the workers."""
+		return sum([wqueue.qsize() for wqueue in self.queues])
+
+	def start(self):
+		for thread in self.threads:
+			thread.start()
+
+	def submit(self, key, *args):
+		"""Have `handler(*args)` called by the worker in charge of `key`."""
+		if self.size == 1:
+			self.__handle(args)
+		else:
+			self.queues[hash(key) % self.size].put(args)
+
+	def stop(self):
+		"""Stop the workers once they're done with what was submitted."""
+		for wqueue in self.queues:
+			wqueue.put(None)
+
+	def join(self):
+		for thread in self.threads:
+			if thread.is_alive():
+				thread.join()
+
+	def __worker(self, wqueue):
+		"""Internal. Worker thread."""
+		while True:
+			args = wqueue.get()
+			if args == None:
+				break
+			self.__handle(args)
+
+	def __handle(self, args):
+		"""Internal. Have the work handled, and log it if it fails."""
+		try:
+			self.handler(*args)
+		except Exception:
+			self.logger.exception("Failed to handle work from %s", threading.current_thread().name)
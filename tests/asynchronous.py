@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+
+import asyncio
+import os
+import random
+import threading
+import time
+
+from stolas.betterui import pprint as print
+from stolas.aio import AsyncStolas
+
+async def transmit(quantity):
+	port = random.randrange(1024, 60000)
+	nodes = []
+	for n in range(quantity):
+		node = AsyncStolas(port = port + n, virtual = True)
+		await node.start()
+		if len(nodes) > 0:
+			pid = await node.connect("127.0.0.1", random.choice(nodes).port)
+			assert(type(pid) == type(0))
+		nodes.append(node)
+		print("Created node {0}/{1}...".format(n+1, quantity), end = "\r")
+	print()
+
+	payload = os.urandom(random.randrange(10, 65000))
+	await nodes[0].send_message("", payload)
+
+	# Every other node gets it sooner or later through message distribution
+	async def receive(node):
+		async for msgobj in node:
+			if msgobj.get_payload() == payload:
+				return True
+
+	received = await asyncio.wait_for(asyncio.gather(*[receive(node) for node in nodes[1:]]), 120)
+	print("Message received by {0} nodes ✓".format(len(received)))
+
+	for node in nodes:
+		await node.stop()
+	return all(received)
+
+async def connect_while_locked():
+	"""Connect two nodes while their peer locks are held by another thread,
+	and check that their event loop goes on meanwhile."""
+	port = random.randrange(1024, 60000)
+	server, client = AsyncStolas(port = port, virtual = True), AsyncStolas(port = port + 1, virtual = True)
+	for node in [server, client]:
+		await node.start()
+
+	held, release = threading.Event(), threading.Event()
+	def hold():
+		for node in [server, client]:
+			node.networker.peerlock.acquire()
+		held.set()
+		release.wait(2) # Were the loop held up, it would only be for so long
+		for node in [server, client]:
+			node.networker.peerlock.release()
+	holder = threading.Thread(target = hold)
+	holder.start()
+	held.wait()
+
+	connecting = asyncio.ensure_future(client.connect("127.0.0.1", port))
+	for e in range(5):
+		then = time.monotonic()
+		await asyncio.sleep(0.05)
+		assert(time.monotonic() - then < 0.5)
+	assert(not connecting.done() and len(server.networker.peers) == 0)
+
+	release.set()
+	holder.join()
+	assert(type(await asyncio.wait_for(connecting, 5)) == type(0))
+	then = time.monotonic()
+	while len(server.networker.peers) == 0:
+		assert(time.monotonic() - then < 5)
+		await asyncio.sleep(0.05)
+
+	for node in [server, client]:
+		await node.stop()
+	return True
+
+def test_asyncio_transmission(quantity = 4):
+	print("~<s:bright]Starting Asyncio Transmission Test~<s:reset_all]")
+	assert(asyncio.run(connect_while_locked()))
+	return asyncio.run(transmit(quantity))
+
+if __name__ == "__main__":
+	test_asyncio_transmission()
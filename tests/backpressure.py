@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+import socket
+import threading
+import time
+
+from stolas.betterui import pprint as print
+from stolas.protocol import *
+from stolas.utils import i2b
+from common import start_model
+
+# A bulk packet, and the water marks of the peers it is sent to
+FRAME = i2b(MESSAGE_BYTE) + i2b(2**14, 3) + bytes(2**14)
+HIGH_WATER = (2**16, 64)
+
+def congested_peer(**kwargs):
+	"""Returns a model, a socket connected to it that never reads, and the
+	Peer ID it has for that socket, whose output is congested already."""
+	model = start_model(high_water = HIGH_WATER, sndbuf = 4096, **kwargs)
+	sink = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sink.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+	sink.connect(("127.0.0.1", model.port))
+	while len(model.peers) == 0:
+		time.sleep(0.05)
+	pid = list(model.peers.keys())[0]
+	peer = model.peer_get(pid)
+	for e in range(2**10):
+		if peer.oqueue.congested():
+			break
+		assert(model.raw_peer_send(pid, FRAME))
+	assert(peer.oqueue.congested())
+	return model, sink, pid
+
+def drain(sink):
+	"""Read everything from the sink, until it is closed."""
+	try:
+		while len(sink.recv(2**16)) > 0:
+			pass
+	except OSError:
+		pass
+
+def test_backpressure(engine = "threads"):
+	# Bulk packets to a congested peer are dropped, control packets still go
+	model, sink, pid = congested_peer(engine = engine, backpressure = "drop")
+	assert(model.raw_peer_send(pid, FRAME) == False)
+	assert(model.backpressure["drop"] == 1)
+	assert(model.raw_peer_send(pid, i2b(PING_BYTE) + bytes(8)))
+	assert(model.peer_get(pid) != None)
+	sink.close()
+	model.stop()
+	model.join()
+
+	# The producer waits for a congested peer to drain, or gives up
+	model, sink, pid = congested_peer(engine = engine, backpressure = "block", block_timeout = 0.5)
+	now = time.time()
+	assert(model.raw_peer_send(pid, FRAME) == False)
+	assert(0.4 < time.time() - now < 2)
+	assert(model.backpressure["block"] == 1 and model.backpressure["drop"] == 1)
+	# Unless it relays, and cannot stall the peer it relays from
+	now = time.time()
+	assert(model.raw_peer_send(pid, FRAME, block = False) == False)
+	assert(time.time() - now < 0.1)
+	assert(model.backpressure["block"] == 1 and model.backpressure["drop"] == 2)
+	# Once the peer reads, the producer goes on
+	reader = threading.Thread(target = drain, args = (sink,))
+	reader.start()
+	assert(model.raw_peer_send(pid, FRAME))
+	assert(model.backpressure["block"] == 2 and model.backpressure["drop"] == 2)
+	model.stop()
+	model.join()
+	sink.close()
+	reader.join()
+
+	# Or the peer is let go of
+	model, sink, pid = congested_peer(engine = engine, backpressure = "disconnect")
+	assert(model.raw_peer_send(pid, FRAME) == False)
+	assert(model.backpressure["disconnect"] == 1)
+	now = time.time()
+	while model.peer_get(pid) != None:
+		assert(time.time() - now < 2)
+		time.sleep(0.05)
+	sink.close()
+	model.stop()
+	model.join()
+
+	print("Backpressure ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_backpressure()
+	test_backpressure("selector")
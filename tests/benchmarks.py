@@ -0,0 +1,593 @@
+#!/usr/bin/python3
+# -*- encoding: utf-8 -*-
+#
+# Benchmarks for Stolas' network layers. Run with the name of a benchmark :
+#   python3 benchmarks.py engines
+#
+
+from sys import argv
+import os
+import random
+import resource
+import socket
+import threading
+import time
+
+from stolas.betterui import pprint as print
+from stolas.stolas import Stolas
+from stolas.framer import Framer
+from stolas.protocol import *
+from stolas.utils import b2i, i2b
+
+from network import build_network
+from common import network_collapse
+
+def cpu_time():
+	"""CPU time (user + system) consumed by our process so far."""
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	return usage.ru_utime + usage.ru_stime
+
+def bench_engines(quantity = 10, duration = 10):
+	"""Build a cluster with each transport engine, let it integrate, and
+	compare the CPU time burnt along with the threads used."""
+	threading.current_thread().setName("Main__")
+	results = {}
+	for engine in ["threads", "selector"]:
+		port = random.randrange(1024, 60000)
+		then, cpu = time.time(), cpu_time()
+		models = build_network(port, quantity, engine)
+		threads = threading.active_count()
+		while time.time() - then < duration:
+			time.sleep(0.5)
+
+		elapsed, cpu = time.time() - then, cpu_time() - cpu
+		integrated = len([m for m in models if m.integrated])
+		network_collapse(models)
+		results[engine] = (cpu / elapsed, threads, integrated)
+
+	print("~<s:bright]{0:10s} {1:>10s} {2:>8s} {3:>11s}~<s:reset_all]".format("Engine", "CPU/s", "Threads", "Integrated"))
+	for engine, (load, threads, integrated) in results.items():
+		print("{0:10s} {1:10.2f} {2:8d} {3:8d}/{4}".format(engine, load, threads, integrated, quantity))
+
+def bench_framer(duration = 3):
+	"""Measure how fast the Framer slices small control packets, and large
+	MESSAGE packets arriving 1024 bytes at a time."""
+	control = b"".join([
+		i2b(MESSAGEACK_BYTE) + i2b(1234, 3),
+		i2b(REQUESTPEER_BYTE),
+		i2b(SHAREPEER_BYTE) + i2b(9) + b"127.0.0.1" + i2b(6666, 2),
+		i2b(GOODBYE_BYTE),
+	]) * 256
+	payload = os.urandom(2**20)
+	message = i2b(MESSAGE_BYTE) + i2b(len(payload), 3) + payload
+
+	print("~<s:bright]{0:10s} {1:>14s} {2:>14s}~<s:reset_all]".format("Packets", "Frames/s", "MB/s"))
+	for name, stream, step in [("control", control, len(control)), ("message", message, 1024)]:
+		framer = Framer()
+		frames, size, then = 0, 0, time.time()
+		while time.time() - then < duration:
+			for index in range(0, len(stream), step):
+				framer.feed(stream[index:index+step])
+				for frame in framer.frames():
+					frames += 1
+			size += len(stream)
+		elapsed = time.time() - then
+		print("{0:10s} {1:14.0f} {2:14.2f}".format(name, frames / elapsed, size / elapsed / 2**20))
+
+def bench_registry(churn = 2000):
+	"""Measure what a peer coming and going costs a registry holding
+	thousands of peers, alone, and followed by a read of the peers as a
+	broadcast does."""
+	from stolas.registry import PeerRegistry
+
+	class FakePeer:
+		def __init__(self, pid, port):
+			self.pid = pid
+			self.verbinfo = ("127.0.0.1", port)
+			self.listen = ("127.0.0.1", port)
+
+	print("~<s:bright]{0:>8s} {1:>16s} {2:>16s}~<s:reset_all]".format("Peers", "Changes/s", "With reads/s"))
+	for quantity in [10, 1000, 10000]:
+		rates = []
+		for read in [False, True]:
+			registry = PeerRegistry()
+			for port in range(quantity):
+				registry.add(FakePeer(registry.allocate(), port))
+			then = time.time()
+			for e in range(churn):
+				registry.add(FakePeer(registry.allocate(), 2**16 + e))
+				if read:
+					len(list(registry.peers))
+				registry.remove(quantity)
+			rates.append(2 * churn / (time.time() - then))
+		print("{0:8d} {1:16.0f} {2:16.0f}".format(quantity, rates[0], rates[1]))
+
+def bench_control(frames = 200000):
+	"""Blast a model with small control packets and measure how fast its
+	processor goes through them, and in how many hand-offs."""
+	from stolas.unisocket import UnisocketModel
+	threading.current_thread().setName("Main__")
+	stream = (i2b(MESSAGEACK_BYTE) + i2b(1234, 3)) * frames
+	print("~<s:bright]{0:10s} {1:>12s} {2:>10s} {3:>12s} {4:>10s} {5:>10s}~<s:reset_all]".format(
+		"Engine", "Frames/s", "Hand-offs", "Frames/off", "p50 (ms)", "p99 (ms)"))
+	for engine in ["threads", "selector"]:
+		model = UnisocketModel(random.randrange(1024, 60000), engine = engine)
+		model.start()
+		sock = socket.create_connection(("127.0.0.1", model.port))
+		while len(model.peers) == 0:
+			time.sleep(0.05)
+
+		then = time.time()
+		sock.sendall(stream)
+		while model.batch_sizes.sum < frames and time.time() - then < 60:
+			time.sleep(0.01)
+		elapsed = time.time() - then
+		sizes, latency = model.batch_sizes, model.batch_latency
+		print("{0:10s} {1:12.0f} {2:10d} {3:12.1f} {4:10.2f} {5:10.2f}".format(
+			engine, sizes.sum / elapsed, sizes.count, sizes.mean(),
+			latency.quantile(0.5) * 1000, latency.quantile(0.99) * 1000))
+		sock.close()
+		model.stop()
+		model.join()
+
+def bench_workers(messages = 2000, senders = 8):
+	"""Have several peers send a node compressed messages, and measure how
+	many it logs per second depending on its amount of workers."""
+	threading.current_thread().setName("Main__")
+	frames = []
+	for index in range(messages):
+		payload = os.urandom(2**14) + bytes(3 * 2**14)
+		data = Message(payload = payload, channel = "", ttl = 600).implode()
+		frames.append(i2b(MESSAGE_BYTE) + i2b(len(data), 3) + data)
+
+	print("~<s:bright]{0:10s} {1:>8s} {2:>12s}~<s:reset_all]".format("Engine", "Workers", "Messages/s"))
+	for engine, workers in [(engine, workers) for engine in ["threads", "selector"] for workers in [1, 2, 4, 8]]:
+		node = Stolas(port = random.randrange(1024, 60000), virtual = True, engine = engine, workers = workers)
+		logged = threading.Semaphore(0)
+		node.on_new_message_callbacks.append(lambda msg: logged.release())
+		node.start()
+		socks = [socket.create_connection(("127.0.0.1", node.port)) for e in range(senders)]
+		streams = [b"".join(frames[index::senders]) for index in range(senders)]
+		while len(node.networker.peers) < senders:
+			time.sleep(0.05)
+
+		then = time.time()
+		threads = [threading.Thread(target = sock.sendall, args = (stream,)) for sock, stream in zip(socks, streams)]
+		for thread in threads:
+			thread.start()
+		for index in range(messages):
+			logged.acquire()
+		elapsed = time.time() - then
+		print("{0:10s} {1:8d} {2:12.0f}".format(engine, workers, messages / elapsed))
+		for thread in threads:
+			thread.join()
+		for sock in socks:
+			sock.close()
+		node.stop()
+		node.join()
+
+def build_stolas_network(port, quantity, **kwargs):
+	"""Build a network of virtual Stolas nodes, each connected to a random
+	older one."""
+	nodes = []
+	while len(nodes) < quantity:
+		try:
+			node = Stolas(port = port, virtual = True, **kwargs)
+		except OSError:
+			port += 1
+			continue
+		node.start()
+		if len(nodes) > 0:
+			node.networker.peer_add(("127.0.0.1", random.choice(nodes).port))
+		nodes.append(node)
+		port += 1
+	return nodes
+
+def bench_distribution(quantity = 6, rounds = 50):
+	"""Measure what distributing a large message over and over costs."""
+	threading.current_thread().setName("Main__")
+	nodes = build_stolas_network(random.randrange(1024, 60000), quantity)
+	msgobj = Message(payload = os.urandom(2**19) + bytes(2**19), channel = "", ttl = 600)
+	then, cpu = time.time(), cpu_time()
+	for index in range(rounds):
+		nodes[0].message_broadcast(msgobj)
+	elapsed, cpu = time.time() - then, cpu_time() - cpu
+	implosions = nodes[0].implosions
+	network_collapse(nodes)
+
+	print("~<s:bright]{0:>14s} {1:>14s} {2:>11s} {3:>9s} {4:>12s}~<s:reset_all]".format(
+		"ms/broadcast", "CPU ms/bcast", "Compressed", "Reused", "Saved (MB)"))
+	print("{0:14.2f} {1:14.2f} {2:11d} {3:9d} {4:12.1f}".format(
+		elapsed / rounds * 1000, cpu / rounds * 1000, implosions["compressed"],
+		implosions["reused"], implosions["saved"] / 2**20))
+
+def bench_idle(quantity = 10, settle = 10, duration = 10):
+	"""Measure the CPU time an idle node burns once its network settled."""
+	threading.current_thread().setName("Main__")
+	print("~<s:bright]{0:10s} {1:>16s}~<s:reset_all]".format("Engine", "CPU/s per node"))
+	for engine in ["threads", "selector"]:
+		nodes = build_stolas_network(random.randrange(1024, 60000), quantity, engine = engine)
+		time.sleep(settle)
+		then, cpu = time.time(), cpu_time()
+		time.sleep(duration)
+		load = (cpu_time() - cpu) / (time.time() - then)
+		network_collapse(nodes)
+		print("{0:10s} {1:16.4f}".format(engine, load / quantity))
+
+def tarpit():
+	"""Open a listen socket that never accepts, and fill its backlog up so
+	that any further connection attempt hangs. Returns the socket and the
+	connections filling it."""
+	pit = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	pit.bind(("127.0.0.1", 0))
+	pit.listen(0)
+	fillers = []
+	while True:
+		filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		filler.setblocking(False)
+		filler.connect_ex(pit.getsockname())
+		fillers.append(filler)
+		time.sleep(0.05)
+		if filler.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0 or len(fillers) > 8:
+			break
+	return pit, fillers
+
+def bench_integration(quantity = 20, dead = 10):
+	"""Measure the time a cluster of UnisocketModels takes to integrate when
+	every node also knows of a few addresses that never answer."""
+	from stolas.unisocket import UnisocketModel
+	threading.current_thread().setName("Main__")
+	pits = [tarpit() for e in range(dead)]
+
+	port = random.randrange(1024, 60000)
+	models = []
+	while len(models) < quantity:
+		model = UnisocketModel(port, name = len(models), engine = "selector", connect_timeout = 2)
+		try:
+			model.start()
+		except OSError:
+			model.stop()
+			port += 1
+			continue
+		model.possible_peers += [pit.getsockname() for pit, fillers in pits]
+		if len(models) > 0:
+			model.peer_add(("127.0.0.1", random.choice(models).port))
+		models.append(model)
+		port += 1
+
+	then = time.time()
+	while False in [m.integrated for m in models] and time.time() - then < 300:
+		time.sleep(0.1)
+	elapsed, integrated = time.time() - then, len([m for m in models if m.integrated])
+	network_collapse(models)
+	for pit, fillers in pits:
+		for sock in fillers + [pit]:
+			sock.close()
+
+	print("~<s:bright]{0:>12s} {1:>11s}~<s:reset_all]".format("Integration", "Integrated"))
+	print("{0:11.2f}s {1:8d}/{2}".format(elapsed, integrated, quantity))
+
+def bench_sockets(volume = 2**26, pings = 500):
+	"""Measure the loopback throughput, both ways, and round trip latency of
+	a model under several socket settings."""
+	from stolas.unisocket import UnisocketModel
+	threading.current_thread().setName("Main__")
+	settings = [
+		("defaults", {}),
+		("nagle", {"nodelay": False}),
+		("recv 1KiB", {"recv_size": 1024}),
+		("bufs 16KiB", {"sndbuf": 2**14, "rcvbuf": 2**14}),
+	]
+	payload = os.urandom(2**16 - 4)
+	frame = i2b(MESSAGE_BYTE) + i2b(len(payload), 3) + payload
+	ping = i2b(MESSAGE_BYTE) + i2b(1, 3) + b"\0"
+
+	print("~<s:bright]{0:10s} {1:12s} {2:>10s} {3:>10s} {4:>10s} {5:>10s} {6:>9s} {7:>9s}~<s:reset_all]".format(
+		"Engine", "Settings", "In MB/s", "Out MB/s", "RTT p50", "RTT p99", "Reads/MB", "Allocs/MB"))
+	for engine, (name, options) in [(engine, setting) for engine in ["threads", "selector"] for setting in settings]:
+		model = UnisocketModel(random.randrange(1024, 60000), engine = engine, backpressure = "block", **options)
+		model.start()
+		sock = socket.create_connection(("127.0.0.1", model.port))
+		while len(model.peers) == 0:
+			time.sleep(0.05)
+		pid = list(model.peers.keys())[0]
+
+		# Inbound : frames are counted once handed to the processor
+		count = volume // len(frame)
+		then = time.time()
+		sock.sendall(frame * count)
+		while model.batch_sizes.sum < count and time.time() - then < 60:
+			time.sleep(0.001)
+		inbound = count * len(frame) / (time.time() - then) / 2**20
+		framer = model.peers[pid].iqueue
+		received = framer.received / 2**20
+		reads, allocations = framer.reads / received, framer.allocations / received
+		while not model.imessages.empty():
+			model.imessages.get() # Nobody consumes the messages here
+
+		# Outbound, the acknowledgements of what came in going first
+		then, received = time.time(), 0
+		sender = threading.Thread(target = lambda: [model.raw_peer_send(pid, frame) for index in range(count)])
+		sender.start()
+		while received < count * (len(frame) + 4) and time.time() - then < 60:
+			received += len(sock.recv(2**20))
+		outbound = received / (time.time() - then) / 2**20
+		sender.join()
+
+		# Round trips of a tiny message and its acknowledgement
+		rtts = []
+		for index in range(pings):
+			then = time.perf_counter()
+			sock.sendall(ping)
+			acked = 0
+			while acked < 4:
+				acked += len(sock.recv(4 - acked))
+			rtts.append(time.perf_counter() - then)
+		rtts.sort()
+		print("{0:10s} {1:12s} {2:10.1f} {3:10.1f} {4:8.3f}ms {5:8.3f}ms {6:9.1f} {7:9.2f}".format(
+			engine, name, inbound, outbound, rtts[len(rtts) // 2] * 1000, rtts[int(len(rtts) * 0.99)] * 1000,
+			reads, allocations))
+		sock.close()
+		model.stop()
+		model.join()
+
+def bench_coalesce(frames = 20000, burst = 10):
+	"""Have a model send small control packets to a peer, a few at a time,
+	and count the writes it takes with and without a coalescing window."""
+	from stolas.unisocket import UnisocketModel
+	threading.current_thread().setName("Main__")
+	frame = i2b(MESSAGEACK_BYTE) + i2b(1234, 3)
+	print("~<s:bright]{0:10s} {1:>14s} {2:>14s} {3:>10s}~<s:reset_all]".format(
+		"Engine", "Window", "Writes/frame", "Time (s)"))
+	for engine, coalesce in [(engine, coalesce) for engine in ["threads", "selector"] for coalesce in [None, (0.001, 1400), (0.005, 1400)]]:
+		model = UnisocketModel(random.randrange(1024, 60000), engine = engine, coalesce = coalesce)
+		model.start()
+		sock = socket.create_connection(("127.0.0.1", model.port))
+		while len(model.peers) == 0:
+			time.sleep(0.05)
+		pid = list(model.peers.keys())[0]
+		oqueue = model.peers[pid].oqueue
+
+		def produce():
+			for index in range(frames):
+				model.raw_peer_send(pid, frame)
+				if index % burst == burst - 1:
+					time.sleep(0.0002)
+		then, received = time.time(), 0
+		producer = threading.Thread(target = produce)
+		producer.start()
+		while received < frames * len(frame):
+			received += len(sock.recv(2**16))
+		elapsed = time.time() - then
+		producer.join()
+		print("{0:10s} {1:>14s} {2:14.3f} {3:10.2f}".format(
+			engine, "none" if coalesce == None else "{0:g}ms/{1}B".format(coalesce[0] * 1000, coalesce[1]),
+			oqueue.writes / oqueue.completed, elapsed))
+		sock.close()
+		model.stop()
+		model.join()
+
+def delayed_sink(delay, deliveries):
+	"""Listen for a model's connections, answer their pings, and note how
+	long the MESSAGE packets (carrying their sending time) they send took,
+	as if the link to us was `delay` seconds long, one way. Returns the
+	listen socket."""
+	server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	server.bind(("127.0.0.1", 0))
+	server.listen(8)
+
+	def serve(sock):
+		framer = Framer()
+		while True:
+			try:
+				data = sock.recv(2**16)
+			except OSError:
+				break
+			if len(data) == 0:
+				break
+			arrival = time.monotonic()
+			framer.feed(data)
+			for packet in framer.frames():
+				time.sleep(max(0, arrival + delay - time.monotonic()))
+				if packet[0] == PING_BYTE:
+					sock.sendall(i2b(PONG_BYTE) + packet[1:])
+				elif packet[0] == MESSAGE_BYTE:
+					deliveries.append(time.monotonic() - b2i(packet[4:12]) / 10**6)
+		sock.close()
+
+	def accept():
+		while True:
+			try:
+				sock, addr = server.accept()
+			except OSError:
+				return # Closed
+			threading.Thread(target = serve, args = (sock,), daemon = True).start()
+	threading.Thread(target = accept, daemon = True).start()
+	return server
+
+def bench_selection(candidates = 12, impaired = 6, delay = 0.04, settle = 20, messages = 100):
+	"""Give a model at capacity candidates half of which are behind slow
+	links, and measure how long the messages it then sends its peers take to
+	arrive, with each peer selection strategy."""
+	from stolas.unisocket import UnisocketModel
+	threading.current_thread().setName("Main__")
+	print("~<s:bright]{0:10s} {1:>10s} {2:>10s} {3:>10s} {4:>10s}~<s:reset_all]".format(
+		"Strategy", "Peers", "Impaired", "p50 (ms)", "p90 (ms)"))
+	for strategy in ["random", "latency"]:
+		deliveries = []
+		sinks = [delayed_sink(delay if index < impaired else 0, deliveries) for index in range(candidates)]
+		addrs = [sink.getsockname() for sink in sinks]
+		model = UnisocketModel(random.randrange(1024, 60000), engine = "selector", listen = False, selection = strategy,
+			max_clients = MIN_INTEGRATION, heartbeat = 0.5, replace_interval = 1)
+		model.start()
+		# Both strategies start from the same slow peer
+		model.possible_peers += addrs[1:]
+		model.peer_add(addrs[0])
+		time.sleep(settle)
+
+		peers = list(model.peers.values())
+		slow = len([peer for peer in peers if peer.verbinfo in addrs[:impaired]])
+		for index in range(messages):
+			stamp = i2b(int(time.monotonic() * 10**6), 8)
+			for pid in model.peers:
+				model.raw_peer_send(pid, i2b(MESSAGE_BYTE) + i2b(len(stamp), 3) + stamp)
+			time.sleep(0.05)
+		time.sleep(delay * 2)
+		times = sorted(deliveries)
+		print("{0:10s} {1:10d} {2:10d} {3:10.2f} {4:10.2f}".format(
+			strategy, len(peers), slow, times[len(times) // 2] * 1000, times[int(len(times) * 0.9)] * 1000))
+		model.stop()
+		model.join()
+		for sink in sinks:
+			sink.close()
+
+def blast(engine, messages, size, on_message = None, **kwargs):
+	"""Blast a model running on `engine`, with the given options, with
+	`messages` packets of `size` bytes from a socket, and measure how fast
+	they come out of it. `on_message` is called with each message handed
+	over. Returns the amount of messages per second."""
+	from stolas.unisocket import UnisocketModel
+	payload = os.urandom(size)
+	stream = (i2b(MESSAGE_BYTE) + i2b(len(payload), 3) + payload) * messages
+	model = UnisocketModel(random.randrange(1024, 60000), engine = engine, **kwargs)
+	model.start()
+	sock = socket.create_connection(("127.0.0.1", model.port))
+	while len(model.peers) == 0:
+		time.sleep(0.05)
+
+	then, received = time.time(), 0
+	sender = threading.Thread(target = sock.sendall, args = (stream,))
+	sender.start()
+	while received < messages:
+		kind, item = model.imessages.get()
+		if kind == "message":
+			received += 1
+			if on_message != None:
+				on_message(item)
+	elapsed = time.time() - then
+	sender.join()
+	sock.close()
+	model.stop()
+	model.join()
+	return messages / elapsed
+
+def blast_header(column):
+	print("~<s:bright]{0:10s} {1:10s} {2:>12s} {3:>10s}~<s:reset_all]".format("Engine", column, "Messages/s", "MB/s"))
+
+def blast_row(engine, label, rate, size):
+	print("{0:10s} {1:10s} {2:12.0f} {3:10.2f}".format(engine, label, rate, rate * size / 2**20))
+
+def bench_logging(messages = 20000, size = 2**12):
+	"""Blast a model with messages (see `blast`) without logging, logging
+	warnings only, with messages formatted lazily or eagerly, and logging
+	everything to a file, either directly or through a background writer."""
+	import logging, logging.handlers, queue, tempfile
+	from stolas.utils import PhantomLogger, Excerpt
+	threading.current_thread().setName("Main__")
+
+	class EagerLogger(logging.Logger):
+		"""Logger formatting messages, payloads in full, before knowing whether
+		they're emitted, as they were when built with `str.format` by the
+		caller."""
+		def eager(self, msg, args):
+			return msg % tuple([repr(bytes(arg.data)) if isinstance(arg, Excerpt) else arg for arg in args])
+
+		def debug(self, msg, *args, **kwargs):
+			super().debug(self.eager(msg, args), **kwargs)
+
+		def info(self, msg, *args, **kwargs):
+			super().info(self.eager(msg, args), **kwargs)
+
+	def file_logger(queued, level = logging.DEBUG, eager = False):
+		"""Returns a logger writing to a temporary file from `level` on, its
+		file handler, and the listener running it if it is queued."""
+		logger = (EagerLogger if eager else logging.Logger)("bench", level)
+		handler = logging.handlers.RotatingFileHandler(tempfile.mktemp())
+		handler.setFormatter(logging.Formatter("[%(asctime)s][%(levelname)7s][%(funcName)25s:%(lineno)3s][%(threadName)20s] %(message)s"))
+		if not queued:
+			logger.addHandler(handler)
+			return logger, handler, None
+		records = queue.Queue()
+		listener = logging.handlers.QueueListener(records, handler)
+		listener.start()
+		logger.addHandler(logging.handlers.QueueHandler(records))
+		return logger, handler, listener
+
+	blast_header("Logging")
+	for engine, logging_mode in [(engine, mode) for engine in ["threads", "selector"] for mode in ["off", "eager", "lazy", "file", "queued"]]:
+		logger, handler, listener = PhantomLogger(), None, None
+		if logging_mode in ["eager", "lazy"]:
+			logger, handler, listener = file_logger(False, logging.WARNING, logging_mode == "eager")
+		elif logging_mode != "off":
+			logger, handler, listener = file_logger(logging_mode == "queued")
+		blast_row(engine, logging_mode, blast(engine, messages, size, logger = logger), size)
+		if listener != None:
+			listener.stop()
+		if handler != None:
+			handler.close()
+			os.remove(handler.baseFilename)
+
+def bench_metrics(messages = 20000, size = 2**12):
+	"""Blast a model with messages (see `blast`) without metrics, with
+	metrics, and with metrics scraped continuously."""
+	from stolas.metrics import MetricsRegistry
+	threading.current_thread().setName("Main__")
+
+	def scrape(registry, done):
+		while not done.is_set():
+			registry.exposition()
+			time.sleep(0.01)
+
+	blast_header("Metrics")
+	for engine, mode in [(engine, mode) for engine in ["threads", "selector"] for mode in ["off", "on", "scraped"]]:
+		registry = MetricsRegistry() if mode != "off" else None
+		done = threading.Event()
+		scraper = threading.Thread(target = scrape, args = (registry, done))
+		if mode == "scraped":
+			scraper.start()
+		blast_row(engine, mode, blast(engine, messages, size, metrics = registry), size)
+		done.set()
+		if scraper.is_alive():
+			scraper.join()
+
+def bench_tracing(messages = 20000, size = 2**12):
+	"""Blast a model with messages (see `blast`) without tracing, tracing a
+	sample of them, and tracing all of them, then show where the time went."""
+	from stolas.tracing import Tracer
+	threading.current_thread().setName("Main__")
+
+	def finish(item):
+		if item[2] != None:
+			item[2].finish()
+
+	blast_header("Traced")
+	for engine, rate in [(engine, rate) for engine in ["threads", "selector"] for rate in [0, 0.01, 1]]:
+		tracer = Tracer(rate) if rate > 0 else None
+		blast_row(engine, "{0:.0%}".format(rate), blast(engine, messages, size, finish, tracer = tracer), size)
+		if rate == 1:
+			for stage, histogram in tracer.histograms():
+				if histogram.count > 0:
+					print("\t{0:10s} {1:8d} traces, mean {2:8.3f}ms, p99 < {3:.3f}ms".format(
+						stage, histogram.count, histogram.mean() * 1000, histogram.quantile(0.99) * 1000))
+
+if __name__ == "__main__":
+	benchmarks = {
+		"engines": bench_engines,
+		"coalesce": bench_coalesce,
+		"control": bench_control,
+		"distribution": bench_distribution,
+		"framer": bench_framer,
+		"idle": bench_idle,
+		"integration": bench_integration,
+		"logging": bench_logging,
+		"metrics": bench_metrics,
+		"registry": bench_registry,
+		"selection": bench_selection,
+		"sockets": bench_sockets,
+		"tracing": bench_tracing,
+		"workers": bench_workers,
+	}
+	if len(argv) < 2 or not argv[1] in benchmarks:
+		print("Available benchmarks : {0}".format(", ".join(sorted(benchmarks))))
+	else:
+		benchmarks[argv[1]]()
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+
+import os
+import random
+import socket
+import time
+
+from stolas.betterui import pprint as print
+from stolas.buffers import OutputBuffer
+
+def test_output_buffer():
+	frames = [os.urandom(random.randrange(1, 70000)) for e in range(200)]
+	expected = b"".join(frames)
+
+	# A small send buffer forces many partial writes
+	left, right = socket.socketpair()
+	left.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+	left.setblocking(False)
+	right.setblocking(False)
+
+	buf = OutputBuffer()
+	for frame in frames:
+		buf.append(frame)
+	assert(len(buf) == len(expected))
+
+	received = bytearray()
+	while len(buf) > 0 or len(received) < len(expected):
+		try:
+			buf.flush(left)
+		except BlockingIOError:
+			pass
+		try:
+			received += right.recv(65536)
+		except BlockingIOError:
+			pass
+
+	assert(received == expected)
+	assert(len(buf.frames) == 0 and buf.offset == 0)
+	left.close()
+	right.close()
+
+	# What is left after a partial consumption is all that's taken
+	for frame in frames[:3]:
+		buf.append(frame)
+	buf.consume(len(frames[0]) + 1)
+	assert(b"".join(buf.take()) == b"".join(frames[:3])[len(frames[0]) + 1:])
+	assert(len(buf) == 0)
+
+	# Urgent frames go ahead of the others, but not of what is being sent
+	buf.append(b"bulk1")
+	buf.append(b"bulk2")
+	buf.append(b"bulk3")
+	buf.consume(2)
+	buf.append(b"ack1", urgent = True)
+	buf.append(b"ack2", urgent = True)
+	buf.consume(3)
+	buf.append(b"ack3", urgent = True)
+	assert(b"".join(buf.take()) == b"ack1ack2ack3bulk2bulk3")
+
+	# Small frames are held back together, for a while or until they add up
+	buf = OutputBuffer(coalesce = (0.05, 100))
+	assert(buf.append(b"ack1") and buf.holding() > 0)
+	assert(not buf.append(b"ack2") and buf.holding() > 0)
+	time.sleep(0.06)
+	assert(buf.holding() == 0)
+	buf.take()
+	assert(buf.append(b"ack3") and buf.holding() > 0)
+	assert(buf.append(b"\0" * 200) and buf.holding() == 0)
+	buf.take()
+	assert(buf.append(b"ack4") and buf.holding() > 0)
+
+	# Congestion starts at the high water mark and ends at the low one
+	buf = OutputBuffer(high_water = (1000, 10), low_water = (100, 5))
+	for e in range(9):
+		buf.append(b"\0" * 10)
+	assert(not buf.congested())
+	buf.append(b"\0" * 10)
+	assert(buf.congested())
+	buf.consume(40)
+	assert(buf.congested() and not buf.wait_drained(0.01))
+	buf.consume(10)
+	assert(not buf.congested() and buf.wait_drained(0))
+
+	print("Output Buffer ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_output_buffer()
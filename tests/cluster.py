@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+import multiprocessing
+import queue
+import random
+import time
+
+from stolas.betterui import pprint as print
+from stolas.cluster import shared_claims, SharedClaims, Claimer
+from stolas.unisocket import UnisocketModel
+from stolas.stolas import Stolas
+
+class CountingClaims(SharedClaims):
+	"""Claims counting the calls made to the manager."""
+	calls = 0
+	def claim_many(self, claims):
+		self.calls += 1
+		return super().claim_many(claims)
+
+def claim_all(claims, usigs, results):
+	results.put([usig for usig in usigs if claims.claim(usig, time.time() + 60)])
+
+def test_shared_claims(processes = 4):
+	claims, manager = shared_claims()
+	usigs = ["{0:x}".format(random.getrandbits(128)) for e in range(200)]
+	results = multiprocessing.Queue()
+	workers = [multiprocessing.Process(target = claim_all, args = (claims, usigs, results)) for e in range(processes)]
+	for worker in workers:
+		worker.start()
+	claimed = []
+	for worker in workers:
+		claimed += results.get()
+	for worker in workers:
+		worker.join()
+
+	# Every message was claimed, by a single process
+	assert(sorted(claimed) == sorted(usigs))
+	assert(not claims.claim(usigs[0], time.time() + 60))
+
+	# Dead messages are forgotten
+	assert(claims.claim("dead", time.time() - 1))
+	assert(claims.vacuum() == 1 and len(claims) == len(usigs))
+
+	# Claims are made in batches, away from whoever submits them
+	counting = CountingClaims(claims.shared)
+	outcomes = queue.Queue()
+	claimer = Claimer(counting, lambda won, usig: outcomes.put((usig, won)))
+	claimer.start()
+	fresh = ["{0:x}".format(random.getrandbits(128)) for e in range(1000)]
+	for usig in fresh + usigs[:10]:
+		claimer.submit(usig, time.time() + 60, usig)
+	claimer.stop()
+	claimer.join()
+	won = dict([outcomes.get() for e in range(len(fresh) + 10)])
+	assert(all([won[usig] for usig in fresh]) and not any([won[usig] for usig in usigs[:10]]))
+	print("Claimed {0} messages in {1} calls".format(len(won), counting.calls))
+	assert(counting.calls < len(won) // 4)
+
+	# A message reaching two nodes of a cluster is only logged by one
+	port = random.randrange(1024, 60000)
+	sender = Stolas(port = port, virtual = True)
+	nodes = [Stolas(port = port + index, virtual = True, claims = claims) for index in [1, 2]]
+	for node in [sender] + nodes:
+		node.start()
+	for node in nodes:
+		node.networker.peer_add(("127.0.0.1", port))
+	while len(sender.networker.peers) < 2:
+		time.sleep(0.05)
+	sender.send_message("", b"Hello, cluster")
+	then = time.time()
+	while sum([len(node.mpile) for node in nodes]) == 0:
+		assert(time.time() - then < 10)
+		time.sleep(0.05)
+	time.sleep(0.5)
+	assert(sorted([len(node.mpile) for node in nodes]) == [0, 1])
+	for node in [sender] + nodes:
+		node.stop()
+	for node in [sender] + nodes:
+		node.join()
+	manager.shutdown()
+
+	# Several models can serve the same port
+	port = random.randrange(1024, 65500)
+	models = [UnisocketModel(port, name = index, reuse_port = True) for index in range(2)]
+	for model in models:
+		model.start()
+	for model in models:
+		model.stop()
+	for model in models:
+		model.join()
+
+	print("Shared Claims ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_shared_claims()
@@ -1,6 +1,9 @@
 import sys
+import random
 from io import StringIO
 
+from stolas.unisocket import UnisocketModel
+
 def network_collapse(cluster):
 	i = 1
 	for obj in cluster:
@@ -12,6 +15,19 @@ def network_collapse(cluster):
 		i += 1
 	print("\nAll models terminated")
 
+def start_model(**kwargs):
+	"""Start a UnisocketModel with the given options on a random port,
+	trying the next ones until one is free."""
+	port = random.randrange(1024, 65500)
+	while True:
+		model = UnisocketModel(port = port, **kwargs)
+		try:
+			model.start()
+			return model
+		except OSError:
+			model.stop()
+			port += 1
+
 def swap_in(stdout):
 	"""Swap in the current stdout object for one given as argument (requires that object to support read/write operations)."""
 	old = sys.stdout
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+import queue
+import socket
+import time
+
+from stolas.betterui import pprint as print
+from stolas.dialer import Dialer
+from stolas.unisocket import UnisocketModel
+
+def unanswering():
+	"""Returns a listening socket whose backlog is full, so that connecting
+	to it never completes, and the sockets filling its backlog."""
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listener.bind(("127.0.0.1", 0))
+	listener.listen(0)
+	held = []
+	while True:
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.settimeout(0.2)
+		try:
+			sock.connect(listener.getsockname())
+		except socket.timeout:
+			sock.close()
+			return listener, held
+		held.append(sock)
+
+def test_dialer():
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listener.bind(("127.0.0.1", 0))
+	listener.listen(8)
+	refusing = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	refusing.bind(("127.0.0.1", 0)) # Bound, but not listening
+	silent, held = unanswering()
+
+	events = queue.Queue()
+	dialer = Dialer(lambda verbinfo, sock, elapsed: events.put(("connected", verbinfo, sock, elapsed)),
+		lambda verbinfo, error: events.put(("failed", verbinfo, error, None)), timeout = 0.5)
+	dialer.start()
+
+	# Every candidate is dialed at once : the ones that answer are not held
+	# up by the one that doesn't
+	now = time.monotonic()
+	for verbinfo in [silent.getsockname(), refusing.getsockname(), listener.getsockname()]:
+		assert(dialer.dial(verbinfo))
+	assert(not dialer.dial(silent.getsockname())) # Being dialed already
+	assert(len(dialer) == 3)
+	outcomes = {}
+	for e in range(3):
+		kind, verbinfo, detail, elapsed = events.get(timeout = 5)
+		outcomes[verbinfo] = (kind, detail, time.monotonic() - now)
+
+	kind, sock, elapsed = outcomes[listener.getsockname()]
+	assert(kind == "connected" and elapsed < 0.5)
+	sock.close()
+	kind, error, elapsed = outcomes[refusing.getsockname()]
+	assert(kind == "failed" and isinstance(error, ConnectionRefusedError) and elapsed < 0.5)
+	kind, error, elapsed = outcomes[silent.getsockname()]
+	assert(kind == "failed" and isinstance(error, TimeoutError) and 0.4 < elapsed < 2)
+	assert(len(dialer) == 0 and not dialer.dialing(silent.getsockname()))
+
+	# Attempts still on their way when the dialer stops are failed
+	dialer.dial(silent.getsockname())
+	time.sleep(0.1)
+	dialer.stop()
+	dialer.join()
+	kind, verbinfo, error, elapsed = events.get(timeout = 1)
+	assert(kind == "failed" and isinstance(error, ConnectionAbortedError))
+	assert(not dialer.dial(listener.getsockname()))
+
+	# A model that stopped closes the sockets handed to it
+	model = UnisocketModel(0, listen = False)
+	sock = socket.create_connection(listener.getsockname())
+	assert(model.peer_add(listener.getsockname(), sock, outbound = True) == False)
+	assert(sock.fileno() == -1)
+
+	for sock in held + [listener, refusing, silent]:
+		sock.close()
+	print("Dialer ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_dialer()
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+
+import os
+import random
+import socket
+import threading
+
+from stolas.betterui import pprint as print
+from stolas.framer import Framer, FramingError, SpilledFrame
+from stolas.protocol import *
+from stolas.utils import i2b
+
+def random_packet():
+	"""Build a random valid packet of the lower protocol."""
+	header = random.choice(list(PACKET_FRAMING.keys()))
+	if header in [MESSAGE_BYTE, CHUNK_BYTE]:
+		payload = os.urandom(random.randrange(1, 5000))
+		return i2b(header) + i2b(len(payload), 3) + payload
+	elif header in [SHAREPEER_BYTE, ADVERTISE_BYTE]:
+		addr = "127.0.0.{0}".format(random.randrange(256)).encode("utf8")
+		return i2b(header) + i2b(len(addr)) + addr + i2b(random.randrange(65536), 2)
+
+	length, field = PACKET_FRAMING[header]
+	return i2b(header) + os.urandom(length - 1)
+
+def test_framer():
+	packets = [random_packet() for e in range(2000)]
+	stream = b"".join(packets)
+
+	# Feed the stream in pieces of random size and expect the same packets
+	framer = Framer()
+	sliced = []
+	index = 0
+	while index < len(stream):
+		step = random.randrange(1, 2048)
+		framer.feed(stream[index:index+step])
+		sliced += list(framer.frames())
+		index += step
+	assert(sliced == packets)
+	assert(len(framer) == 0)
+
+	# Data is received in place, and the buffer is reused from one read to
+	# the next
+	left, right = socket.socketpair()
+	sender = threading.Thread(target = left.sendall, args = (stream,))
+	sender.start()
+	framer = Framer(read_size = 1024)
+	sliced, reads = [], 0
+	while len(sliced) < len(packets):
+		with framer.reserve() as view:
+			size = right.recv_into(view)
+		framer.commit(size)
+		sliced += list(framer.frames())
+		reads += 1
+	sender.join()
+	left.close()
+	right.close()
+	assert(sliced == packets and framer.received == len(stream))
+	assert(framer.allocations < reads / 10)
+
+	# The Death Sequence arrives in pieces too, and ends everything
+	framer.feed(DEATH_SEQUENCE[:20])
+	assert(framer.next_frame() == None)
+	framer.feed(DEATH_SEQUENCE[20:] + b"\x02")
+	assert(framer.next_frame() == DEATH_SEQUENCE)
+	assert(len(framer) == 0)
+
+	# Garbage is reported and dropped
+	framer.feed(packets[0] + b"\xff" * 10)
+	assert(framer.next_frame() == packets[0])
+	try:
+		framer.next_frame()
+	except FramingError as err:
+		assert(err.discarded == 10)
+	else:
+		assert(False)
+	assert(len(framer) == 0)
+
+	# Packets too long are refused as soon as their length is known, and
+	# what follows them is still sliced
+	framer = Framer(max_frame = 2**13)
+	big = i2b(MESSAGE_BYTE) + i2b(2**13, 3) + os.urandom(2**13)
+	framer.feed(big[:100])
+	try:
+		framer.next_frame()
+	except FramingError as err:
+		assert(err.discarded == len(big))
+	else:
+		assert(False)
+	framer.feed(big[100:] + packets[0])
+	assert(framer.next_frame() == packets[0])
+	assert(len(framer) == 0)
+
+	# Long packets are spilled to disk as they arrive
+	framer = Framer(spill = 2**13)
+	for index in range(0, len(big), 1000):
+		framer.feed(big[index:index+1000])
+		if index + 1000 < len(big):
+			assert(framer.next_frame() == None)
+	framer.feed(packets[1])
+	spilled = framer.next_frame()
+	assert(isinstance(spilled, SpilledFrame))
+	assert(len(spilled) == len(big) and spilled[0] == MESSAGE_BYTE and spilled[1:4] == big[1:4])
+	assert(spilled.open(4).read() == big[4:])
+	assert(framer.next_frame() == packets[1])
+	spilled.close()
+
+	# And they stream through a buffer no larger than a read
+	framer = Framer(spill = 2**13, read_size = 2**10)
+	framer.feed(big[:4])
+	assert(framer.next_frame() == None)
+	received = 4
+	while received < len(big):
+		with framer.reserve() as view:
+			size = min(len(view), len(big) - received)
+			assert(size <= 2**10)
+			view[:size] = big[received:received+size]
+		framer.commit(size)
+		received += size
+		assert(len(framer.buffer) <= 2**11)
+	spilled = framer.next_frame()
+	assert(isinstance(spilled, SpilledFrame) and spilled.open(4).read() == big[4:])
+	spilled.close()
+
+	print("Framer ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_framer()
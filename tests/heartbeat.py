@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+
+import socket
+import time
+
+from stolas.betterui import pprint as print
+from stolas.unisocket import Peer
+from stolas.framer import Framer
+from stolas.protocol import *
+from stolas.utils import i2b
+from common import start_model
+
+def test_heartbeat(engine = "threads"):
+	# Round trip times are smoothed, and so is their deviation
+	peer = Peer(0, None)
+	peer.measure(0.1)
+	assert(peer.rtt == 0.1 and peer.jitter == 0.05)
+	peer.measure(0.2)
+	assert(0.1 < peer.rtt < 0.2 and 0.05 < peer.jitter < 0.1)
+
+	# A peer answering our pings is measured, and kept
+	model = start_model(engine = engine, heartbeat = 0.1, heartbeat_misses = 3)
+	sock = socket.create_connection(("127.0.0.1", model.port))
+	sock.settimeout(2)
+	while len(model.peers) == 0:
+		time.sleep(0.05)
+	peer = list(model.peers.values())[0]
+	framer, pings = Framer(), 0
+	while pings < 10:
+		framer.feed(sock.recv(2**10))
+		for packet in framer.frames():
+			if packet[0] == PING_BYTE: # Anything else is ignored
+				sock.sendall(i2b(PONG_BYTE) + packet[1:])
+				pings += 1
+	time.sleep(0.1)
+	assert(model.peer_get(peer.pid) is peer and peer.missed == 0)
+	assert(peer.rtt != None and 0 < peer.rtt < 0.1)
+	print("Measured a round trip time of {0:.2f}ms (±{1:.2f}ms)".format(peer.rtt * 1000, peer.jitter * 1000))
+
+	# Once it falls silent, it is evicted
+	now = time.time()
+	while model.peer_get(peer.pid) != None:
+		assert(time.time() - now < 2)
+		time.sleep(0.05)
+	print("Evicted a silent peer in {0:.2f}s".format(time.time() - now))
+	sock.close()
+	model.stop()
+	model.join()
+
+	print("Heartbeat ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_heartbeat()
+	test_heartbeat("selector")
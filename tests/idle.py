@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+import os
+import resource
+import socket
+import sys
+import time
+
+from stolas.betterui import pprint as print
+from common import start_model
+
+def cpu_time():
+	"""CPU time (user + system) consumed by our process so far."""
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	return usage.ru_utime + usage.ru_stime
+
+def thread_cpu_time(thread):
+	"""CPU time consumed by one of our threads so far, or None if we can't
+	tell (outside of Linux)."""
+	try:
+		with open("/proc/self/task/{0}/stat".format(thread.native_id)) as stat:
+			fields = stat.read().rsplit(")", 1)[1].split()
+	except OSError:
+		return None
+	return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def waiting_in(thread, function):
+	"""Tell whether a thread is currently in a call to `function`."""
+	frame = sys._current_frames().get(thread.ident, None)
+	while frame != None:
+		if frame.f_code.co_name == function:
+			return True
+		frame = frame.f_back
+	return False
+
+def test_idle_processor(engine = "threads", duration = 2):
+	model = start_model(engine = engine)
+	sock = socket.create_connection(("127.0.0.1", model.port))
+	while len(model.peers) == 0:
+		time.sleep(0.05)
+	time.sleep(0.5) # Settle
+
+	# With nothing to do, the processor sleeps on its queue, for a long while
+	samples = 0
+	for e in range(20):
+		samples += waiting_in(model.processor, "get")
+		time.sleep(0.01)
+	assert(samples >= 18)
+	now, processor = cpu_time(), thread_cpu_time(model.processor)
+	time.sleep(duration)
+	spent = cpu_time() - now
+	print("Idle for {0}s, spent {1:.3f}s of CPU time".format(duration, spent))
+	if processor != None:
+		assert(thread_cpu_time(model.processor) - processor < duration * 0.05)
+	elif engine != "threads":
+		# Peers of the "threads" engine are served by busy threads, but
+		# nothing else should be running
+		assert(spent < duration * 0.05)
+
+	sock.close()
+	model.stop()
+	model.join()
+
+	print("Idle Processor ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_idle_processor()
+	test_idle_processor("selector")
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+import logging
+import os
+import socket
+
+import stolas.unisocket
+from stolas.betterui import pprint as print
+from stolas.framer import Framer
+from stolas.protocol import *
+from stolas.utils import i2b, Excerpt
+from common import start_model
+
+class CountingExcerpt(Excerpt):
+	"""Excerpt counting how many times it was formatted."""
+	formatted = 0
+
+	def __str__(self):
+		CountingExcerpt.formatted += 1
+		return super().__str__()
+
+class ListHandler(logging.Handler):
+	"""Handler keeping the messages of the records it is given."""
+	def __init__(self):
+		super().__init__()
+		self.messages = []
+
+	def emit(self, record):
+		self.messages.append(record.getMessage())
+
+def received_by(level, messages = 20):
+	"""Send messages to a model logging at `level`, and return what it logged
+	along with the amount of payload excerpts it formatted."""
+	logger, handler = logging.Logger("lazy"), ListHandler()
+	logger.setLevel(level)
+	logger.addHandler(handler)
+	model = start_model(logger = logger, heartbeat = None)
+	sock = socket.create_connection(("127.0.0.1", model.port))
+	payload = os.urandom(2**12)
+	CountingExcerpt.formatted = 0
+	for e in range(messages):
+		sock.sendall(i2b(MESSAGE_BYTE) + i2b(len(payload), 3) + payload)
+
+	# Every message handled is acknowledged
+	framer, acks = Framer(), 0
+	while acks < messages:
+		framer.feed(sock.recv(2**16))
+		acks += len([frame for frame in framer.frames() if frame[0] == MESSAGEACK_BYTE])
+	sock.close()
+	model.stop()
+	model.join()
+	return handler.messages, CountingExcerpt.formatted
+
+def test_lazy_logging():
+	# Payloads are never logged in full
+	assert(str(Excerpt(b"tiny")) == repr(b"tiny"))
+	excerpt = str(Excerpt(bytes(2**16)))
+	assert(len(excerpt) < 2**10 and excerpt.endswith("({0} bytes)".format(2**16)))
+
+	# And only formatted if they're logged at all
+	original, stolas.unisocket.Excerpt = stolas.unisocket.Excerpt, CountingExcerpt
+	try:
+		messages, formatted = received_by(logging.WARNING)
+		assert(formatted == 0)
+		assert(not any([message.startswith("Received") for message in messages]))
+		messages, formatted = received_by(logging.INFO)
+		assert(formatted == 20)
+		assert(len([message for message in messages if message.startswith("Received")]) == 20)
+	finally:
+		stolas.unisocket.Excerpt = original
+
+	print("Lazy Logging ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_lazy_logging()
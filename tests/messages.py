@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+import io
+import os
+import random
+
+from stolas.betterui import pprint as print
+from stolas.chunks import Reassembler, ReassemblyLimitError
+from stolas.framer import Framer
+from stolas.protocol import Message, CHUNK_BYTE
+from stolas.utils import b2i
+
+def test_message_implosion():
+	msgobj = Message(payload = os.urandom(2**12) + bytes(2**12), channel = "test", ttl = 120)
+	assert(not msgobj.is_imploded())
+
+	# Imploding only compresses once
+	data = msgobj.implode()
+	assert(msgobj.is_imploded() and msgobj.implode() is data)
+	frame = msgobj.frame()
+	assert(msgobj.frame() is frame)
+	framer = Framer()
+	framer.feed(frame)
+	assert(list(framer.frames()) == [frame])
+
+	# Exploded messages keep what they were received as
+	exploded = Message.explode(data)
+	assert(exploded == msgobj and exploded.implode() is data)
+
+	# Messages can be exploded from a file, read in pieces
+	streamed = Message.explode(io.BytesIO(data))
+	assert(streamed == msgobj and not streamed.is_imploded())
+	try:
+		Message.explode(io.BytesIO(data[:-10]))
+	except ValueError:
+		pass
+	else:
+		assert(False)
+
+	# Chunks can be reassembled in any order, whatever peer they come from
+	chunks = msgobj.chunks(1000)
+	assert(msgobj.chunks(1000) is chunks and len(chunks) == (len(data) + 999) // 1000)
+	framer = Framer()
+	framer.feed(b"".join(chunks))
+	assert(list(framer.frames()) == chunks and chunks[0][0] == CHUNK_BYTE)
+	reassembler = Reassembler(1000)
+	for index, chunk in enumerate(random.sample(chunks, len(chunks))):
+		reassembly, new, complete = reassembler.feed(chunk[4:68], b2i(chunk[68:71]), b2i(chunk[71:74]), chunk[74:], index % 3)
+		assert(new and complete == (index == len(chunks) - 1))
+		if index == 0:
+			assert(not reassembler.feed(chunk[4:68], b2i(chunk[68:71]), b2i(chunk[71:74]), chunk[74:], 3)[1])
+	assert(len(reassembler) == 0 and reassembler.feed(chunk[4:68], len(data), 0, data[:1000], 0)[0] == None)
+	reassembly.map.seek(0)
+	assert(Message.explode(reassembly.map) == msgobj)
+
+	# Chunks out of place, overlapping or too long never complete a Message
+	usig = chunks[0][4:68]
+	reassembler = Reassembler(1000, max_total = 2**16, max_pending = 3, max_per_source = 2)
+	for offset, size in [(500, 1000), (0, 1001), (0, 999), (len(data) - 10, 10)]:
+		try:
+			reassembler.feed(usig, len(data), offset, data[offset:offset+size], 0)
+		except ValueError:
+			pass
+		else:
+			assert(False)
+	for chunk in chunks[:-1] * 2:
+		assert(not reassembler.feed(usig, len(data), b2i(chunk[71:74]), chunk[74:], 0)[2])
+	try:
+		reassembler.feed(b"\1" * 64, 2**16 + 1, 0, bytes(1000), 0)
+	except ValueError:
+		pass
+	else:
+		assert(False)
+
+	# And only so many Messages are reassembled at once, and per peer
+	reassembler.feed(b"\1" * 64, 2000, 0, bytes(1000), 0)
+	for usig, source in [(b"\2" * 64, 0), (b"\3" * 64, 1), (b"\4" * 64, 2)]:
+		try:
+			reassembler.feed(usig, 2000, 0, bytes(1000), source)
+		except ReassemblyLimitError:
+			pass
+		else:
+			assert(usig == b"\3" * 64)
+	assert(len(reassembler) == 3 and reassembler.expire(0) == 3 and len(reassembler.owned) == 0)
+
+	# Every setter drops what was imploded
+	for setter, value in [("set_timestamp", 1234), ("set_ttl", 3600), ("set_channel", "other"), ("set_payload", b"payload")]:
+		getattr(msgobj, setter)(value)
+		assert(not msgobj.is_imploded())
+		assert(Message.explode(msgobj.implode()) == msgobj)
+		assert(msgobj.frame() != frame)
+
+	print("Message Implosion ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_message_implosion()
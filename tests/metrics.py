@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+import random
+import threading
+import time
+import urllib.request
+
+from stolas.betterui import pprint as print
+from stolas.metrics import MetricsRegistry, CONTENT_TYPE
+from stolas.stolas import Stolas
+
+def test_metrics():
+	registry = MetricsRegistry()
+
+	# Counters add up what every thread counted, even once they're gone
+	counter = registry.counter("test_total", "Things counted")
+	threads = [threading.Thread(target = lambda: [counter.inc() for e in range(10000)]) for e in range(4)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	counter.inc(5)
+	assert(counter.get() == 40005)
+
+	# Labels, gauges backed by functions, and histograms
+	packets = registry.counter("test_packets_total", "Packets", ["type"])
+	packets.labels("MESSAGE").inc(3)
+	registry.gauge("test_depth", "Depth", function = lambda: 7)
+	latency = registry.histogram("test_seconds", "Latency", (0.1, 1))
+	for value in [0.05, 0.5, 5]:
+		latency.observe(value)
+	text = registry.exposition()
+	for line in ["# TYPE test_total counter", "test_total 40005", "test_packets_total{type=\"MESSAGE\"} 3",
+		"test_depth 7", "test_seconds_bucket{le=\"1\"} 2", "test_seconds_bucket{le=\"+Inf\"} 3", "test_seconds_count 3"]:
+		assert(line in text.split("\n"))
+	assert(registry.get("test_packets_total", "MESSAGE") == 3)
+
+	# Nodes record what goes through them, and serve it
+	port = random.randrange(1024, 60000)
+	sender = Stolas(port = port, virtual = True, metrics = True)
+	receiver = Stolas(port = port + 1, virtual = True, metrics_port = 0)
+	sender.start()
+	receiver.start()
+	receiver.networker.peer_add(("127.0.0.1", port))
+	while len(sender.networker.peers) == 0:
+		time.sleep(0.05)
+	sender.send_message("", b"Hello, metrics")
+	then = time.time()
+	while receiver.metrics.get("stolas_mpile_added_total") != 1:
+		assert(time.time() - then < 10)
+		time.sleep(0.05)
+	assert(receiver.metrics.get("stolas_packets_received_total", "MESSAGE") >= 1)
+	assert(sender.metrics.get("stolas_messages_broadcast_total") >= 1)
+	assert(receiver.metrics.get("stolas_bytes_total", "inbound") > 0)
+	response = urllib.request.urlopen("http://127.0.0.1:{0}/metrics".format(receiver.metrics_server.port))
+	assert(response.headers["Content-Type"] == CONTENT_TYPE)
+	scraped = response.read().decode("utf8")
+	assert("stolas_mpile_added_total 1" in scraped.split("\n"))
+	assert("stolas_peers 1" in scraped.split("\n"))
+	print(scraped.count("\n"), "lines of metrics")
+
+	for node in [sender, receiver]:
+		node.stop()
+	for node in [sender, receiver]:
+		node.join()
+
+	print("Metrics ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_metrics()
@@ -13,7 +13,7 @@ from stolas.stolas import Stolas
 from stolas.unisocket import UnisocketModel
 from stolas.protocol import Message
 
-from common import network_collapse
+from common import network_collapse, start_model
 
 def run_stolas():
 	port = None
@@ -37,7 +37,7 @@ def __trigger_connection(n, host):
 		pass
 	assert(len(n.peers) > 0)
 
-def build_network(port, quantity = None):
+def build_network(port, quantity = None, engine = "threads"):
 	ports = []
 	cport = port
 	objects = []
@@ -47,7 +47,7 @@ def build_network(port, quantity = None):
 	for n in range(quantity):
 		while True:
 			try:
-				stols = UnisocketModel(port = cport, name = len(ports))
+				stols = UnisocketModel(port = cport, name = len(ports), engine = engine)
 				stols.start()
 				if len(ports) > 0:
 					rport = random.choice(ports)
@@ -68,15 +68,15 @@ def build_network(port, quantity = None):
 	return objects
 
 
-def test_network_integration_and_collapsing():
+def test_network_integration_and_collapsing(engine = "threads"):
 	import time
 
 	threading.current_thread().setName("Main__")
 	port = random.randrange(1024, 65500)
 
-	print("Started on port {0}".format(port))
+	print("Started on port {0} ({1} engine)".format(port, engine))
 
-	models = build_network(port, random.randrange(10, 20))
+	models = build_network(port, random.randrange(10, 20), engine)
 
 	print("Readying...")
 	print("Asserting that the network is correct...", end = "")
@@ -107,6 +107,28 @@ def test_network_integration_and_collapsing():
 
 	return worked_out_fine # We're a test unit
 
+def test_bounded_shutdown(engine = "threads"):
+	# A peer that never reads cannot hold our shutdown past its deadline
+	model = start_model(name = "slow", engine = engine, shutdown_timeout = 0.5)
+	sink = socket.create_connection(("127.0.0.1", model.port))
+	while len(model.peers) == 0:
+		time.sleep(0.1)
+
+	pid = list(model.peers.keys())[0]
+	for _ in range(256):
+		model.raw_peer_send(pid, b"\xff" * 2**16)
+
+	now = time.time()
+	model.stop()
+	model.join()
+	delta = time.time() - now
+	sink.close()
+	print("Shutdown took {0:.2f}s, abandoned {1}".format(delta, model.abandoned))
+	assert(delta < 3)
+	assert(model.abandoned["peers"] == 1 and model.abandoned["bytes"] > 0)
+	assert(len(model.peers) == 0)
+	return True # We're a test unit
+
 def manual_stolas_prompt(eh):
 	while eh.running and eh.networker.running:
 		try:
@@ -144,30 +166,25 @@ def manual_stolas_prompt(eh):
 			eh.message_broadcast(msgobj)
 
 		elif csplit[0] == "haddaway":
-			eh.networker.peerlock.acquire()
 			for peer in eh.networker.peers:
 				eh.networker.raw_peer_send(peer, eh.networker.death_sequence)
-			eh.networker.peerlock.release()
 			time.sleep(1)
 
 		elif csplit[0] == "peers":
-			eh.networker.peerlock.acquire()
+			peers = eh.networker.peers
 			colors = ["red", "yellow", "green", "cyan", "blue", "magenta"]
 			col = random.randrange(0,len(colors))
-			for peer in sorted(list(eh.networker.peers.keys())):
+			for peer in sorted(list(peers.keys())):
 				print("~<s:bright]{0}~<s:reset_all] => ~<f:{1}]{2}~<s:reset_all]".format(
 					peer,
 					colors[col],
-					eh.networker.peers[peer].listen or eh.networker.peers[peer].verbinfo
+					peers[peer].listen or peers[peer].verbinfo
 				))
 				col = (col+1)%len(colors)
-			eh.networker.peerlock.release()
 
 		elif csplit[0] == "fpeers":
-			eh.networker.peerlock.acquire()
-			for peer in [eh.networker.peers[peer] for peer in eh.networker.peers if eh.networker.peers[peer].listen != None]:
+			for peer in [peer for peer in eh.networker.peers.values() if peer.listen != None]:
 				print("~<s:bright]{0}~<s:reset_all] => ~<s:bright]{1}~<s:reset_all]".format(peer.pid, peer.listen))
-			eh.networker.peerlock.release()
 
 		elif csplit[0] == "port":
 			print("Port is : {0}".format(eh.port))
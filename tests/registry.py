@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+from stolas.betterui import pprint as print
+from stolas.registry import PeerRegistry, CandidateList
+
+class FakePeer:
+	def __init__(self, pid, verbinfo):
+		self.pid = pid
+		self.verbinfo = verbinfo
+		self.listen = None
+
+def test_registry():
+	registry = PeerRegistry()
+	peers = []
+	for port in range(5):
+		peer = FakePeer(registry.allocate(), ("127.0.0.1", 40000 + port))
+		registry.add(peer)
+		peers.append(peer)
+	assert([peer.pid for peer in peers] == list(range(5)))
+	assert(len(registry) == 5 and 3 in registry)
+
+	# Lookups by address and listen address
+	assert(registry.find(("127.0.0.1", 40002)) is peers[2])
+	registry.set_listen(peers[2], ("127.0.0.1", 62000))
+	assert(registry.find(("127.0.0.1", 62000)) is peers[2])
+	registry.set_listen(peers[2], ("127.0.0.1", 62001))
+	assert(registry.find(("127.0.0.1", 62000)) == None)
+	assert(list(registry.by_listen.values()) == [2])
+
+	# Tables are snapshots, left untouched by later changes, and only copied
+	# again once something changed
+	snapshot = registry.peers
+	assert(registry.peers is snapshot and registry.by_listen is registry.by_listen)
+	try:
+		snapshot[9] = peers[0]
+		assert(False)
+	except TypeError:
+		pass
+
+	# Released Peer IDs are reused, lowest first
+	registry.remove(3)
+	assert(3 in snapshot and 3 not in registry.peers)
+	assert(registry.peers is not snapshot and 3 not in registry)
+	registry.remove(1)
+	assert(registry.find(("127.0.0.1", 40001)) == None)
+	assert(registry.allocate() == 1 and registry.allocate() == 3)
+	assert(registry.allocate() == 5)
+	registry.remove(2)
+	assert(len(registry.by_listen) == 0)
+
+	# Candidates are unique, and removed in constant time
+	candidates = CandidateList([("127.0.0.1", port) for port in range(5)])
+	candidates += [("127.0.0.1", 0), ("127.0.0.1", 5)]
+	assert(len(candidates) == 6)
+	candidates.remove(("127.0.0.1", 1))
+	assert(("127.0.0.1", 1) not in candidates and len(candidates) == 5)
+	for addr in list(candidates):
+		assert(addr in candidates)
+		candidates.remove(addr)
+	assert(len(candidates) == 0)
+	try:
+		candidates.remove(("127.0.0.1", 1))
+		assert(False)
+	except ValueError:
+		pass
+
+	print("Registry ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_registry()
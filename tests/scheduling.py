@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+
+import queue
+import threading
+import time
+
+from stolas.betterui import pprint as print
+from stolas.scheduler import Scheduler
+
+def test_scheduler():
+	calls = []
+	scheduler = Scheduler()
+	assert(scheduler.timeout() == None)
+
+	# Callbacks run in deadline order, and only once due
+	scheduler.call_later(0.2, calls.append, "late")
+	scheduler.call_later(0.1, calls.append, "early")
+	cancelled = scheduler.call_later(0.1, calls.append, "cancelled")
+	scheduler.cancel(cancelled)
+	scheduler.run_pending()
+	assert(calls == [])
+	assert(0 < scheduler.timeout() <= 0.1)
+
+	time.sleep(0.25)
+	scheduler.run_pending()
+	assert(calls == ["early", "late"])
+	assert(scheduler.timeout() == None and len(scheduler) == 0)
+
+	# A thread sleeping on its queue is woken up for earlier deadlines
+	events = queue.Queue()
+	scheduler = Scheduler(wakeup = lambda: events.put(None))
+	scheduler.call_later(60, calls.append, "never")
+	def runner():
+		while True:
+			scheduler.run_pending()
+			if "woken" in calls:
+				break
+			try:
+				events.get(timeout = scheduler.timeout())
+			except queue.Empty:
+				pass
+	thread = threading.Thread(target = runner)
+	thread.start()
+	scheduler.call_later(0.05, calls.append, "woken")
+	thread.join(5)
+	assert(not thread.is_alive())
+
+	print("Scheduler ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_scheduler()
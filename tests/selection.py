@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+
+from stolas.betterui import pprint as print
+from stolas.selection import RandomSelection, LatencySelection, THROUGHPUT_SAMPLE
+from stolas.framer import Framer
+
+class FakePeer:
+	def __init__(self, pid, rtt):
+		self.pid = pid
+		self.rtt = rtt
+		self.listen = ("127.0.0.1", 40000 + pid)
+		self.iqueue = Framer()
+
+def test_peer_selection():
+	peers = dict([(pid, FakePeer(pid, rtt)) for pid, rtt in enumerate([0.01, 0.2, 0.05, 0.1])])
+	candidates = [("127.0.0.1", 50000 + index) for index in range(4)]
+
+	# Random selection never lets a peer go
+	selection = RandomSelection()
+	assert(len(selection.candidates(candidates, 2, peers)) == 2)
+	assert(selection.requestee(peers) in peers)
+	assert(selection.surplus(peers, 2) == [])
+
+	# Latency aware selection lets the slowest peers go, once all of them
+	# were measured
+	selection = LatencySelection()
+	selection.observe(peers)
+	assert(selection.surplus(peers, 2) == [1, 3])
+	assert(selection.requestee(peers) in [0, 2])
+	peers[4] = FakePeer(4, None)
+	assert(selection.surplus(peers, 1) == [])
+	del peers[4]
+
+	# A peer slow to send us data costs more
+	peers[0].iqueue.feed(bytes(THROUGHPUT_SAMPLE))
+	selection.observe(peers)
+	assert(selection.cost(peers[0]) > 0.01)
+
+	# Unknown candidates come first, then those cheaper than our worst peer
+	selection.connected(candidates[0], 0.5)
+	selection.connected(candidates[1], 0.001)
+	selection.failed(candidates[2])
+	picked = selection.candidates(candidates, 4, peers)
+	assert(picked == [candidates[3], candidates[1]])
+	# Peers we had are remembered by what they cost
+	assert(selection.candidates([peers[1].listen, peers[2].listen], 2, peers) == [peers[2].listen])
+
+	print("Peer Selection ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_peer_selection()
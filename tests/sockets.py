@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+
+import socket
+import time
+
+from stolas.betterui import pprint as print
+from common import start_model
+
+# Options given to the models, and the buffer sizes asked for
+KEEPALIVE = (30, 5, 3)
+BUFFER = 2**17
+
+def check_socket(sock, nodelay):
+	"""Check that the options of a model were applied to one of its peers'
+	sockets."""
+	assert(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY) == int(nodelay))
+	assert(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE) == 1)
+	for option, value in zip(["TCP_KEEPIDLE", "TCP_KEEPINTVL", "TCP_KEEPCNT"], KEEPALIVE):
+		if hasattr(socket, option):
+			assert(sock.getsockopt(socket.IPPROTO_TCP, getattr(socket, option)) == value)
+	# The kernel may double the sizes asked for, to account for its overhead
+	assert(sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) >= BUFFER)
+	assert(sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= BUFFER)
+
+def test_socket_options(engine = "threads"):
+	for nodelay in [True, False]:
+		server = start_model(engine = engine, nodelay = nodelay, keepalive = KEEPALIVE, sndbuf = BUFFER, rcvbuf = BUFFER)
+		client = start_model(engine = engine, nodelay = nodelay, keepalive = KEEPALIVE, sndbuf = BUFFER, rcvbuf = BUFFER)
+
+		# Sockets we connect, and sockets we accept, alike
+		pid = client.peer_add(("127.0.0.1", server.port))
+		assert(type(pid) == type(0))
+		check_socket(client.peer_get(pid).sock, nodelay)
+		then = time.time()
+		while len(server.peers) == 0:
+			assert(time.time() - then < 5)
+			time.sleep(0.05)
+		check_socket(list(server.peers.values())[0].sock, nodelay)
+
+		for model in [client, server]:
+			model.stop()
+		for model in [client, server]:
+			model.join()
+
+	print("Socket Options ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_socket_options()
+	test_socket_options("selector")
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+import socket
+import time
+
+from stolas.betterui import pprint as print
+from stolas.throttle import TokenBucket, Throttle
+from stolas.protocol import *
+from stolas.utils import i2b
+from common import start_model
+
+def test_throttle(engine = "threads"):
+	# Buckets go into debt, and tell how long it takes to pay it back
+	bucket = TokenBucket(1000)
+	bucket.take(1500)
+	assert(0.4 < bucket.delay() <= 0.5)
+	throttle = Throttle((None, 10), Throttle((1000, None)))
+	assert(throttle.account(100, 10) == 0)
+	assert(0 < throttle.account(1900, 1) <= 1)
+	assert(throttle.limited() and not Throttle().limited())
+
+	# Output to a peer is deferred, not dropped
+	rate = 2**17 # A second of burst, then another second of throttling
+	model = start_model(engine = engine, peer_outbound_rate = (rate, None))
+	sink = socket.create_connection(("127.0.0.1", model.port))
+	while len(model.peers) == 0:
+		time.sleep(0.05)
+	pid = list(model.peers.keys())[0]
+	frame = i2b(MESSAGEACK_BYTE) + i2b(1, 3)
+	now, received = time.time(), 0
+	for e in range(2**16):
+		model.raw_peer_send(pid, frame)
+	while received < 2**18:
+		received += len(sink.recv(2**16))
+	delta = time.time() - now
+	print("Sent {0} bytes at {1} bytes/s in {2:.2f}s".format(received, rate, delta))
+	assert(delta >= (received - rate) / rate * 0.8)
+	assert(model.throttled["outbound"] > 0)
+
+	# Input from a peer is read when allowed
+	sink.sendall(frame * 2**12)
+	sink.close()
+	model.stop()
+	model.join()
+
+	# Throttling happens between reads, so they're kept small
+	model = start_model(engine = engine, peer_inbound_rate = (None, 2**10), recv_size = 1024)
+	source = socket.create_connection(("127.0.0.1", model.port))
+	now = time.time()
+	source.sendall(frame * 2**12)
+	while model.batch_sizes.sum < 2**12:
+		time.sleep(0.05)
+	delta = time.time() - now
+	print("Received {0} frames at {1} frames/s in {2:.2f}s".format(2**12, 2**10, delta))
+	assert(delta >= 2)
+	assert(model.throttled["inbound"] > 0)
+	source.close()
+	model.stop()
+	model.join()
+
+	print("Throttling ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_throttle()
+	test_throttle("selector")
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+
+import random
+import time
+
+from stolas.betterui import pprint as print
+from stolas.tracing import Tracer
+from stolas.stolas import Stolas
+
+def test_tracing():
+	# Only a fraction of what is received is traced
+	tracer = Tracer(0.1)
+	sampled = len([trace for trace in [tracer.sample() for e in range(10000)] if trace != None])
+	assert(700 < sampled < 1300)
+	assert(Tracer(1).sample() != None)
+
+	# Stages are timed from the end of the previous one, and messages
+	# forked out of a batch go on on their own
+	trace = tracer.sample(time.monotonic() - 0.002)
+	while trace == None:
+		trace = tracer.sample(time.monotonic() - 0.002)
+	trace.stamp("parse")
+	fork = trace.fork()
+	fork.stamp("handle")
+	fork.finish()
+	histograms = dict(tracer.histograms())
+	assert(histograms["parse"].count == 1 and histograms["parse"].sum >= 0.002)
+	assert(histograms["handle"].count == 1 and histograms["handle"].sum < 0.002)
+	assert(histograms["total"].count == 1 and histograms["total"].sum >= 0.002)
+	assert(histograms["iqueue"].count == 0)
+
+	# Messages received by a node are traced through all of its stages
+	port = random.randrange(1024, 60000)
+	sender = Stolas(port = port, virtual = True)
+	receiver = Stolas(port = port + 1, virtual = True, trace_rate = 1, metrics = True)
+	sender.start()
+	receiver.start()
+	receiver.networker.peer_add(("127.0.0.1", port))
+	while len(sender.networker.peers) == 0:
+		time.sleep(0.05)
+	sender.send_message("", b"Hello, tracing")
+	then = time.time()
+	while dict(receiver.tracer.histograms())["total"].count == 0:
+		assert(time.time() - then < 10)
+		time.sleep(0.05)
+	for stage, histogram in receiver.tracer.histograms():
+		assert(histogram.count > 0)
+		print("{0:12s} {1:.3f}ms".format(stage, histogram.mean() * 1000))
+	assert("stolas_stage_seconds_count{stage=\"explode\"}" in receiver.metrics.exposition())
+
+	for node in [sender, receiver]:
+		node.stop()
+	for node in [sender, receiver]:
+		node.join()
+
+	print("Tracing ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_tracing()
@@ -15,7 +15,7 @@ from stolas.betterui import pprint as print
 from network import manual_stolas_prompt
 from common import network_collapse, mean
 
-def network_random(port, quantity = None):
+def network_random(port, quantity = None, **kwargs):
 	ports = []
 	cport = port
 	objects = []
@@ -25,7 +25,7 @@ def network_random(port, quantity = None):
 	for n in range(quantity):
 		while True:
 			try:
-				stols = stolas.stolas.Stolas(port = cport, virtual=True)
+				stols = stolas.stolas.Stolas(port = cport, virtual=True, **kwargs)
 				stols.start()
 				if len(ports) > 0:
 					rport = random.choice(ports)
@@ -107,19 +107,19 @@ def generate_random_payload():
 def cluster_average_integration(cluster):
         return mean([len(x.networker.peers) for x in cluster if x.is_alive()])
 
-def test_transmission():
+def test_transmission(**kwargs):
 	print("~<s:bright]Starting Message Transmission Test~<s:reset_all]")
 	controlfile = create_ctrlfile()
 
-	sender = stolas.stolas.Stolas()
-	receiver = stolas.stolas.Stolas()
+	sender = stolas.stolas.Stolas(**kwargs)
+	receiver = stolas.stolas.Stolas(**kwargs)
 	print("\t=> Ends created ~<sf:bright,green]\u2713~<s:reset_all]")
 
 	sender.start()
 	receiver.start()
 	print("\t=> Ends started ~<sf:bright,green]\u2713~<s:reset_all]")
 
-	cluster = network_random(sender.port+1, random.randrange(10,12))
+	cluster = network_random(sender.port+1, random.randrange(10,12), **kwargs)
 	print("\n\t=> Done creating the cluster ~<sf:bright,green]\u2713~<s:reset_all]")
 	sender.networker.peer_add(("localhost", random.choice(cluster).port))
 	receiver.networker.peer_add(("localhost", random.choice(cluster).port))
@@ -31,13 +31,78 @@ def main():
 	from encoders import test_encoders
 	run_test_unit("Encoders Test Unit", test_encoders)
 
+	from messages import test_message_implosion
+	run_test_unit("Message Implosion Test Unit", test_message_implosion)
+
+	from framing import test_framer
+	run_test_unit("Framer Test Unit", test_framer)
+
+	from buffers import test_output_buffer
+	run_test_unit("Output Buffer Test Unit", test_output_buffer)
+
+	from scheduling import test_scheduler
+	run_test_unit("Scheduler Test Unit", test_scheduler)
+
+	from registry import test_registry
+	run_test_unit("Peer Registry Test Unit", test_registry)
+
+	from selection import test_peer_selection
+	run_test_unit("Peer Selection Test Unit", test_peer_selection)
+
+	from dialer import test_dialer
+	run_test_unit("Dialer Test Unit", test_dialer)
+
+	from workers import test_worker_pool
+	run_test_unit("Worker Pool Test Unit", test_worker_pool)
+
+	from cluster import test_shared_claims
+	run_test_unit("Shared Claims Test Unit", test_shared_claims)
+
 	print("~<s:bright]~) Network & Transmission (~~<s:reset_all]")
 
 	from network import test_network_integration_and_collapsing
 	run_test_unit("Network Integration", test_network_integration_and_collapsing)
+	run_test_unit("Network Integration (Selector Engine)", (lambda: test_network_integration_and_collapsing(engine = "selector")))
+
+	from network import test_bounded_shutdown
+	run_test_unit("Bounded Shutdown", test_bounded_shutdown)
+	run_test_unit("Bounded Shutdown (Selector Engine)", (lambda: test_bounded_shutdown(engine = "selector")))
+
+	from throttling import test_throttle
+	run_test_unit("Throttling", test_throttle)
+	run_test_unit("Throttling (Selector Engine)", (lambda: test_throttle(engine = "selector")))
+
+	from backpressure import test_backpressure
+	run_test_unit("Backpressure", test_backpressure)
+	run_test_unit("Backpressure (Selector Engine)", (lambda: test_backpressure(engine = "selector")))
+
+	from sockets import test_socket_options
+	run_test_unit("Socket Options", test_socket_options)
+	run_test_unit("Socket Options (Selector Engine)", (lambda: test_socket_options(engine = "selector")))
+
+	from idle import test_idle_processor
+	run_test_unit("Idle Processor", test_idle_processor)
+	run_test_unit("Idle Processor (Selector Engine)", (lambda: test_idle_processor(engine = "selector")))
+
+	from heartbeat import test_heartbeat
+	run_test_unit("Heartbeat", test_heartbeat)
+	run_test_unit("Heartbeat (Selector Engine)", (lambda: test_heartbeat(engine = "selector")))
+
+	from logs import test_lazy_logging
+	run_test_unit("Lazy Logging", test_lazy_logging)
+
+	from metrics import test_metrics
+	run_test_unit("Metrics", test_metrics)
+
+	from tracing import test_tracing
+	run_test_unit("Tracing", test_tracing)
 
 	from transmitters import test_transmission
 	run_test_unit("Transmission in a Network", test_transmission)
+	run_test_unit("Transmission with Workers", (lambda: test_transmission(workers = 4)))
+
+	from asynchronous import test_asyncio_transmission
+	run_test_unit("Transmission with Asyncio", test_asyncio_transmission)
 
 	print("~<s:bright]~) Message Compression (~~<s:reset_all]")
 	from compression import test_compression_advantages
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+import socket
+import threading
+import time
+
+from stolas.betterui import pprint as print
+from stolas.workers import WorkerPool
+from stolas.framer import Framer
+from stolas.protocol import *
+from stolas.utils import i2b
+from common import start_model
+
+class ListLogger:
+	"""Logger keeping what was logged as exceptions."""
+	def __init__(self):
+		self.exceptions = []
+
+	def exception(self, msg, *args):
+		self.exceptions.append(msg % args)
+
+def test_worker_pool():
+	# A single worker handles the work right away, in our thread
+	handled = []
+	pool = WorkerPool(1, lambda key, value: handled.append((key, value, threading.get_ident())))
+	pool.start()
+	pool.submit(3, 3, "a")
+	assert(handled == [(3, "a", threading.get_ident())])
+	pool.stop()
+	pool.join()
+
+	# Several workers keep the order of the work of each key
+	handled = {}
+	lock = threading.Lock()
+	def handler(key, value):
+		lock.acquire()
+		handled.setdefault(key, []).append((value, threading.get_ident()))
+		lock.release()
+
+	pool = WorkerPool(4, handler, "Test")
+	pool.start()
+	for value in range(1000):
+		for key in range(10):
+			pool.submit(key, key, value)
+	pool.stop()
+	pool.join()
+	assert(sorted(handled) == list(range(10)))
+	threads = set()
+	for key in handled:
+		assert([value for value, thread in handled[key]] == list(range(1000)))
+		assert(len(set([thread for value, thread in handled[key]])) == 1)
+		threads.add(handled[key][0][1])
+	assert(len(threads) == 4)
+
+	# Work failing is logged, and the workers, or the submitting thread, go on
+	def failing(key, value):
+		if value % 2:
+			raise ValueError("Odd value")
+		handler(key, value)
+	for size in [1, 4]:
+		handled, logger = {}, ListLogger()
+		pool = WorkerPool(size, failing, "Test", logger)
+		pool.start()
+		for value in range(100):
+			pool.submit(0, 0, value)
+		pool.stop()
+		pool.join()
+		assert([value for value, thread in handled[0]] == list(range(0, 100, 2)))
+		assert(len(logger.exceptions) == 50)
+
+	# So a model keeps serving a peer sending packets it cannot handle
+	model = start_model(workers = 2)
+	sock = socket.create_connection(("127.0.0.1", model.port))
+	sock.settimeout(5)
+	while len(model.peers) == 0:
+		time.sleep(0.05)
+	framer = Framer()
+	for e in range(2):
+		sock.sendall(i2b(SHAREPEER_BYTE) + i2b(3) + b"\xff\xfe\xfd" + i2b(4242, 2) + i2b(MESSAGE_BYTE) + i2b(5, 3) + b"hello")
+		kind, item = model.imessages.get(timeout = 5)
+		while kind != "message":
+			kind, item = model.imessages.get(timeout = 5)
+		assert(item[0] == b"hello")
+		headers = []
+		while not MALFORMED_DATA in headers or not MESSAGEACK_BYTE in headers:
+			framer.feed(sock.recv(2**10))
+			headers += [frame[0] for frame in framer.frames()]
+	assert(len([thread for thread in model.pool.threads if thread.is_alive()]) == 2)
+	sock.close()
+	model.stop()
+	model.join()
+
+	print("Worker Pool ~<sf:bright,green]OK ✓~<s:reset_all]")
+	return True # We're a test unit
+
+if __name__ == "__main__":
+	test_worker_pool()